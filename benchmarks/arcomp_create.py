@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+"""Compare in-process and external binary creation of archives.
+
+A tree holding many small files is archived in each format with
+:py:meth:`snakeoil.compression.ArComp.create`, both serially and with
+parallel reads and compression, and through the external binaries (e.g.
+``tar cf`` piped to the compressor).
+
+Run from a source checkout::
+
+    PYTHONPATH=src python benchmarks/arcomp_create.py --files 5000
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from snakeoil.compression import ArComp
+from snakeoil.process import find_binary, CommandNotFound
+
+commands = {
+    '.tar': ['tar', 'cf', '{path}', '.'],
+    '.tar.gz': ['tar', 'czf', '{path}', '.'],
+    '.tar.bz2': ['tar', 'cjf', '{path}', '.'],
+    '.tar.xz': ['tar', 'cJf', '{path}', '.'],
+    '.tar.zst': ['tar', '--zstd', '-cf', '{path}', '.'],
+    '.zip': ['zip', '-qry', '{path}', '.'],
+}
+
+
+def make_tree(path, nfiles, size):
+    for i in range(nfiles):
+        name = os.path.join(path, f'dir{i % 64}', f'file{i}')
+        os.makedirs(os.path.dirname(name), exist_ok=True)
+        with open(name, 'wb') as f:
+            # half random, half compressible
+            f.write(os.urandom(size // 2) + b'\0' * (size - size // 2))
+
+
+def create_time(ext, src, path, **kwargs):
+    start = time.perf_counter()
+    if kwargs.pop('binary', False):
+        cmd = [x.format(path=path) for x in commands[ext]]
+        subprocess.run(cmd, cwd=src, check=True)
+    else:
+        ArComp(path, ext=ext).create(src, **kwargs)
+    elapsed = time.perf_counter() - start
+    os.unlink(path)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=5000, help='files in the tree')
+    parser.add_argument('--size', type=int, default=4096, help='bytes per file')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per variant, the best is used')
+    parser.add_argument(
+        '--jobs', type=int, default=None,
+        help='threads for parallel creation, defaults to the cpu count')
+    parser.add_argument(
+        '--formats', type=lambda x: x.split(','), default=list(commands),
+        help='comma separated archive extensions')
+    parser.add_argument('--dir', help='directory for scratch files')
+    options = parser.parse_args()
+
+    variants = {
+        'serial': dict(jobs=1),
+        'parallel': dict(jobs=options.jobs),
+        'binary': dict(binary=True),
+    }
+    workdir = tempfile.mkdtemp(dir=options.dir)
+    try:
+        src = os.path.join(workdir, 'src')
+        make_tree(src, options.files, options.size)
+        print(f'{"format":<10} ' + ' '.join(f'{x:>10}' for x in variants) +
+              f' {"vs serial":>10} {"vs binary":>10}')
+        for ext in options.formats:
+            path = os.path.join(workdir, f'archive{ext}')
+            times = {k: [] for k in variants}
+            try:
+                find_binary(commands[ext][0])
+            except CommandNotFound:
+                times['binary'] = None
+            # alternate variants so system noise hits all of them evenly
+            for _ in range(options.repeat):
+                for name, kwargs in variants.items():
+                    if times[name] is not None:
+                        times[name].append(create_time(ext, src, path, **kwargs))
+            times = {k: min(v) if v else None for k, v in times.items()}
+            columns = [f'{x:>9.3f}s' if x is not None else f'{"-":>10}' for x in times.values()]
+            for base in ('serial', 'binary'):
+                if times[base] is None:
+                    columns.append(f'{"-":>10}')
+                else:
+                    columns.append(f'{times[base] / times["parallel"]:>9.2f}x')
+            print(f'{ext:<10} ' + ' '.join(columns))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""Compare in-process and external binary unpacking of archives.
+
+Archives holding many small files are built for each format, then unpacked
+with :py:meth:`snakeoil.compression.ArComp.unpack` natively, both serially
+and with parallel file writes, and through the external binaries (e.g.
+``tar xf``).
+
+Run from a source checkout::
+
+    PYTHONPATH=src python benchmarks/arcomp_unpack.py --files 5000
+"""
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+
+from snakeoil.compression import ArComp, ArCompError
+
+formats = {
+    '.tar': 'w',
+    '.tar.gz': 'w:gz',
+    '.tar.bz2': 'w:bz2',
+    '.tar.xz': 'w:xz',
+    '.zip': None,
+}
+
+
+def make_archive(path, ext, nfiles, size):
+    names = [f'dir{i % 64}/file{i}' for i in range(nfiles)]
+    if ext == '.zip':
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name in names:
+                archive.writestr(name, os.urandom(size))
+        return
+    with tarfile.open(path, formats[ext]) as tar:
+        for name in names:
+            data = os.urandom(size)
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def unpack_time(arcomp, workdir, **kwargs):
+    dest = tempfile.mkdtemp(dir=workdir)
+    # flush writeback from earlier runs so it isn't billed to this one
+    os.sync()
+    start = time.perf_counter()
+    arcomp.unpack(dest, **kwargs)
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(dest)
+    return elapsed
+
+
+def best_times(arcomp, workdir, repeat, variants):
+    """best unpack time per variant, None for those that are unsupported"""
+    times = {name: [] for name in variants}
+    # alternate variants so system noise hits all of them evenly
+    for _ in range(repeat):
+        for name, kwargs in variants.items():
+            if times[name] is None:
+                continue
+            try:
+                times[name].append(unpack_time(arcomp, workdir, **kwargs))
+            except ArCompError as e:
+                sys.stderr.write(f'skipping {name} unpack: {e}\n')
+                times[name] = None
+    return {k: min(v) if v else None for k, v in times.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=5000, help='files per archive')
+    parser.add_argument('--size', type=int, default=512, help='bytes per file')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per variant, the best is used')
+    parser.add_argument(
+        '--jobs', type=int, default=None,
+        help='threads for parallel native unpacking, defaults to the cpu count')
+    parser.add_argument(
+        '--formats', type=lambda x: x.split(','), default=list(formats),
+        help='comma separated archive extensions')
+    parser.add_argument('--dir', help='directory for scratch files')
+    options = parser.parse_args()
+
+    variants = {
+        'serial': dict(native=True, jobs=1),
+        'parallel': dict(native=True, jobs=options.jobs),
+        'binary': dict(native=False),
+    }
+    workdir = tempfile.mkdtemp(dir=options.dir)
+    try:
+        print(f'{"format":<10} ' + ' '.join(f'{x:>10}' for x in variants) +
+              f' {"vs serial":>10} {"vs binary":>10}')
+        for ext in options.formats:
+            path = os.path.join(workdir, f'archive{ext}')
+            make_archive(path, ext, options.files, options.size)
+            arcomp = ArComp(path, ext=ext)
+            times = best_times(arcomp, workdir, options.repeat, variants)
+            columns = [f'{x:>9.3f}s' if x is not None else f'{"-":>10}' for x in times.values()]
+            for base in ('serial', 'binary'):
+                if times[base] is None:
+                    columns.append(f'{"-":>10}')
+                else:
+                    columns.append(f'{times[base] / times["parallel"]:>9.2f}x')
+            print(f'{ext:<10} ' + ' '.join(columns))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+"""Compare :py:func:`snakeoil.chksum.iter_chksums` against looping over get_chksums.
+
+Generates a directory of files, then times hashing all of them both ways.
+Run from a source checkout::
+
+    PYTHONPATH=src python benchmarks/chksum_batch.py --files 2000 --size 64k
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from snakeoil import chksum
+
+
+def parse_size(value):
+    units = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+    value = value.lower()
+    if value[-1] in units:
+        return int(value[:-1]) * units[value[-1]]
+    return int(value)
+
+
+def populate(path, count, size):
+    block = os.urandom(min(size, 1 << 20))
+    paths = []
+    for i in range(count):
+        fp = os.path.join(path, '%06i' % i)
+        with open(fp, 'wb') as f:
+            remaining = size
+            while remaining:
+                chunk = block[:remaining]
+                f.write(chunk)
+                remaining -= len(chunk)
+        paths.append(fp)
+    return paths
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--size', type=parse_size, default='64k')
+    parser.add_argument('--chksums', default='md5,sha1,sha256,size')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--dir', help='directory to populate (defaults to a tempdir)')
+    options = parser.parse_args()
+
+    chfs = options.chksums.split(',')
+    with tempfile.TemporaryDirectory(dir=options.dir) as path:
+        paths = populate(path, options.files, options.size)
+
+        def loop():
+            for p in paths:
+                chksum.get_chksums(p, *chfs)
+
+        def batch(processes=False):
+            for _ in chksum.iter_chksums(
+                    paths, *chfs, max_workers=options.workers, processes=processes):
+                pass
+
+        results = [
+            ('get_chksums loop', timed(loop, options.repeat)),
+            ('iter_chksums threads', timed(batch, options.repeat)),
+            ('iter_chksums processes', timed(lambda: batch(True), options.repeat)),
+        ]
+
+    total = options.files * options.size
+    print('%i files x %i bytes, chksums: %s' % (options.files, options.size, ','.join(chfs)))
+    for name, elapsed in results:
+        print('%-24s %8.3fs %10.1f MiB/s' % (name, elapsed, total / elapsed / (1 << 20)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""Compare the chksum.defaults read strategies (mmap, read, readinto).
+
+Each strategy is timed with and without per-hash threads over one file.
+Run from a source checkout::
+
+    PYTHONPATH=src python benchmarks/chksum_read_strategies.py --size 256m
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from snakeoil import chksum
+from snakeoil.chksum import defaults
+
+
+def parse_size(value):
+    units = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+    value = value.lower()
+    if value[-1] in units:
+        return int(value[:-1]) * units[value[-1]]
+    return int(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=parse_size, default='64m')
+    parser.add_argument('--chksums', default='md5,sha1,sha256,size')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--file', help='existing file to hash instead of a generated one')
+    options = parser.parse_args()
+
+    chfs = options.chksums.split(',')
+    handlers = [chksum.get_handler(k) for k in chfs]
+
+    path = options.file
+    if path is None:
+        fd, path = tempfile.mkstemp()
+        block = os.urandom(1 << 20)
+        remaining = options.size
+        while remaining:
+            remaining -= os.write(fd, block[:remaining])
+        os.close(fd)
+
+    try:
+        size = os.stat(path).st_size
+        print('%s: %i bytes, chksums: %s' % (path, size, ','.join(chfs)))
+        for strategy in defaults.read_strategies:
+            for parallelize in (False, True):
+                best = None
+                for _ in range(options.repeat):
+                    start = time.perf_counter()
+                    defaults.chksum_loop_over_file(
+                        path, [h.new() for h in handlers],
+                        parallelize=parallelize, strategy=strategy)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                print('%-9s parallelize=%-5s %8.3fs %10.1f MiB/s' % (
+                    strategy, parallelize, best, size / best / (1 << 20)))
+    finally:
+        if options.file is None:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
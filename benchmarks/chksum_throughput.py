@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+"""Throughput benchmarks for every registered chksum handler.
+
+Each handler in :py:data:`snakeoil.chksum.chksum_types` is timed on its own
+for every file size and read strategy, and all of the handlers are timed
+together with and without threads.  Results are written as json so runs can
+be compared against each other; ``--compare`` flags regressions against a
+previous run.
+
+Run from a source checkout::
+
+    PYTHONPATH=src python benchmarks/chksum_throughput.py -o results.json
+    PYTHONPATH=src python benchmarks/chksum_throughput.py --compare results.json
+
+Note that the scratch files are hashed from the page cache, so these numbers
+track cpu and syscall overhead rather than raw disk throughput.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from snakeoil import chksum, version
+from snakeoil.chksum import defaults
+
+KiB = 1 << 10
+MiB = 1 << 20
+GiB = 1 << 30
+default_sizes = (KiB, 64 * KiB, MiB, 16 * MiB, 256 * MiB, GiB)
+
+
+def parse_size(value):
+    units = {'k': KiB, 'm': MiB, 'g': GiB}
+    value = value.lower()
+    if value[-1] in units:
+        return int(value[:-1]) * units[value[-1]]
+    return int(value)
+
+
+def fill(path, size):
+    block = os.urandom(min(size, 16 * MiB))
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining:
+            remaining -= f.write(block[:remaining])
+
+
+def measure(func, size, min_time, min_runs):
+    """run func until both min_time and min_runs are satisfied"""
+    times = []
+    total = 0.0
+    while len(times) < min_runs or total < min_time:
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        times.append(elapsed)
+        total += elapsed
+    best = min(times)
+    return {
+        'runs': len(times),
+        'best_s': best,
+        'median_s': statistics.median(times),
+        'mib_per_s': size / best / MiB,
+    }
+
+
+def run(options):
+    handlers = chksum.get_handlers()
+    if options.handlers:
+        handlers = {k: handlers[k] for k in options.handlers}
+    results = []
+
+    for size in options.sizes:
+        fd, path = tempfile.mkstemp(dir=options.dir)
+        os.close(fd)
+        try:
+            fill(path, size)
+            for name, handler in sorted(handlers.items()):
+                for strategy in options.strategies:
+                    if strategy == 'mmap' and not handler.can_mmap:
+                        continue
+                    func = lambda: defaults.chksum_loop_over_file(
+                        path, [handler.new()], parallelize=False,
+                        can_mmap=handler.can_mmap, strategy=strategy)
+                    result = measure(func, size, options.min_time, options.min_runs)
+                    result.update(
+                        chksums=[name], size=size, strategy=strategy, parallelize=False)
+                    results.append(result)
+                    report(result)
+
+            names = sorted(handlers)
+            can_mmap = all(handlers[k].can_mmap for k in names)
+            for strategy in options.strategies:
+                if strategy == 'mmap' and not can_mmap:
+                    continue
+                for parallelize in (False, True):
+                    func = lambda: defaults.chksum_loop_over_file(
+                        path, [handlers[k].new() for k in names],
+                        parallelize=parallelize, can_mmap=can_mmap, strategy=strategy)
+                    result = measure(func, size, options.min_time, options.min_runs)
+                    result.update(
+                        chksums=names, size=size, strategy=strategy,
+                        parallelize=parallelize)
+                    results.append(result)
+                    report(result)
+        finally:
+            os.unlink(path)
+
+    return results
+
+
+def key(result):
+    return (','.join(result['chksums']), result['size'],
+            result['strategy'], result['parallelize'])
+
+
+def report(result, stream=sys.stderr):
+    chfs = ','.join(result['chksums'])
+    if len(chfs) > 24:
+        chfs = '%i chksums' % len(result['chksums'])
+    stream.write('%-24s %10i %-8s parallelize=%-5s %10.1f MiB/s\n' % (
+        chfs, result['size'], result['strategy'], result['parallelize'],
+        result['mib_per_s']))
+
+
+def compare(baseline, results, threshold):
+    """return results that regressed more than threshold (a fraction)"""
+    previous = {key(x): x for x in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        change = result['mib_per_s'] / old['mib_per_s'] - 1
+        if change < -threshold:
+            regressions.append((result, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--sizes', type=lambda x: [parse_size(s) for s in x.split(',')],
+        default=default_sizes, help='comma separated file sizes, e.g. 1k,1m,1g')
+    parser.add_argument(
+        '--max-size', type=parse_size, default=None,
+        help='drop any sizes larger than this')
+    parser.add_argument(
+        '--handlers', type=lambda x: x.split(','), default=None,
+        help='comma separated chksum types (defaults to all registered)')
+    parser.add_argument(
+        '--strategies', type=lambda x: x.split(','), default=defaults.read_strategies,
+        help='comma separated read strategies')
+    parser.add_argument(
+        '--min-time', type=float, default=0.5,
+        help='minimum seconds spent timing each variant')
+    parser.add_argument(
+        '--min-runs', type=int, default=3, help='minimum runs of each variant')
+    parser.add_argument('--dir', help='directory for scratch files')
+    parser.add_argument('-o', '--output', help='write json results to this file')
+    parser.add_argument('--compare', help='json results of a previous run to compare against')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1,
+        help='fractional slowdown counted as a regression (default: %(default)s)')
+    options = parser.parse_args()
+    if options.max_size is not None:
+        options.sizes = [x for x in options.sizes if x <= options.max_size]
+
+    output = {
+        'metadata': {
+            'timestamp': time.time(),
+            'python': sys.version,
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'snakeoil': version.get_version('snakeoil', __file__),
+        },
+        'results': run(options),
+    }
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, output['results'], options.threshold)
+        for result, change in regressions:
+            sys.stderr.write('regression: %+.1f%% ' % (change * 100))
+            report(result)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
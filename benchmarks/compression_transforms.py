@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""Compare the compression transforms against their external binaries.
+
+For every format registered in :py:data:`snakeoil.compression._transforms`,
+data is compressed and decompressed serially and in parallel in-process,
+and through the external binary (piping data through it) when available.
+
+Run from a source checkout::
+
+    PYTHONPATH=src python benchmarks/compression_transforms.py --size 64m
+"""
+
+import argparse
+import os
+import time
+
+from snakeoil import compression
+from snakeoil.compression import _util
+from snakeoil.process import find_binary, CommandNotFound
+
+# external binaries tried for each format, in order of preference
+binaries = {
+    'bzip2': ('lbzip2', 'pbzip2', 'bzip2'),
+    'gzip': ('pigz', 'gzip'),
+    'xz': ('pixz', 'xz'),
+    'zstd': ('zstd',),
+}
+
+
+def parse_size(value):
+    units = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+    value = value.lower()
+    if value[-1] in units:
+        return int(value[:-1]) * units[value[-1]]
+    return int(value)
+
+
+def sample_data(size):
+    # mix of incompressible and highly repetitive chunks, roughly
+    # approximating a tarball of source files
+    chunk = os.urandom(4096) + b'snakeoil ' * 1365
+    return (chunk * (size // len(chunk) + 1))[:size]
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def find_first(names):
+    for name in names:
+        try:
+            return find_binary(name)
+        except CommandNotFound:
+            continue
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=parse_size, default=parse_size('32m'),
+                        help='bytes of sample data')
+    parser.add_argument('--level', type=int, default=6, help='compression level')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per variant, the best is used')
+    parser.add_argument(
+        '--formats', type=lambda x: x.split(','), default=sorted(compression._transforms),
+        help='comma separated formats')
+    options = parser.parse_args()
+
+    data = sample_data(options.size)
+    mib = len(data) / (1 << 20)
+    print(f'{"format":<7} {"variant":<16} {"ratio":>6} {"compress":>14} {"decompress":>14}')
+
+    for fmt in options.formats:
+        variants = [
+            ('serial', False),
+            ('parallel', True),
+        ]
+        for name, parallelize in variants:
+            ctime, compressed = best_time(
+                lambda: compression.compress_data(
+                    fmt, data, options.level, parallelize=parallelize),
+                options.repeat)
+            dtime, _ = best_time(
+                lambda: compression.decompress_data(fmt, compressed, parallelize=parallelize),
+                options.repeat)
+            report(fmt, name, len(compressed) / len(data), mib / ctime, mib / dtime)
+
+        binary = find_first(binaries.get(fmt, ()))
+        if binary is None:
+            print(f'{fmt:<7} {"binary":<16} missing')
+            continue
+        ctime, compressed = best_time(
+            lambda: _util.compress_data(binary, data, compresslevel=options.level),
+            options.repeat)
+        dtime, _ = best_time(
+            lambda: _util.decompress_data(binary, compressed), options.repeat)
+        report(fmt, os.path.basename(binary), len(compressed) / len(data),
+               mib / ctime, mib / dtime)
+
+
+def report(fmt, variant, ratio, compress, decompress):
+    print(f'{fmt:<7} {variant:<16} {ratio:>6.3f} '
+          f'{compress:>8.1f} MiB/s {decompress:>8.1f} MiB/s')
+
+
+if __name__ == '__main__':
+    main()
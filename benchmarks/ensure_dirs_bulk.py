@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+"""Compare ensure_dirs_bulk with a loop over ensure_dirs.
+
+Directory layouts resembling installed packages (many leaves sharing deep
+prefixes) are created from scratch, and then ensured again once they all
+exist, via a loop over :py:func:`snakeoil.osutils.ensure_dirs` and via
+:py:func:`snakeoil.osutils.ensure_dirs_bulk` at varying thread counts.
+
+Run from a source checkout::
+
+    PYTHONPATH=src python benchmarks/ensure_dirs_bulk.py --dirs 100000
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from snakeoil import osutils
+
+
+def make_paths(root, count, fanout):
+    paths = []
+    for i in range(count):
+        parts = []
+        n = i
+        for _ in range(4):
+            parts.append(f'd{n % fanout}')
+            n //= fanout
+        paths.append(os.path.join(root, 'usr', 'share', *parts, f'leaf{i}'))
+    return paths
+
+
+def loop(paths, jobs):
+    for path in paths:
+        osutils.ensure_dirs(path, mode=0o755)
+
+
+def bulk(paths, jobs):
+    osutils.ensure_dirs_bulk(paths, mode=0o755, jobs=jobs)
+
+
+def timed(func, paths, jobs):
+    start = time.perf_counter()
+    func(paths, jobs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dirs', type=int, default=20000, help='leaf directories to create')
+    parser.add_argument('--fanout', type=int, default=8, help='subdirectories per level')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per variant, the best is used')
+    parser.add_argument(
+        '--jobs', type=lambda x: [int(y) for y in x.split(',')], default=[1, 4],
+        help='comma separated thread counts for the bulk variant')
+    parser.add_argument('--dir', help='directory for scratch files')
+    options = parser.parse_args()
+
+    variants = {'loop': (loop, 1)}
+    for jobs in options.jobs:
+        variants[f'bulk jobs={jobs}'] = (bulk, jobs)
+
+    workdir = tempfile.mkdtemp(dir=options.dir)
+    try:
+        results = {name: ([], []) for name in variants}
+        for _ in range(options.repeat):
+            for name, (func, jobs) in variants.items():
+                root = tempfile.mkdtemp(dir=workdir)
+                paths = make_paths(root, options.dirs, options.fanout)
+                results[name][0].append(timed(func, paths, jobs))
+                results[name][1].append(timed(func, paths, jobs))
+                shutil.rmtree(root)
+        print(f'{"variant":<14} {"create":>9} {"existing":>9}')
+        base = [min(x) for x in results['loop']]
+        for name, (create, existing) in results.items():
+            create, existing = min(create), min(existing)
+            print(f'{name:<14} {create:>8.3f}s {existing:>8.3f}s'
+                  f'  ({base[0] / create:.2f}x, {base[1] / existing:.2f}x)')
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
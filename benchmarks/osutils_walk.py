@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""Compare os.walk with the parallel snakeoil.osutils.walk.
+
+A tree is generated (or an existing one given via --tree) and walked with
+:py:func:`os.walk` and :py:func:`snakeoil.osutils.walk` at varying thread
+counts.  Page cache effects dominate on local filesystems, so for realistic
+NFS numbers point --tree at a tree on an NFS mount and drop caches between
+runs, or use --latency to simulate a round trip per directory scan.
+
+Run from a source checkout::
+
+    PYTHONPATH=src python benchmarks/osutils_walk.py --entries 500000
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from snakeoil import osutils
+
+
+def make_tree(path, entries, fanout):
+    """create a tree of roughly `entries` files and directories"""
+    dirs = [path]
+    created = 0
+    while created < entries:
+        parent = dirs.pop(0)
+        for i in range(fanout):
+            sub = os.path.join(parent, f'd{i}')
+            os.mkdir(sub)
+            dirs.append(sub)
+            for j in range(fanout):
+                open(os.path.join(sub, f'f{j}'), 'w').close()
+            created += fanout + 1
+
+
+def walk_time(func, path):
+    start = time.perf_counter()
+    count = 0
+    for _, dirs, files in func(path):
+        count += len(dirs) + len(files)
+    return time.perf_counter() - start, count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=100000, help='entries in the generated tree')
+    parser.add_argument('--fanout', type=int, default=16, help='subdirectories and files per directory')
+    parser.add_argument('--tree', help='walk an existing tree instead')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per variant, the best is used')
+    parser.add_argument(
+        '--jobs', type=lambda x: [int(y) for y in x.split(',')], default=[1, 4, 16],
+        help='comma separated thread counts')
+    parser.add_argument(
+        '--latency', type=float, default=0,
+        help='simulated seconds of latency added to each directory scan')
+    parser.add_argument('--dir', help='directory for scratch files')
+    options = parser.parse_args()
+
+    if options.latency:
+        # os.walk and osutils.walk both look scandir up on the os module
+        scandir = os.scandir
+
+        def slow_scandir(path):
+            time.sleep(options.latency)
+            return scandir(path)
+        os.scandir = slow_scandir
+
+    variants = {'os.walk': os.walk}
+    for jobs in options.jobs:
+        variants[f'jobs={jobs}'] = lambda path, jobs=jobs: osutils.walk(path, jobs=jobs)
+
+    workdir = None
+    try:
+        if options.tree:
+            path = options.tree
+        else:
+            workdir = tempfile.mkdtemp(dir=options.dir)
+            path = workdir
+            make_tree(path, options.entries, options.fanout)
+        times = {name: [] for name in variants}
+        # alternate variants so system noise hits all of them evenly
+        for _ in range(options.repeat):
+            for name, func in variants.items():
+                elapsed, count = walk_time(func, path)
+                times[name].append(elapsed)
+        print(f'{count} entries')
+        base = min(times['os.walk'])
+        for name, results in times.items():
+            best = min(results)
+            print(f'{name:<10} {best:>9.3f}s {base / best:>7.2f}x')
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
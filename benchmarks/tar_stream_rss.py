@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+"""Compare peak memory usage of iterating over large tarballs.
+
+A tarball of empty files is generated for each member count, then iterated
+over (optionally extracting every member) in a fresh interpreter with both
+:py:class:`tarfile.TarFile` and :py:class:`snakeoil.tar.StreamingTarFile`,
+reporting the peak RSS of each.
+
+Run from a source checkout::
+
+    PYTHONPATH=src python benchmarks/tar_stream_rss.py --members 10000,100000,1000000
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+# Peak RSS is read from VmHWM where available since on Linux ru_maxrss
+# carries over the parent's peak across fork and exec.
+child = '''
+import resource, sys, tarfile
+from snakeoil import tar
+cls = tar.StreamingTarFile if sys.argv[1] == 'streaming' else tarfile.TarFile
+with cls.open(sys.argv[2], 'r|gz') as archive:
+    for member in archive:
+        if len(sys.argv) > 3:
+            archive.extract(member, sys.argv[3])
+try:
+    with open('/proc/self/status') as f:
+        print(next(int(x.split()[1]) for x in f if x.startswith('VmHWM:')))
+except (OSError, StopIteration):
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def make_archive(path, members):
+    with tarfile.open(path, 'w:gz', compresslevel=1) as tar:
+        for i in range(members):
+            tar.addfile(tarfile.TarInfo(f'dir{i % 1000}/file{i}'))
+
+
+def peak_rss(variant, path, dest=None):
+    """peak RSS in KiB of iterating over a tarball in a fresh interpreter"""
+    args = [sys.executable, '-c', child, variant, path]
+    if dest is not None:
+        args.append(dest)
+    return int(subprocess.run(
+        args, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--members', type=lambda x: [int(y) for y in x.split(',')],
+        default=[10000, 100000, 500000], help='comma separated member counts')
+    parser.add_argument('--extract', action='store_true', help='extract members while iterating')
+    parser.add_argument('--dir', help='directory for scratch files')
+    options = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(dir=options.dir)
+    try:
+        print(f'{"members":>10} {"tarfile":>12} {"streaming":>12}')
+        for members in options.members:
+            path = os.path.join(workdir, 'archive.tar.gz')
+            make_archive(path, members)
+            results = []
+            for variant in ('tarfile', 'streaming'):
+                dest = None
+                if options.extract:
+                    dest = tempfile.mkdtemp(dir=workdir)
+                results.append(peak_rss(variant, path, dest))
+                if dest is not None:
+                    shutil.rmtree(dest)
+            print(f'{members:>10} ' + ' '.join(f'{x / 1024:>9.1f}MiB' for x in results))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
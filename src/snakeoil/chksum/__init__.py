@@ -2,36 +2,53 @@
 chksum verification/generation subsystem
 """
 
+from concurrent import futures
 from importlib import import_module
+from multiprocessing import cpu_count
 import os
 import sys
 
 from .. import osutils, klass
+from ..data_source import local_source
+from . import defaults
 from .defaults import chksum_loop_over_file
 
 
 chksum_types = {}
 __inited__ = False
+_cache = None
+_process_pool = None
 
 
 class MissingChksumHandler(Exception):
     """A requested checksum handler doesn't exist on the system."""
 
 
+def _get_handler(requested):
+    if not __inited__:
+        init()
+    if requested not in chksum_types:
+        raise MissingChksumHandler("no handler for %s" % requested)
+    return chksum_types[requested]
+
+
 def get_handler(requested):
 
     """
     get a chksum handler
 
+    If a cache was registered via :py:func:`set_cache`, the handler returned
+    consults it for file paths.
+
     :raise MissingChksumHandler: if chksum type has no registered handler
     :return: chksum handler (callable)
     """
 
-    if not __inited__:
-        init()
-    if requested not in chksum_types:
-        raise MissingChksumHandler("no handler for %s" % requested)
-    return chksum_types[requested]
+    handler = _get_handler(requested)
+    if _cache is not None:
+        from .cache import CachedChksummer
+        return CachedChksummer(handler, _cache)
+    return handler
 
 
 def get_handlers(requested=None):
@@ -98,17 +115,36 @@ def init(additional_handlers=None):
     __inited__ = True
 
 
+def set_cache(cache):
+    """
+    register a persistent chksum cache consulted for file paths
+
+    :param cache: a :py:class:`snakeoil.chksum.cache.ChksumCache` instance, or
+        None to disable caching
+    """
+
+    global _cache # pylint: disable=global-statement
+    _cache = cache
+
+
 def get_chksums(location, *chksums, **kwds):
     """
     run multiple chksumers over a data_source/file path
 
     Note that if you need multiple chksums for a file, you should invoke this with
     all desired chksums- the implementation will do some internal efficiency tricks
-    (doing the IO once for example).
+    (doing the IO once for example).  Handlers that hold the GIL are spread
+    across a shared process pool when parallelizing.
+
+    If a cache was registered via :py:func:`set_cache`, results for file paths
+    are pulled from and stored in it.
 
     :param location: either a data_source, or a filepath to generate chksum data for
     :param chksums: variable arg, the name of the chksums desired.  These need to
         be valid chksums known in `chksum_types`
+    :keyword checkpoint: a :py:class:`snakeoil.chksum.checkpoint.ChksumCheckpoint`
+        instance; only data appended to the file since the checkpoint was
+        last advanced is hashed.  Requires `location` to be a file path.
     :return: a list of chksums, matching the order of requested chksums
     """
 
@@ -116,19 +152,142 @@ def get_chksums(location, *chksums, **kwds):
         # dumb api invocation...
         return []
 
-    handlers = get_handlers(chksums)
+    checkpoint = kwds.get("checkpoint")
+    if checkpoint is not None:
+        return checkpoint.get_chksums(
+            location, chksums, blocksize=kwds.get("blocksize"))
+
+    if _cache is not None and isinstance(location, str):
+        return _cache.get_chksums(
+            location, chksums, lambda missing: _get_chksums(location, missing, kwds))
+    return _get_chksums(location, chksums, kwds)
+
+
+def _get_chksums(location, chksums, kwds):
+    handlers = {k: _get_handler(k) for k in chksums}
     # try to hand off to the per file handler, may be faster.
     if len(chksums) == 1:
         return [handlers[chksums[0]](location)]
-    if len(chksums) == 2 and 'size' in chksums:
-        parallelize = False
-    else:
-        parallelize = kwds.get("parallelize", True)
     can_mmap = True
     for k in chksums:
         can_mmap &= handlers[k].can_mmap
-    return chksum_loop_over_file(location, [handlers[k].new() for k in chksums],
-                                 parallelize=parallelize, can_mmap=can_mmap)
+    # size is just a counter, it doesn't warrant a thread of its own.
+    nhashes = len([k for k in chksums if k != 'size'])
+    choice = defaults.selector.select_for(location, nhashes, can_mmap)
+    parallelize = choice.parallelize and kwds.get("parallelize", True)
+
+    # only plain files can be handed to other processes by path; other data
+    # sources, e.g. compressed ones, transform the file they're backed by.
+    path = location
+    if isinstance(location, local_source):
+        path = location.path
+    gil_bound = [k for k in chksums if not handlers[k].releases_gil]
+    if parallelize and gil_bound and isinstance(path, str):
+        return _process_chksums(path, chksums, gil_bound, kwds)
+
+    return chksum_loop_over_file(
+        location, [handlers[k].new() for k in chksums],
+        parallelize=parallelize, can_mmap=can_mmap, strategy=kwds.get("strategy", choice.strategy),
+        blocksize=kwds.get("blocksize", choice.blocksize))
+
+
+def _get_process_pool():
+    global _process_pool # pylint: disable=global-statement
+    # pools don't survive fork, children get their own.
+    if _process_pool is None or _process_pool[0] != os.getpid():
+        _process_pool = (os.getpid(), futures.ProcessPoolExecutor(cpu_count()))
+    return _process_pool[1]
+
+
+def _process_chksums(path, chksums, gil_bound, kwds):
+    # each GIL bound hash gets a process of its own, only the path and the
+    # resulting long cross the process boundary; the rest are threaded here
+    # in the meantime.
+    pool = _get_process_pool()
+    jobs = {k: pool.submit(_chksum_worker, path, (k,)) for k in gil_bound}
+    rest = [k for k in chksums if k not in jobs]
+    results = dict(zip(rest, _get_chksums(path, rest, kwds))) if rest else {}
+    results.update((k, fut.result()[0]) for k, fut in jobs.items())
+    return [results[k] for k in chksums]
+
+
+def _chksum_worker(location, chksums):
+    # module level so process pools can pickle it; threads are only used
+    # across files here, never per file.
+    return get_chksums(location, *chksums, parallelize=False)
+
+
+def _seek_order_key(location):
+    # approximate on-disk order via (device, inode); unstatable paths are
+    # pushed to the end and left for the worker to raise on.
+    try:
+        st = os.stat(location)
+    except EnvironmentError:
+        return (1, 0, 0)
+    return (0, st.st_dev, st.st_ino)
+
+
+def iter_chksums(locations, *chksums, max_workers=None, processes=None,
+                 sort_reads=True):
+    """
+    run multiple chksumers over many file paths using a shared worker pool
+
+    Unlike looping over :py:func:`get_chksums`, the workers are created once
+    and reused for every file; each worker hashes a whole file at a time so
+    no per file threads are spawned.
+
+    :param locations: iterable of file paths to generate chksum data for
+    :param chksums: variable arg, the name of the chksums desired.  These need to
+        be valid chksums known in `chksum_types`
+    :param max_workers: size of the worker pool, defaults to the cpu count
+    :param processes: if True, use a process pool instead of a thread pool;
+        only file paths and the resulting integers cross the process boundary.
+        Defaults to using processes if any requested handler holds the GIL.
+    :param sort_reads: if True, files are submitted in (device, inode) order
+        to keep disk seeks down
+    :raise MissingChksumHandler: if requested chksum type has no registered handler
+    :return: iterator of (location, chksums) tuples in completion order, chksums
+        being a list matching the order of requested chksums
+    """
+
+    if not chksums:
+        return
+    # validate up front rather than once per file in the workers.
+    handlers = get_handlers(chksums)
+    if processes is None:
+        processes = not all(h.releases_gil for h in handlers.values())
+
+    locations = list(locations)
+    if sort_reads:
+        locations.sort(key=_seek_order_key)
+    if max_workers is None:
+        max_workers = cpu_count()
+    if processes:
+        executor = futures.ProcessPoolExecutor(max_workers)
+    else:
+        executor = futures.ThreadPoolExecutor(max_workers)
+
+    # bound the number of queued jobs so results don't pile up if the
+    # consumer is slower than the pool.
+    window = max_workers * 4
+    pending = {}
+    locations = iter(locations)
+    try:
+        while True:
+            for location in locations:
+                fut = executor.submit(_chksum_worker, location, chksums)
+                pending[fut] = location
+                if len(pending) >= window:
+                    break
+            if not pending:
+                break
+            done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for fut in done:
+                yield pending.pop(fut), fut.result()
+    finally:
+        for fut in pending:
+            fut.cancel()
+        executor.shutdown(wait=True)
 
 
 class LazilyHashedPath(metaclass=klass.immutable_instance):
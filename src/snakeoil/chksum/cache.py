@@ -0,0 +1,223 @@
+"""
+persistent on disk chksum cache
+
+Results are keyed on the stat identity of a file- (st_dev, st_ino, st_size,
+st_mtime_ns)- so an unchanged file is never rehashed across runs, while any
+modification (or replacement) of the file results in a cache miss.
+
+The store is a small sqlite database; sqlite's own locking makes it safe to
+share between multiple processes.
+
+Usage is opt in:
+
+>>> from snakeoil import chksum
+>>> from snakeoil.chksum.cache import ChksumCache
+>>> chksum.set_cache(ChksumCache('/var/cache/chksums.db'))  # doctest: +SKIP
+"""
+
+__all__ = ("ChksumCache", "CachedChksummer")
+
+import os
+import sqlite3
+import threading
+import time
+
+from ..klass import GetAttrProxy
+
+
+class ChksumCache:
+    """sqlite backed chksum store keyed on file stat identity
+
+    Eviction is size based: once the live data in the database exceeds
+    `max_size` bytes, the oldest quarter of the entries (by insertion time)
+    is dropped.  Lookups never write, so hits stay cheap even with many
+    processes sharing the store.
+
+    Files modified within the last :py:attr:`racy_window` seconds aren't
+    cached, since they could be rewritten within the filesystem's mtime
+    granularity without their stat identity changing.
+    """
+
+    racy_window = 2.0
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS chksums (
+            dev INTEGER NOT NULL,
+            ino INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            value TEXT NOT NULL,
+            ctime REAL NOT NULL,
+            PRIMARY KEY (dev, ino, size, mtime_ns, type)
+        );
+        CREATE INDEX IF NOT EXISTS chksums_ctime ON chksums (ctime);
+    """
+
+    # how many inserts between checks of the database size
+    _evict_check_interval = 256
+
+    def __init__(self, path, max_size=64 * 1024 * 1024, timeout=30):
+        """
+        :param path: file path of the database, created if missing
+        :param max_size: upper bound on the live data in the database, in bytes
+        :param timeout: seconds to wait on a database locked by another process
+        """
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._pid = None
+        self._connect()
+
+    def _connect(self):
+        # connections are shared between threads, all access is serialized
+        # through self._lock.
+        self._conn = sqlite3.connect(
+            self.path, timeout=self.timeout, isolation_level=None,
+            check_same_thread=False)
+        self._pid = os.getpid()
+        try:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.DatabaseError:
+            # WAL isn't supported on all filesystems, notably NFS.
+            pass
+        self._conn.executescript(self._schema)
+
+    @property
+    def conn(self):
+        # sqlite connections can't be carried across fork(), so forked
+        # children (process pools for example) open their own.
+        if self._pid != os.getpid():
+            self._lock = threading.Lock()
+            self._connect()
+        return self._conn
+
+    @staticmethod
+    def _key(st):
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self, st, chksums):
+        """get any cached chksums for a file
+
+        :param st: stat result of the file
+        :param chksums: sequence of chksum names
+        :return: dict of chksum name to long for all cached chksums
+        """
+        conn = self.conn
+        with self._lock:
+            rows = conn.execute(
+                'SELECT type, value FROM chksums WHERE '
+                'dev=? AND ino=? AND size=? AND mtime_ns=?', self._key(st)).fetchall()
+        chksums = frozenset(chksums)
+        return {k: int(v, 16) for k, v in rows if k in chksums}
+
+    def update(self, st, values):
+        """store chksums for a file
+
+        Any entries for older incarnations of the same inode are dropped.
+
+        :param st: stat result of the file, taken before hashing it
+        :param values: dict of chksum name to long
+        """
+        key = self._key(st)
+        now = time.time()
+        conn = self.conn
+        with self._lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    'DELETE FROM chksums WHERE dev=? AND ino=? AND '
+                    '(size!=? OR mtime_ns!=?)', key)
+                self._inserts += len(values)
+                if self._inserts >= self._evict_check_interval:
+                    self._inserts = 0
+                    self._evict()
+                conn.executemany(
+                    'INSERT OR REPLACE INTO chksums VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [key + (k, '%x' % v, now) for k, v in values.items()])
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def _live_size(self):
+        conn = self._conn
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        return (page_count - free) * page_size
+
+    def _evict(self):
+        # freed pages are reused by later inserts, so only live pages count.
+        if self._live_size() <= self.max_size:
+            return
+        count = self._conn.execute('SELECT COUNT(*) FROM chksums').fetchone()[0]
+        if not count:
+            return
+        self._conn.execute(
+            'DELETE FROM chksums WHERE rowid IN '
+            '(SELECT rowid FROM chksums ORDER BY ctime LIMIT ?)',
+            (max(count // 4, 1),))
+
+    def get_chksums(self, location, chksums, compute):
+        """return chksums for a file path, computing and storing any misses
+
+        :param location: file path
+        :param chksums: sequence of chksum names
+        :param compute: callable taking a sequence of chksum names and
+            returning a list of longs for them, used for cache misses
+        :return: list of longs matching the order of `chksums`
+        """
+        try:
+            st = os.stat(location)
+        except EnvironmentError:
+            # let the handlers deal with (or raise on) missing files.
+            return compute(chksums)
+        found = self.get(st, chksums)
+        missing = [k for k in chksums if k not in found]
+        if missing:
+            values = dict(zip(missing, compute(missing)))
+            # don't store results for a file that changed under us, or that
+            # could still change without its stat identity changing.
+            try:
+                unchanged = self._key(os.stat(location)) == self._key(st)
+            except EnvironmentError:
+                unchanged = False
+            if unchanged and time.time() - st.st_mtime > self.racy_window:
+                self.update(st, values)
+            found.update(values)
+        return [found[k] for k in chksums]
+
+    def clear(self):
+        """drop all cached entries"""
+        conn = self.conn
+        with self._lock:
+            conn.execute('DELETE FROM chksums')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedChksummer:
+    """chksum handler proxy that consults a :py:class:`ChksumCache` for paths"""
+
+    __slots__ = ("handler", "cache")
+
+    def __init__(self, handler, cache):
+        self.handler = handler
+        self.cache = cache
+
+    def __call__(self, location):
+        if not isinstance(location, str):
+            return self.handler(location)
+        return self.cache.get_chksums(
+            location, (self.handler.chf_type,),
+            lambda chksums: [self.handler(location)])[0]
+
+    __getattr__ = GetAttrProxy("handler")
+
+    def __str__(self):
+        return str(self.handler)
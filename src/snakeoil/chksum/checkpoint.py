@@ -0,0 +1,112 @@
+"""
+resumable chksum state for files that only grow
+
+Intended for partially downloaded files; rather than rehashing from byte 0
+on every resume, a :py:class:`ChksumCheckpoint` remembers the hash state
+along with how far into the file it got, and only the newly appended data
+is hashed on the next run.
+
+>>> from snakeoil import chksum
+>>> from snakeoil.chksum.checkpoint import ChksumCheckpoint
+>>> checkpoint = ChksumCheckpoint(('sha512', 'size'))
+>>> chksum.get_chksums('/tmp/partial', 'sha512', 'size', checkpoint=checkpoint)  # doctest: +SKIP
+"""
+
+__all__ = ("ChksumCheckpoint",)
+
+import os
+import pickle
+
+from . import defaults
+
+
+class ChksumCheckpoint:
+    """Hash state plus the byte offset it covers.
+
+    Note that only the file identity (device and inode) and size are checked
+    before resuming; it's up to the caller to ensure the file was only
+    appended to since the checkpoint was taken.  If the file was replaced or
+    shrank, hashing transparently restarts from the beginning.
+
+    Checkpoints can be pickled to persist them across runs; this only keeps
+    the state if every hash backend supports serializing it (hashlib objects
+    for example don't), otherwise the unpickled checkpoint starts over from
+    byte 0.
+
+    :ivar offset: number of bytes the hash state covers
+    """
+
+    def __init__(self, chksum_types):
+        """
+        :param chksum_types: sequence of chksum types to track
+        """
+        self.chksum_types = tuple(chksum_types)
+        self.reset()
+
+    def reset(self):
+        """drop all hash state, restarting from the beginning of the file"""
+        # delayed import; this module is loaded during chksum.init()
+        from . import _get_handler
+        self.hashers = [_get_handler(k).new()() for k in self.chksum_types]
+        self.offset = 0
+        self.identity = None
+
+    def get_chksums(self, location, chksums, blocksize=None):
+        """hash any data appended since the last call, advancing the checkpoint
+
+        :param location: file path
+        :param chksums: sequence of chksum types, a subset of those tracked
+        :param blocksize: size of the chunks read
+        :return: list of chksums for the entire file, matching the order of
+            `chksums`
+        """
+        missing = set(chksums).difference(self.chksum_types)
+        if missing:
+            raise ValueError(
+                "checkpoint doesn't track: %s" % ', '.join(sorted(missing)))
+        if not isinstance(location, str):
+            raise TypeError("checkpoints only support file paths: %r" % (location,))
+        if blocksize is None:
+            blocksize = defaults.blocksize
+
+        with open(location, 'rb', buffering=0) as f:
+            st = os.fstat(f.fileno())
+            identity = (st.st_dev, st.st_ino)
+            if identity != self.identity or st.st_size < self.offset:
+                self.reset()
+                self.identity = identity
+            f.seek(self.offset)
+            for data in defaults._readinto_iter(f, blocksize):
+                for hasher in self.hashers:
+                    hasher.update(data)
+                self.offset += len(data)
+
+        values = {}
+        for k, hasher in zip(self.chksum_types, self.hashers):
+            # digest copies where possible; some backends refuse updates
+            # once a digest was taken.
+            if hasattr(hasher, 'copy'):
+                hasher = hasher.copy()
+            values[k] = int(hasher.hexdigest(), 16)
+        return [values[k] for k in chksums]
+
+    def __getstate__(self):
+        try:
+            hashers = pickle.dumps(self.hashers)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return {'chksum_types': self.chksum_types}
+        return {
+            'chksum_types': self.chksum_types,
+            'hashers': hashers,
+            'offset': self.offset,
+            'identity': self.identity,
+        }
+
+    def __setstate__(self, state):
+        self.chksum_types = state['chksum_types']
+        if 'hashers' not in state:
+            self.reset()
+            return
+        self.hashers = pickle.loads(state['hashers'])
+        self.offset = state['offset']
+        self.identity = state['identity']
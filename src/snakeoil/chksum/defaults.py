@@ -6,15 +6,22 @@ for chksum implementations, while also preferring the fastest implementation
 available.
 """
 
+from contextlib import contextmanager
 from functools import partial
 import hashlib
+import io
+import json
+import mmap
 from multiprocessing import cpu_count
 import os
 import queue
 from sys import intern
+import tempfile
 import threading
+import time
 
 from .. import modules
+from ..sequences import namedtuple
 from ..data_source import base as base_data_source
 from ..fileutils import mmap_or_open_for_read
 
@@ -32,6 +39,11 @@ blake2b_size = 128
 blake2s_size = 64
 
 
+def _default_blocksize():
+    # resolved at call time so the module level default stays tweakable.
+    return blocksize
+
+
 def chf_thread(queue, callback):
     qget = queue.get
     data = qget()
@@ -40,22 +52,65 @@ def chf_thread(queue, callback):
         data = qget()
 
 
-def chksum_loop_over_file(filename, chfs, parallelize=True, can_mmap=True):
+def chksum_loop_over_file(filename, chfs, parallelize=True, can_mmap=True,
+                          strategy=None, blocksize=None):
+    if parallelize and len(chfs) > 1 and cpu_count() > 1:
+        return hashing_executor.chksum_loop_over_file(
+            filename, chfs, can_mmap=can_mmap, strategy=strategy,
+            blocksize=blocksize)
     chfs = [chf() for chf in chfs]
     loop_over_file(
         filename, [chf.update for chf in chfs],
-        parallelize=parallelize, can_mmap=can_mmap)
+        parallelize=False, can_mmap=can_mmap, strategy=strategy,
+        blocksize=blocksize)
     return [int(chf.hexdigest(), 16) for chf in chfs]
 
 
-def loop_over_file(handle, callbacks, parallelize=True, can_mmap=True):
+# supported ways of feeding file data to the callbacks:
+# - mmap: map the file, handing the whole mapping to each callback at once.
+# - read: read blocksize chunks, allocating a new bytes object per chunk.
+# - readinto: fill preallocated buffers, so the loop itself doesn't allocate.
+read_strategies = ('mmap', 'read', 'readinto')
+
+
+def _resolve_strategy(strategy, can_mmap):
+    if strategy is None:
+        return 'mmap' if can_mmap else 'read'
+    elif strategy not in read_strategies:
+        raise ValueError("unknown read strategy: %r" % (strategy,))
+    elif strategy == 'mmap' and not can_mmap:
+        return 'read'
+    return strategy
+
+
+def _advise_sequential(f=None, m=None):
+    # purely a hint to the kernel to read ahead aggressively; failures and
+    # platforms lacking support are ignored.
+    try:
+        if m is not None:
+            m.madvise(mmap.MADV_SEQUENTIAL)
+        else:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    except (AttributeError, EnvironmentError, ValueError, io.UnsupportedOperation):
+        pass
+
+
+@contextmanager
+def _open_for_loop(handle, strategy):
+    """yield a (mmap, file object) pair for a path, data_source, or file object
+
+    Exactly one of the pair is not None.
+    """
     m = None
     close_f = True
     if isinstance(handle, str):
-        if can_mmap:
+        if strategy == 'mmap':
             m, f = mmap_or_open_for_read(handle)
         else:
-            f = open(handle, "rb")
+            # readinto goes straight to the raw file, skipping the copy
+            # through the BufferedReader's internal buffer.
+            f = open(handle, "rb", buffering=0 if strategy == 'readinto' else -1)
+        _advise_sequential(f, m)
     elif isinstance(handle, base_data_source):
         f = handle.bytes_fileobj()
     else:
@@ -68,58 +123,496 @@ def loop_over_file(handle, callbacks, parallelize=True, can_mmap=True):
         # the encoding bypass during py3k
         f.seek(0, 0)
 
+    try:
+        yield m, f
+    finally:
+        if m is not None:
+            m.close()
+        elif f is not None and close_f:
+            f.close()
+
+
+def _uses_readinto(m, f, strategy):
+    return (strategy == 'readinto' and m is None and
+            hasattr(f, 'readinto') and not hasattr(f, 'getvalue'))
+
+
+def _iter_chunks(m, f, strategy, blocksize):
+    if m is not None:
+        return (m,)
+    if hasattr(f, 'getvalue'):
+        data = f.getvalue()
+        if not isinstance(data, bytes):
+            data = data.encode()
+        return (data,)
+    if _uses_readinto(m, f, strategy):
+        return _readinto_iter(f, blocksize)
+    return _read_iter(f, blocksize)
+
+
+def loop_over_file(handle, callbacks, parallelize=True, can_mmap=True,
+                   strategy=None, blocksize=None):
+    """feed the contents of a file to a set of callbacks
+
+    :param handle: file path, data_source, or file object
+    :param callbacks: sequence of callables each invoked with every chunk of data
+    :param parallelize: if True, run each callback in its own thread
+    :param can_mmap: whether the callbacks accept mmap objects
+    :param strategy: one of :py:data:`read_strategies`; defaults to mmap
+        if possible, read otherwise.  Note that with readinto, callbacks are
+        handed memoryviews of buffers that are reused once they return.
+    :param blocksize: size of the chunks read, defaults to :py:data:`blocksize`
+    """
+    strategy = _resolve_strategy(strategy, can_mmap)
+    if blocksize is None:
+        blocksize = _default_blocksize()
     parallelize = parallelize and len(callbacks) > 1 and cpu_count() > 1
-    threads, queues = [], []
 
+    with _open_for_loop(handle, strategy) as (m, f):
+        if not parallelize:
+            for data in _iter_chunks(m, f, strategy, blocksize):
+                for callback in callbacks:
+                    callback(data)
+        elif _uses_readinto(m, f, strategy):
+            _parallel_readinto(f, callbacks, blocksize)
+        else:
+            _parallel_loop(_iter_chunks(m, f, strategy, blocksize), callbacks)
+
+
+def _parallel_loop(chunks, callbacks):
+    queues = [queue.Queue(8) for _ in callbacks]
+    threads = [threading.Thread(target=chf_thread, args=(queue, functor))
+               for queue, functor in zip(queues, callbacks)]
+    for thread in threads:
+        thread.start()
     try:
-        if parallelize:
-            queues = [queue.Queue(8) for _ in callbacks]
+        for data in chunks:
+            for q in queues:
+                q.put(data)
+    finally:
+        for q in queues:
+            q.put(None)
+        for thread in threads:
+            thread.join()
 
-            threads = [threading.Thread(target=chf_thread, args=(queue, functor))
-                       for queue, functor in zip(queues, callbacks)]
 
-            for thread in threads:
-                thread.start()
+def _read_iter(f, blocksize):
+    data = f.read(blocksize)
+    while data:
+        yield data
+        data = f.read(blocksize)
 
-            callbacks = [queue.put for queue in queues]
 
-        if m is not None:
-            for callback in callbacks:
-                callback(m)
-        elif hasattr(f, 'getvalue'):
-            data = f.getvalue()
-            if not isinstance(data, bytes):
-                data = data.encode()
-
-            for callback in callbacks:
-                callback(data)
-        else:
-            data = f.read(blocksize)
-            while data:
-                for callback in callbacks:
-                    callback(data)
-                data = f.read(blocksize)
+def _readinto_iter(f, blocksize):
+    buf = bytearray(blocksize)
+    view = memoryview(buf)
+    readinto = f.readinto
+    size = readinto(buf)
+    while size:
+        yield view if size == blocksize else view[:size]
+        size = readinto(buf)
+
 
+def _parallel_readinto(f, callbacks, blocksize, buffers=8):
+    """readinto variant of the threaded loop
+
+    A fixed ring of buffers is shared between the callback threads; a buffer
+    is only refilled once every callback is done with it.  The first error
+    raised by a callback stops reading and is reraised here.
+    """
+    views = [memoryview(bytearray(blocksize)) for _ in range(buffers)]
+    free = queue.Queue()
+    for idx in range(buffers):
+        free.put(idx)
+    pending = [0] * buffers
+    lock = threading.Lock()
+    ncallbacks = len(callbacks)
+    errors = []
+
+    def worker(q, callback):
+        for idx, size in iter(q.get, None):
+            try:
+                # queued chunks are still drained once a callback failed,
+                # releasing their buffers
+                if not errors:
+                    callback(views[idx][:size])
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                with lock:
+                    pending[idx] -= 1
+                    if not pending[idx]:
+                        free.put(idx)
+
+    queues = [queue.Queue() for _ in callbacks]
+    threads = [threading.Thread(target=worker, args=x)
+               for x in zip(queues, callbacks)]
+    for thread in threads:
+        thread.start()
+    try:
+        while not errors:
+            idx = free.get()
+            size = f.readinto(views[idx])
+            if not size:
+                break
+            pending[idx] = ncallbacks
+            for q in queues:
+                q.put((idx, size))
     finally:
-        if parallelize:
-            for functor in callbacks:
-                functor(None)
-            for thread in threads:
+        for q in queues:
+            q.put(None)
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
+
+class _HashJob:
+    """bookkeeping for one file flowing through a :py:class:`HashingExecutor`"""
+
+    __slots__ = ('results', 'remaining', 'error', 'done', 'lock', 'free', 'pending')
+
+    def __init__(self, count, buffers=0):
+        self.results = [None] * count
+        self.remaining = count
+        self.error = None
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.free = queue.Queue()
+        for idx in range(buffers):
+            self.free.put(idx)
+        self.pending = [0] * buffers
+
+    def chunk_done(self, idx):
+        if idx is None:
+            return
+        with self.lock:
+            self.pending[idx] -= 1
+            if not self.pending[idx]:
+                self.free.put(idx)
+
+    def finish(self, pos, value):
+        with self.lock:
+            self.results[pos] = value
+            self.remaining -= 1
+            if not self.remaining:
+                self.done.set()
+
+
+def _hash_worker(q):
+    # items are (job, result position, hash object, data, buffer index);
+    # data of None finalizes that hash object.
+    for job, pos, chf, data, idx in iter(q.get, None):
+        if data is None:
+            value = None
+            if job.error is None:
+                try:
+                    value = int(chf.hexdigest(), 16)
+                except Exception as e: # pylint: disable=broad-except
+                    job.error = e
+            job.finish(pos, value)
+            continue
+        if job.error is None:
+            try:
+                chf.update(data)
+            except Exception as e: # pylint: disable=broad-except
+                job.error = e
+        job.chunk_done(idx)
+
+
+class HashingExecutor:
+    """Long lived hashing threads, one per hash of a file.
+
+    Rather than spawning a thread and queue per hash for every file, chunks
+    from any number of files (and concurrent callers) are pipelined through
+    the same workers; each queued chunk carries the hash object it belongs
+    to, so files never mix.  The n-th hash of every file goes to the n-th
+    worker, so the number of threads is bounded by the most hashes
+    requested for a single file rather than by the distinct constructors
+    callers pass in.
+
+    Workers are started on first use and are daemonic.
+    """
+
+    def __init__(self, queue_size=16, buffers=8):
+        """
+        :param queue_size: max chunks queued per worker before callers block
+        :param buffers: size of the per file buffer ring used for readinto
+        """
+        self.queue_size = queue_size
+        self.buffers = buffers
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._threads = []
+        self._pid = os.getpid()
+
+    def _queue(self, slot):
+        with self._lock:
+            if self._pid != os.getpid():
+                # threads don't survive fork; start over in the child.
+                self._queues, self._threads = {}, []
+                self._pid = os.getpid()
+            q = self._queues.get(slot)
+            if q is None:
+                q = self._queues[slot] = queue.Queue(self.queue_size)
+                thread = threading.Thread(
+                    target=_hash_worker, args=(q,), daemon=True,
+                    name='snakeoil-chksum-%i' % slot)
+                thread.start()
+                self._threads.append(thread)
+            return q
+
+    def chksum_loop_over_file(self, handle, chfs, can_mmap=True, strategy=None,
+                              blocksize=None):
+        """same as :py:func:`chksum_loop_over_file`, hashing via the workers"""
+        strategy = _resolve_strategy(strategy, can_mmap)
+        if blocksize is None:
+            blocksize = _default_blocksize()
+        work = [(self._queue(slot), chf()) for slot, chf in enumerate(chfs)]
+
+        with _open_for_loop(handle, strategy) as (m, f):
+            readinto = _uses_readinto(m, f, strategy)
+            job = _HashJob(len(work), self.buffers if readinto else 0)
+            try:
+                if readinto:
+                    views = [memoryview(bytearray(blocksize)) for _ in range(self.buffers)]
+                    while True:
+                        idx = job.free.get()
+                        size = f.readinto(views[idx])
+                        if not size:
+                            break
+                        job.pending[idx] = len(work)
+                        data = views[idx][:size]
+                        for pos, (q, chf) in enumerate(work):
+                            q.put((job, pos, chf, data, idx))
+                else:
+                    for data in _iter_chunks(m, f, strategy, blocksize):
+                        for pos, (q, chf) in enumerate(work):
+                            q.put((job, pos, chf, data, None))
+            finally:
+                # always drain; queued chunks may reference the mapping or
+                # buffers that are released on the way out.
+                for pos, (q, chf) in enumerate(work):
+                    q.put((job, pos, chf, None, None))
+                job.done.wait()
+
+        if job.error is not None:
+            raise job.error
+        return job.results
+
+    def shutdown(self):
+        """stop all worker threads; they're restarted on demand"""
+        with self._lock:
+            for q in self._queues.values():
+                q.put(None)
+            for thread in self._threads:
                 thread.join()
+            self._queues, self._threads = {}, []
 
-        if m is not None:
-            m.close()
-        elif f is not None and close_f:
-            f.close()
+
+#: executor used by :py:func:`chksum_loop_over_file` when parallelizing
+hashing_executor = HashingExecutor()
+
+
+HashStrategy = namedtuple('HashStrategy', ('blocksize', 'parallelize', 'strategy'))
+
+# filesystems where per request latency dominates; larger reads amortize it
+# and mmap page faulting tends to lose against plain reads.
+network_fstypes = frozenset([
+    '9p', 'afs', 'ceph', 'cifs', 'fuse.sshfs', 'glusterfs', 'lustre',
+    'nfs', 'nfs4', 'smb3', 'smbfs',
+])
+
+_fstypes = None
+
+
+def fstype(st_dev):
+    """return the filesystem type a device id is mounted as, None if unknown"""
+    global _fstypes # pylint: disable=global-statement
+    if _fstypes is None:
+        _fstypes = {}
+        try:
+            with open('/proc/self/mountinfo') as f:
+                for line in f:
+                    fields, _, extra = line.partition(' - ')
+                    major, minor = fields.split()[2].split(':')
+                    _fstypes.setdefault(
+                        os.makedev(int(major), int(minor)), extra.split()[0])
+        except (EnvironmentError, IndexError, ValueError):
+            pass
+    return _fstypes.get(st_dev)
+
+
+class StrategySelector:
+    """Pick block size, threading and read strategy used to hash a file.
+
+    Choices are based off the file size, the number of hashes, and the
+    filesystem the file lives on.  The thresholds default to conservative
+    values; :py:meth:`calibrate` tunes them for the local system, and the
+    results can be persisted via :py:meth:`save` and restored via
+    :py:meth:`load`.
+
+    :ivar thread_min_size: files smaller than this never pay for thread
+        startup; None disables threading entirely.
+    :ivar mmap_min_size: files smaller than this are read rather than mapped
+    :ivar large_file_size: files at least this large use `large_blocksize`
+    :ivar fstypes: mapping of filesystem type to a dict of overrides,
+        `blocksize` and/or `mmap` (a boolean)
+    """
+
+    _attrs = ('blocksize', 'large_blocksize', 'large_file_size',
+              'thread_min_size', 'mmap_min_size', 'fstypes')
+
+    def __init__(self, blocksize=2 ** 17, large_blocksize=2 ** 20,
+                 large_file_size=2 ** 26, thread_min_size=2 ** 20,
+                 mmap_min_size=2 ** 20, fstypes=None):
+        self.blocksize = blocksize
+        self.large_blocksize = large_blocksize
+        self.large_file_size = large_file_size
+        self.thread_min_size = thread_min_size
+        self.mmap_min_size = mmap_min_size
+        self.fstypes = {} if fstypes is None else fstypes
+
+    def select(self, size, nhashes, can_mmap=True, fstype=None):
+        """
+        :param size: file size in bytes, None if unknown
+        :param nhashes: number of hashes being computed, not counting size
+        :param can_mmap: whether all the hashes accept mmap objects
+        :param fstype: filesystem type the file lives on, None if unknown
+        :return: :py:class:`HashStrategy` instance
+        """
+        if size is None:
+            # not a plain file; use the historical defaults.
+            return HashStrategy(self.blocksize, nhashes > 1, None)
+
+        parallelize = (
+            nhashes > 1 and self.thread_min_size is not None and
+            size >= self.thread_min_size and cpu_count() > 1)
+        if size < self.mmap_min_size:
+            return HashStrategy(self.blocksize, parallelize, 'read')
+
+        overrides = self.fstypes.get(fstype, {})
+        network = fstype in network_fstypes
+        blocksize = self.blocksize
+        if network or size >= self.large_file_size:
+            blocksize = self.large_blocksize
+        blocksize = overrides.get('blocksize', blocksize)
+        use_mmap = can_mmap and overrides.get('mmap', not network)
+        return HashStrategy(blocksize, parallelize, 'mmap' if use_mmap else 'readinto')
+
+    def select_for(self, location, nhashes, can_mmap=True):
+        """:py:meth:`select` variant pulling size and fstype from a location"""
+        path = location
+        if isinstance(location, base_data_source):
+            path = location.path
+        if not isinstance(path, str):
+            return self.select(None, nhashes, can_mmap)
+        try:
+            st = os.stat(path)
+        except EnvironmentError:
+            # let the actual hashing raise.
+            return self.select(None, nhashes, can_mmap)
+        return self.select(st.st_size, nhashes, can_mmap, fstype(st.st_dev))
+
+    def calibrate(self, path, chksums=('md5', 'sha1'), repeat=3,
+                  sizes=tuple(2 ** x for x in range(14, 25, 2)),
+                  blocksizes=tuple(2 ** x for x in range(16, 23))):
+        """time hashing variants on the local system, tuning the thresholds
+
+        Note that the scratch files are hashed from the page cache, so this
+        measures cpu and syscall overhead rather than raw disk throughput.
+
+        :param path: directory scratch files are written to; the block size and
+            mmap results are recorded for the filesystem it lives on, or as the
+            general defaults if its filesystem type can't be determined.
+        :param chksums: chksum types to time with
+        :param repeat: how many times to time each variant, the best is used
+        :param sizes: file sizes to try for the threading and mmap cutoffs
+        :param blocksizes: block sizes to try against the largest file
+        """
+        from . import get_handler
+        handlers = [get_handler(k) for k in chksums]
+
+        def best(*args, **kwds):
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                chksum_loop_over_file(*args, **kwds)
+                times.append(time.perf_counter() - start)
+            return min(times)
+
+        fd, scratch = tempfile.mkstemp(dir=path)
+        try:
+            block = os.urandom(max(sizes))
+            thread_min_size = mmap_min_size = None
+            for size in sorted(sizes):
+                os.ftruncate(fd, 0)
+                os.pwrite(fd, block[:size], 0)
+                chfs = [h.new() for h in handlers]
+                serial = best(scratch, chfs, parallelize=False, strategy='read')
+                if cpu_count() > 1:
+                    threaded = best(scratch, chfs, parallelize=True, strategy='read')
+                    if threaded >= serial:
+                        thread_min_size = None
+                    elif thread_min_size is None:
+                        thread_min_size = size
+                mapped = best(scratch, chfs, parallelize=False, strategy='mmap')
+                if mapped >= serial:
+                    mmap_min_size = None
+                elif mmap_min_size is None:
+                    mmap_min_size = size
+
+            timings = {
+                bs: best(scratch, chfs, parallelize=False, strategy='readinto',
+                         blocksize=bs)
+                for bs in blocksizes}
+            fast_blocksize = min(timings, key=timings.get)
+            st = os.fstat(fd)
+        finally:
+            os.close(fd)
+            os.unlink(scratch)
+
+        self.thread_min_size = thread_min_size
+        # None means mmap never won; never map then.
+        self.mmap_min_size = max(sizes) + 1 if mmap_min_size is None else mmap_min_size
+        fs = fstype(st.st_dev)
+        if fs is None:
+            # no way to key the results; make them the general defaults.
+            self.blocksize = self.large_blocksize = fast_blocksize
+        else:
+            self.fstypes[fs] = {
+                'blocksize': fast_blocksize,
+                'mmap': mmap_min_size is not None,
+            }
+
+    def save(self, path):
+        """write the current thresholds to a json file"""
+        with open(path, 'w') as f:
+            json.dump({k: getattr(self, k) for k in self._attrs}, f)
+
+    def load(self, path):
+        """restore thresholds previously written by :py:meth:`save`"""
+        with open(path) as f:
+            data = json.load(f)
+        for k in self._attrs:
+            if k in data:
+                setattr(self, k, data[k])
+
+
+#: selector consulted by :py:func:`snakeoil.chksum.get_chksums` and handlers
+selector = StrategySelector()
 
 
 class Chksummer:
 
-    def __init__(self, chf_type, obj, str_size, can_mmap=True):
+    def __init__(self, chf_type, obj, str_size, can_mmap=True, releases_gil=True):
         self.obj = obj
         self.chf_type = chf_type
         self.str_size = str_size
         self.can_mmap = can_mmap
+        # pure python implementations (or those holding the GIL) gain nothing
+        # from threads; multiple such hashes are spread across processes instead.
+        self.releases_gil = releases_gil
 
     def new(self):
         return self.obj
@@ -132,85 +625,30 @@ class Chksummer:
         return int(val, 16)
 
     def __call__(self, filename):
+        choice = selector.select_for(filename, 1, self.can_mmap)
         return chksum_loop_over_file(
-            filename, [self.obj], can_mmap=self.can_mmap)[0]
+            filename, [self.obj], can_mmap=self.can_mmap,
+            strategy=choice.strategy, blocksize=choice.blocksize)[0]
 
     def __str__(self):
         return "%s chksummer" % self.chf_type
 
 
-# We have a couple of options:
-#
-# - If we are on python 2.5 or newer we can use hashlib, which uses
-#   openssl if available (this will be fast and support a whole bunch
-#   of hashes) and use a c implementation from python itself otherwise
-#   (does not support as many hashes, slower).
-# - On older pythons we can use the sha and md5 module for sha1 and md5.
-#   On python 2.5 these are deprecated wrappers around hashlib.
-# - On any python we can use the fchksum module (if available) which can
-#   hash an entire file faster than we can, probably just because it does the
-#   file-reading and hashing both in c.
-# - For any python we can use PyCrypto. Supports many hashes, fast but not
-#   as fast as openssl-powered hashlib. Not compared to cpython hashlib.
-#
-# To complicate matters hashlib has a couple of hashes always present
-# as attributes of the hashlib module and less common hashes available
-# through a constructor taking a string. The former is faster.
-#
-# Some timing data from my athlonxp 2600+, python 2.4.3, python 2.5rc1,
-# pycrypto 2.0.1-r5, openssl 0.9.7j, fchksum 1.7.1 (not exhaustive obviously):
-# (test file is the Python 2.4.3 tarball, 7.7M)
-#
-# python2.4 -m timeit -s 'import fchksum'
-#   'fchksum.fmd5t("/home/marienz/tmp/Python-2.4.3.tar.bz2")[0]'
-# 40 +/- 1 msec roughly
-#
-# same with python2.5: same results.
-#
-# python2.4 -m timeit -s 'from snakeoil.chksum import defaults;import md5'
-#   'defaults.loop_over_file(md5, "/home/marienz/tmp/Python-2.4.3.tar.bz2")'
-# 64 +/- 1 msec roughly
-#
-# Same with python2.5:
-# 37 +/- 1 msec roughly
-#
-# python2.5 -m timeit -s
-#   'from snakeoil.chksum import defaults; from snakeoil import currying;'
-# -s 'import hashlib; hash = currying.pre_curry(hashlib.new, "md5")'
-#   'defaults.loop_over_file(hash, "/home/marienz/tmp/Python-2.4.3.tar.bz2")'
-# 37 +/- 1 msec roughly
-#
-# python2.5 -m timeit -s 'import hashlib'
-#   'h=hashlib.new("md5"); h.update("spork"); h.hexdigest()'
-# 6-7 usec per loop
-#
-# python2.5 -m timeit -s 'import hashlib'
-#   'h=hashlib.md5(); h.update("spork"); h.hexdigest()'
-# ~4 usec per loop
-#
-# python2.5 -m timeit -s 'import hashlib;data = 1024 * "spork"'
-#   'h=hashlib.new("md5"); h.update(data); h.hexdigest()'
-# ~20 usec per loop
-#
-# python2.5 -m timeit -s 'import hashlib;data = 1024 * "spork"'
-#   'h=hashlib.md5(); h.update(data); h.hexdigest()'
-# ~18 usec per loop
-#
-# Summarized:
-# - hashlib is faster than fchksum, fchksum is faster than python 2.4's md5.
-# - using hashlib's new() instead of the predefined type is still noticably
-#   slower for 5k of data. Since ebuilds and patches will often be smaller
-#   than 5k we should avoid hashlib's new if there is a predefined type.
-# - If we do not have hashlib preferring fchksum over python md5 is worth it.
-# - Testing PyCrypto is unnecessary since its Crypto.Hash.MD5 is an
-#   alias for python's md5 (same for sha1).
+# Implementation preferences:
 #
-# An additional advantage of using hashlib instead of PyCrypto is it
-# is more reliable (PyCrypto has a history of generating bogus hashes,
-# especially on non-x86 platforms, OpenSSL should be more reliable
-# because it is more widely used).
+# - hashlib uses openssl if available (fast, and supports a whole bunch of
+#   hashes), falling back to python's own C implementations otherwise.
+# - hashlib has a couple of hashes always present as attributes of the
+#   module, with less common hashes only available through new() taking a
+#   string.  The attributes are cheaper to instantiate, which matters since
+#   ebuilds and patches are often only a few KiB.
+# - pysha3/pyblake2 are lightweight extensions covering hashes older
+#   openssl/python versions lack.
+# - pycryptodome supports many hashes but is slower than openssl-powered
+#   hashlib, and has historically been less reliable on non-x86 platforms.
 #
-# TODO do benchmarks for more hashes?
+# For throughput numbers of every registered handler see
+# benchmarks/chksum_throughput.py in the source tree.
 #
 # Hash function we use is:
 # - hashlib attr if available
@@ -260,7 +698,7 @@ for k, modattr, str_size in (
         continue
     try:
         chksum_types[k] = Chksummer(k, modules.load_attribute(
-            modattr), str_size, can_mmap=False)
+            modattr), str_size, can_mmap=False, releases_gil=False)
     except modules.FailedImport:
         pass
 
@@ -277,7 +715,8 @@ for k, v, str_size in (
         continue
     try:
         chksum_types[k] = Chksummer(k, modules.load_attribute(
-            "Crypto.Hash.%s.new" % v), str_size, can_mmap=False)
+            "Crypto.Hash.%s.new" % v), str_size, can_mmap=False,
+            releases_gil=False)
     except modules.FailedImport:
         pass
 
@@ -291,7 +730,7 @@ for k, v, str_size in (
     try:
         chksum_types[k] = Chksummer(k, partial(modules.load_attribute(
             "Crypto.Hash.%s.new" % v), digest_bytes=str_size//2), str_size,
-            can_mmap=False)
+            can_mmap=False, releases_gil=False)
     except modules.FailedImport:
         pass
 
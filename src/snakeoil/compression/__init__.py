@@ -1,9 +1,21 @@
+import bz2
+import gzip
 from importlib import import_module
+from importlib.util import find_spec
+import lzma
+from multiprocessing import cpu_count
+import os
 import shlex
+import stat
+import tarfile
+import threading
+import zipfile
+import zlib
 
 from .. import klass
+from . import _create, _extract
 from ..cli.exceptions import UserException
-from ..process import find_binary, CommandNotFound
+from ..process import find_binary_cached, CommandNotFound
 from ..process.spawn import spawn_get_output
 
 
@@ -20,6 +32,10 @@ class _transform_source:
     def parallelizable(self):
         return bool(getattr(self.module, 'parallelizable', False))
 
+    @klass.jit_attr
+    def exceptions(self):
+        return (EnvironmentError,) + tuple(getattr(self.module, 'exceptions', ()))
+
     def compress_data(self, data, level, parallelize=False):
         parallelize = parallelize and self.module.parallelizable
         return self.module.compress_data(data, level, parallelize=parallelize)
@@ -37,7 +53,10 @@ class _transform_source:
         return self.module.decompress_handle(handle, parallelize=parallelize)
 
 
-_transforms = {name: _transform_source(name) for name in ('bzip2',)}
+_transforms = {name: _transform_source(name) for name in ('bzip2', 'gzip', 'xz')}
+# zstd support relies on an optional module
+if find_spec('zstandard') is not None:
+    _transforms['zstd'] = _transform_source('zstd')
 
 def compress_data(compressor_type, data, level=9, **kwds):
     return _transforms[compressor_type].compress_data(data, level, **kwds)
@@ -51,6 +70,44 @@ def compress_handle(compressor_type, handle, level=9, **kwds):
 def decompress_handle(compressor_type, source, **kwds):
     return _transforms[compressor_type].decompress_handle(source, **kwds)
 
+def handle_exceptions(compressor_type):
+    """Return the exceptions compression handles may raise on I/O or corrupt data."""
+    return _transforms[compressor_type].exceptions
+
+# leading bytes identifying compressed data
+_magics = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bzip2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+)
+
+def detect_compressor(path):
+    """Return the compression format of a file from its magic bytes.
+
+    :return: compressor type usable with :py:func:`decompress_handle` and
+        friends, or None if the data isn't recognized as compressed
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+    for prefix, compressor_type in _magics:
+        if magic.startswith(prefix):
+            return compressor_type
+    return None
+
+def open_seekable(path, compressor_type=None, index_path=None, **kwds):
+    """Open a compressed file for random access reads.
+
+    Unlike :py:func:`decompress_handle`, seeking doesn't restart
+    decompression from the start of the file; see
+    :py:mod:`snakeoil.compression._seekable` for details.
+
+    :param compressor_type: gzip, bzip2, or xz; detected if not given
+    :param index_path: file path to cache the file's checkpoint index at
+    """
+    from ._seekable import open_seekable
+    return open_seekable(path, compressor_type, index_path, **kwds)
+
 
 class ArCompError(UserException):
     """Generic archive and compressed file error."""
@@ -60,6 +117,80 @@ class ArCompError(UserException):
         self.code = code
 
 
+class _NativeUnsupported(Exception):
+    """The stdlib can't handle the file, unpacking falls back to binaries."""
+
+
+# errors raised when opening a file the stdlib doesn't support
+_native_open_errors = (
+    OSError, EOFError, lzma.LZMAError, tarfile.ReadError, zipfile.BadZipFile)
+# errors raised from corrupted data partway through unpacking
+_native_unpack_errors = (
+    OSError, EOFError, lzma.LZMAError, zlib.error, tarfile.TarError,
+    zipfile.BadZipFile)
+
+# rejects members escaping the destination, including via links, and
+# devices; without it native tar extraction isn't safe and isn't used
+_tar_filter = getattr(tarfile, 'data_filter', None)
+
+_zip_methods = frozenset([
+    zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA])
+
+_native_bufsize = 1024 * 1024
+
+# leading bytes of the compression formats the stdlib supports
+_native_magic = (
+    (b'\x1f\x8b', gzip.open),
+    (b'BZh', bz2.open),
+    (b'\xfd7zXZ\x00', lzma.open),
+    (b'\x5d\x00\x00', lzma.open),
+)
+
+
+def _native_opener(path):
+    """Return the stdlib opener for a compressed file, None if there's none."""
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+    for prefix, opener in _native_magic:
+        if magic.startswith(prefix):
+            return opener
+    return None
+
+
+class _PipedDecompressor:
+    """Decompress a file in a thread, feeding the data through a pipe.
+
+    Much like tar running a separate decompression process, this overlaps
+    decompression with writing out the unpacked files (the stdlib
+    decompressors release the GIL), while the pipe bounds memory usage.
+    """
+
+    def __init__(self, opener, path):
+        self.error = None
+        rfd, wfd = os.pipe()
+        self.reader = open(rfd, 'rb')
+        self._thread = threading.Thread(
+            target=self._decompress, args=(opener, path, wfd), daemon=True)
+        self._thread.start()
+
+    def _decompress(self, opener, path, fd):
+        try:
+            with open(fd, 'wb') as pipe, opener(path) as src:
+                data = src.read(_native_bufsize)
+                while data:
+                    pipe.write(data)
+                    data = src.read(_native_bufsize)
+        except BrokenPipeError:
+            # the reader stopped early, e.g. at the end of a tar archive
+            pass
+        except _native_unpack_errors as e:
+            self.error = e
+
+    def close(self):
+        self.reader.close()
+        self._thread.join()
+
+
 class _RegisterCompressionFormat(type):
     """Metaclass for registering archive formats."""
 
@@ -95,7 +226,7 @@ class ArComp:
     def _unpack_cmd(self):
         for b in self.binary:
             try:
-                binary = find_binary(b)
+                binary = find_binary_cached(b)
                 break
             except CommandNotFound:
                 continue
@@ -103,32 +234,121 @@ class ArComp:
             choices = ', '.join(self.binary)
             raise ArCompError(
                 f'required binary not found from the following choices: {choices}')
-        cmd = self.default_unpack_cmd.format(binary=binary, path=self.path)
+        # archives may be unpacked from another working directory
+        path = os.path.abspath(self.path)
+        cmd = self.default_unpack_cmd.format(binary=binary, path=path)
         return cmd
 
-    def unpack(self, dest=None, **kwargs):
-        raise NotImplementedError
+    def unpack(self, dest=None, native=False, jobs=None, **kwargs):
+        """Unpack the file.
+
+        :param dest: target file path for compressed files, target directory
+            for archives (defaulting to the `cwd` keyword or the current
+            working directory)
+        :param native: unpack in-process via the stdlib where it supports the
+            format, falling back to external binaries otherwise; off by
+            default as tarfile and zipfile are slower than the binaries for
+            archives holding many small files.  Tarballs are only unpacked
+            natively if tarfile has extraction filters, see
+            :py:func:`tarfile.data_filter`
+        :param jobs: for native unpacking of archives, the number of threads
+            writing out files (see :py:mod:`snakeoil.compression._extract`),
+            defaulting to the cpu count; 1 unpacks serially
+        """
+        if native:
+            try:
+                return self._unpack_native(dest, jobs=jobs, **kwargs)
+            except _NativeUnsupported:
+                pass
+        return self._unpack_binary(dest, **kwargs)
 
-    def create(self, dest):
+    def _unpack_native(self, dest, jobs=None, **kwargs):
+        raise _NativeUnsupported()
+
+    def _unpack_binary(self, dest, **kwargs):
         raise NotImplementedError
 
+    def create(self, src, level=None, jobs=None, mtime=None):
+        """Create the archive from the contents of a directory.
+
+        Output is reproducible, see :py:mod:`snakeoil.compression._create`.
+
+        :param src: directory to archive
+        :param level: compression level, defaulting to the format's default
+        :param jobs: number of threads scanning and reading files,
+            defaulting to the cpu count
+        :param mtime: if given, timestamp used for all members; otherwise
+            file mtimes are used, clamped to ``SOURCE_DATE_EPOCH`` if set
+        :raises ArCompError: on failure, or if the format can't be created
+        """
+        raise ArCompError(f'archive creation unsupported: {self.path!r}')
+
+    def _write(self, write):
+        """Write the archive via write(file object), removing it on failure."""
+        try:
+            with open(self.path, 'wb') as f:
+                write(f)
+        except BaseException as e:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            if isinstance(e, (OSError, tarfile.TarError, zlib.error, lzma.LZMAError)):
+                raise ArCompError(f'creating failed: {self.path!r}: {e}')
+            raise
+
 
 class _Archive(ArComp):
     """Generic archive format support."""
 
-    def unpack(self, dest=None, **kwargs):
-        cmd = shlex.split(self._unpack_cmd.format(path=self.path))
+    def unpack(self, dest=None, native=False, jobs=None, **kwargs):
+        if dest is None:
+            dest = kwargs.get('cwd', os.curdir)
+        kwargs['cwd'] = dest
+        return super().unpack(dest, native=native, jobs=jobs, **kwargs)
+
+    def _unpack_binary(self, dest, **kwargs):
+        cmd = shlex.split(self._unpack_cmd)
         ret, output = spawn_get_output(cmd, collect_fds=(2,), **kwargs)
         if ret:
             msg = '\n'.join(output) if output else f'unpacking failed: {self.path!r}'
             raise ArCompError(msg, code=ret)
 
 
-class _CompressedFile(ArComp):
+class _Compressed(ArComp):
+    """Single compressed file, decompressed in-process if supported."""
+
+    # stdlib opener for the format, e.g. gzip.open
+    _native_open = None
+
+    def _unpack_native(self, dest, jobs=None, **kwargs):
+        if self._native_open is None:
+            raise _NativeUnsupported()
+        try:
+            src = self._native_open(self.path)
+        except _native_open_errors:
+            raise _NativeUnsupported()
+        with src:
+            # most format errors only show up on the first read; bail before
+            # creating the target.
+            try:
+                data = src.read(_native_bufsize)
+            except _native_open_errors:
+                raise _NativeUnsupported()
+            try:
+                with open(dest, 'wb') as f:
+                    while data:
+                        f.write(data)
+                        data = src.read(_native_bufsize)
+            except _native_unpack_errors as e:
+                raise ArCompError(f'unpacking failed: {self.path!r}: {e}')
+
+
+class _CompressedFile(_Compressed):
     """Single compressed file."""
 
-    def unpack(self, dest=None, **kwargs):
-        cmd = shlex.split(self._unpack_cmd.format(path=self.path))
+    def _unpack_binary(self, dest, **kwargs):
+        cmd = shlex.split(self._unpack_cmd)
         with open(dest, 'wb') as f:
             ret, output = spawn_get_output(
                 cmd, collect_fds=(2,), fd_pipes={1: f.fileno()}, **kwargs)
@@ -137,10 +357,10 @@ class _CompressedFile(ArComp):
             raise ArCompError(msg, code=ret)
 
 
-class _CompressedStdin(ArComp):
+class _CompressedStdin(_Compressed):
     """Compressed data from stdin."""
 
-    def unpack(self, dest=None, **kwargs):
+    def _unpack_binary(self, dest, **kwargs):
         cmd = shlex.split(self._unpack_cmd)
         with open(self.path, 'rb') as src, open(dest, 'wb') as f:
             ret, output = spawn_get_output(
@@ -156,6 +376,9 @@ class _Tar(_Archive, metaclass=_RegisterCompressionFormat):
     binary = ('tar',)
     compress_binary = None
     default_unpack_cmd = '{binary} xf "{path}"'
+    # compression transform used when creating archives
+    compressor = None
+    compress_level = None
 
     @klass.jit_attr
     def _unpack_cmd(self):
@@ -163,7 +386,7 @@ class _Tar(_Archive, metaclass=_RegisterCompressionFormat):
         if self.compress_binary is not None:
             for b in self.compress_binary:
                 try:
-                    binary = find_binary(b)
+                    binary = find_binary_cached(b)
                     cmd += f' --use-compress-program={b}'
                     break
                 except CommandNotFound:
@@ -175,17 +398,72 @@ class _Tar(_Archive, metaclass=_RegisterCompressionFormat):
                     f'following choices: {choices}')
         return cmd
 
+    def _unpack_native(self, dest, jobs=None, **kwargs):
+        if _tar_filter is None:
+            raise _NativeUnsupported()
+        try:
+            opener = _native_opener(self.path)
+        except OSError:
+            raise _NativeUnsupported()
+        if opener is None:
+            # uncompressed, or compressed in a format the stdlib lacks
+            return self._extract(dest, jobs, name=self.path)
+        stream = _PipedDecompressor(opener, self.path)
+        try:
+            self._extract(dest, jobs, fileobj=stream.reader)
+        except ArCompError:
+            stream.close()
+            if stream.error is None:
+                raise
+            raise ArCompError(f'unpacking failed: {self.path!r}: {stream.error}')
+        finally:
+            stream.close()
+
+    def create(self, src, level=None, jobs=None, mtime=None):
+        if self.compressor is None:
+            if self.compress_binary is not None:
+                raise ArCompError(f'archive creation unsupported: {self.path!r}')
+            return self._write(lambda f: _create.create_tar(f, src, jobs, mtime))
+        if self.compressor not in _transforms:
+            raise ArCompError(f'{self.compressor} compression support is unavailable')
+        level = self.compress_level if level is None else level
+
+        def write(f):
+            with compress_handle(self.compressor, f, level, parallelize=True) as out:
+                _create.create_tar(out, src, jobs, mtime)
+        return self._write(write)
+
+    def _extract(self, dest, jobs, name=None, fileobj=None):
+        # stream mode reads members sequentially, writing each straight to
+        # disk without seeking back or buffering the archive.
+        try:
+            tar = tarfile.open(name, mode='r|', fileobj=fileobj)
+        except _native_open_errors:
+            raise _NativeUnsupported()
+        with tar:
+            try:
+                if (jobs or cpu_count()) == 1:
+                    tar.extractall(dest, filter=_tar_filter)
+                else:
+                    _extract.extract_tar(tar, dest, jobs, filter=_tar_filter)
+            except _native_unpack_errors as e:
+                raise ArCompError(f'unpacking failed: {self.path!r}: {e}')
+
 
 class _TarGZ(_Tar, metaclass=_RegisterCompressionFormat):
 
     exts = frozenset(['.tar.gz', '.tgz', '.tar.Z', '.tar.z'])
     compress_binary = ('pigz', 'gzip')
+    compressor = 'gzip'
+    compress_level = 6
 
 
 class _TarBZ2(_Tar, metaclass=_RegisterCompressionFormat):
 
     exts = frozenset(['.tar.bz2', '.tbz2', '.tbz'])
     compress_binary = ('lbzip2', 'pbzip2', 'bzip2')
+    compressor = 'bzip2'
+    compress_level = 9
 
 
 class _TarLZMA(_Tar, metaclass=_RegisterCompressionFormat):
@@ -198,6 +476,16 @@ class _TarXZ(_Tar, metaclass=_RegisterCompressionFormat):
 
     exts = frozenset(['.tar.xz', '.txz'])
     compress_binary = ('pixz', 'xz')
+    compressor = 'xz'
+    compress_level = 6
+
+
+class _TarZST(_Tar, metaclass=_RegisterCompressionFormat):
+
+    exts = frozenset(['.tar.zst', '.tzst'])
+    compress_binary = ('zstd',)
+    compressor = 'zstd'
+    compress_level = 3
 
 
 class _Zip(_Archive, metaclass=_RegisterCompressionFormat):
@@ -206,12 +494,64 @@ class _Zip(_Archive, metaclass=_RegisterCompressionFormat):
     binary = ('unzip',)
     default_unpack_cmd = '{binary} -qo "{path}"'
 
+    def _unpack_native(self, dest, jobs=None, **kwargs):
+        try:
+            archive = zipfile.ZipFile(self.path)
+        except _native_open_errors:
+            raise _NativeUnsupported()
+        with archive:
+            members = archive.infolist()
+            # leave encrypted archives and exotic compression methods to unzip
+            if any(x.flag_bits & 0x1 or x.compress_type not in _zip_methods
+                   for x in members):
+                raise _NativeUnsupported()
+            try:
+                if (jobs or cpu_count()) == 1:
+                    realdest = os.path.realpath(dest)
+                    for member in members:
+                        self._extract_member(archive, member, dest, realdest)
+                else:
+                    _extract.extract_zip(archive, dest, jobs, members)
+            except _native_unpack_errors as e:
+                raise ArCompError(f'unpacking failed: {self.path!r}: {e}')
+
+    def create(self, src, level=None, jobs=None, mtime=None):
+        level = 6 if level is None else level
+        return self._write(
+            lambda f: _create.create_zip(f, src, level, jobs, mtime))
+
+    @staticmethod
+    def _extract_member(archive, member, dest, realdest):
+        # zipfile follows symlinks extracted earlier, so refuse members that
+        # would land outside dest and replace symlinks instead of writing
+        # through them.
+        target = os.path.join(dest, _extract._zip_path(member.filename))
+        parent = os.path.realpath(os.path.dirname(target))
+        if os.path.commonpath((realdest, parent)) != realdest:
+            raise OSError(
+                f'{member.filename!r} would be extracted to {parent!r}, '
+                'which is outside the destination')
+        _extract._unlink_symlink(target)
+        path = archive.extract(member, dest)
+        # zipfile ignores unix modes and symlinks; restore them like unzip.
+        mode = member.external_attr >> 16
+        if member.create_system != 3 or not mode or member.is_dir():
+            return
+        if stat.S_ISLNK(mode):
+            with open(path) as f:
+                target = f.read()
+            os.unlink(path)
+            os.symlink(target, path)
+        else:
+            os.chmod(path, stat.S_IMODE(mode))
+
 
 class _GZ(_CompressedStdin, metaclass=_RegisterCompressionFormat):
 
     exts = frozenset(['.gz', '.Z', '.z'])
     binary = ('pigz', 'gzip')
     default_unpack_cmd = '{binary} -d -c'
+    _native_open = staticmethod(gzip.open)
 
 
 class _BZ2(_CompressedStdin, metaclass=_RegisterCompressionFormat):
@@ -219,6 +559,7 @@ class _BZ2(_CompressedStdin, metaclass=_RegisterCompressionFormat):
     exts = frozenset(['.bz2', '.bz'])
     binary = ('lbzip2', 'pbzip2', 'bzip2')
     default_unpack_cmd = '{binary} -d -c'
+    _native_open = staticmethod(bz2.open)
 
 
 class _XZ(_CompressedStdin, metaclass=_RegisterCompressionFormat):
@@ -226,6 +567,7 @@ class _XZ(_CompressedStdin, metaclass=_RegisterCompressionFormat):
     exts = frozenset(['.xz'])
     binary = ('pixz', 'xz')
     default_unpack_cmd = '{binary} -d -c'
+    _native_open = staticmethod(lzma.open)
 
 
 class _7Z(_Archive, metaclass=_RegisterCompressionFormat):
@@ -261,3 +603,4 @@ class _LZMA(_CompressedFile, metaclass=_RegisterCompressionFormat):
     exts = frozenset(['.lzma'])
     binary = ('lzma',)
     default_unpack_cmd = '{binary} -dc "{path}"'
+    _native_open = staticmethod(lzma.open)
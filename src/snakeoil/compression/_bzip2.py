@@ -11,16 +11,19 @@ Should use this module unless its absolutely critical that bz2 module be used
 __all__ = ("compress_data", "decompress_data")
 
 from functools import partial
-import multiprocessing
+from multiprocessing import cpu_count
 
 from .. import process
-from ..compression import _util
+from ..compression import _parallel, _util
 
 # Unused import
 # pylint: disable=W0611
 
-# if Bzip2 can't be found, throw an error.
-bz2_path = process.find_binary("bzip2")
+
+def _bz2_path():
+    # resolved on use, the binary is only needed when the bz2 module is
+    # missing or for file descriptor and file object handles.
+    return process.find_binary_cached("bzip2")
 
 
 try:
@@ -34,48 +37,54 @@ except ImportError:
     # (and some code needs to be able to check that).
     native = False
 
-    _compress_data = partial(_util.compress_data, bz2_path)
-    _decompress_data = partial(_util.decompress_data, bz2_path)
+    def _compress_data(data, compresslevel=9):
+        return _util.compress_data(_bz2_path(), data, compresslevel=compresslevel)
 
-_compress_handle = partial(_util.compress_handle, bz2_path)
-_decompress_handle = partial(_util.decompress_handle, bz2_path)
+    def _decompress_data(data):
+        return _util.decompress_data(_bz2_path(), data)
 
-lbzip2_path = None
-parallelizable = False
-lbzip2_compress_args = lbzip2_decompress_args = ()
-try:
-    lbzip2_path = process.find_binary("lbzip2")
-    lbzip2_compress_args = ('-n%i' % multiprocessing.cpu_count(),)
-    lbzip2_decompress_args = lbzip2_compress_args
-    parallelizable = True
-except process.CommandNotFound:
-    pass
+def _compress_handle(handle, compresslevel=9):
+    return _util.compress_handle(_bz2_path(), handle, compresslevel=compresslevel)
+
+def _decompress_handle(handle):
+    return _util.decompress_handle(_bz2_path(), handle)
+
+def _lbzip2_serial():
+    # single stream files can't be split in-process; lbzip2 decompresses
+    # their blocks in parallel instead.
+    try:
+        lbzip2 = process.find_binary_cached("lbzip2")
+    except process.CommandNotFound:
+        return None
+    return partial(_util.decompress_stream, lbzip2, extra_args=('-n%i' % cpu_count(),))
+
+# in-process parallelism needs the bz2 module
+parallelizable = native
+# errors raised by handles on corrupt data beyond EnvironmentError
+exceptions = (EOFError,)
 
 
 def compress_data(data, level=9, parallelize=False):
     if parallelize and parallelizable:
-        return _util.compress_data(lbzip2_path, data, compresslevel=level,
-                                   extra_args=lbzip2_compress_args)
+        return _parallel.compress_data('bzip2', data, level)
     return _compress_data(data, compresslevel=level)
 
 def decompress_data(data, parallelize=False):
     if parallelize and parallelizable:
-        return _util.decompress_data(lbzip2_path, data,
-                                     extra_args=lbzip2_decompress_args)
+        return _parallel.decompress_data('bzip2', data, serial=_lbzip2_serial())
     return _decompress_data(data)
 
 def compress_handle(handle, level=9, parallelize=False):
     if parallelize and parallelizable:
-        return _util.compress_handle(lbzip2_path, handle, compresslevel=level,
-                                     extra_args=lbzip2_compress_args)
-    elif native and isinstance(handle, str):
+        return _parallel.compress_handle('bzip2', handle, level)
+    elif native and not isinstance(handle, int):
+        # paths and file objects; BZ2File doesn't support raw fds
         return BZ2File(handle, mode='w', compresslevel=level)
     return _compress_handle(handle, compresslevel=level)
 
 def decompress_handle(handle, parallelize=False):
     if parallelize and parallelizable:
-        return _util.decompress_handle(lbzip2_path, handle,
-                                       extra_args=lbzip2_decompress_args)
-    elif (native and isinstance(handle, str)):
+        return _parallel.decompress_handle('bzip2', handle, serial=_lbzip2_serial())
+    elif native and not isinstance(handle, int):
         return BZ2File(handle, mode='r')
     return _decompress_handle(handle)
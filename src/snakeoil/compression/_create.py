@@ -0,0 +1,412 @@
+"""
+parallel archive creation
+
+Directories are scanned concurrently on a thread pool and file data is read
+ahead on it, while the archive itself is written sequentially; compression
+runs in parallel blocks (see :py:mod:`snakeoil.compression._parallel`), or
+for zip archives, per member on the thread pool.
+
+Output is reproducible: members are sorted by name within each directory,
+with directories preceding their contents, and archive headers only depend
+on file metadata, not on the creator's timezone or user database.  Member
+mtimes may be clamped or overridden, by default they're clamped to
+``SOURCE_DATE_EPOCH`` if it's set.  Tar member ownership is recorded as
+root (uid and gid 0, without names) unless explicitly requested.
+"""
+
+__all__ = ("walk", "create_tar", "create_zip")
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+import grp
+import io
+import os
+import pwd
+import stat
+import struct
+import sys
+import tarfile
+import time
+import zipfile
+import zlib
+
+# bytes of file data read ahead of the archive writer
+_max_pending = 64 * 1024 * 1024
+# files larger than this are streamed by the writing thread
+_max_queued = 8 * 1024 * 1024
+_readsize = 1024 * 1024
+
+
+def _scan(path):
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            st = entry.stat(follow_symlinks=False)
+            link = os.readlink(entry.path) if stat.S_ISLNK(st.st_mode) else None
+            entries.append((entry.name, st, link))
+    entries.sort(key=lambda x: x[0])
+    return entries
+
+
+def _walk(pool, src, relpath, listing):
+    subdirs = {}
+    # scan subdirectories ahead of time
+    for name, st, _ in listing.result():
+        if stat.S_ISDIR(st.st_mode):
+            subdirs[name] = pool.submit(_scan, os.path.join(src, relpath, name))
+    for name, st, link in listing.result():
+        path = f'{relpath}/{name}' if relpath else name
+        yield path, st, link
+        if name in subdirs:
+            yield from _walk(pool, src, path, subdirs[name])
+
+
+def walk(src, pool):
+    """Yield (relative path, lstat result, symlink target) for a tree.
+
+    Entries are sorted by name within each directory, directories preceding
+    their contents.  Directories are scanned concurrently on `pool`.
+    """
+    return _walk(pool, src, '', pool.submit(_scan, src))
+
+
+def _clamp_mtime(st, mtime, clamp):
+    if mtime is not None:
+        return mtime
+    if clamp is not None:
+        return min(int(st.st_mtime), clamp)
+    return int(st.st_mtime)
+
+
+def _resolve_mtimes(mtime):
+    """return the (override, clamp) mtime pair"""
+    clamp = os.environ.get('SOURCE_DATE_EPOCH')
+    return mtime, int(clamp) if clamp else None
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class _ReadAhead:
+    """Read file data on a thread pool ahead of its use, in order.
+
+    :param entries: list of (relative path, lstat result) pairs for the
+        files that will be requested, in order
+    """
+
+    def __init__(self, pool, src, entries, func=_read):
+        self._pool = pool
+        self._src = src
+        self._func = func
+        self._entries = deque(x for x in entries if x[1].st_size <= _max_queued)
+        self._inflight = {}
+        self._pending = 0
+        self._fill()
+
+    def _fill(self):
+        while self._entries and (
+                not self._inflight or self._pending + self._entries[0][1].st_size <= _max_pending):
+            path, st = self._entries.popleft()
+            self._inflight[path] = (
+                self._pool.submit(self._func, os.path.join(self._src, path)), st.st_size)
+            self._pending += st.st_size
+
+    def get(self, path):
+        """Return the result for `path`, None if it wasn't read ahead."""
+        task = self._inflight.pop(path, None)
+        if task is None:
+            return None
+        self._pending -= task[1]
+        result = task[0].result()
+        self._fill()
+        return result
+
+    def cancel(self):
+        for task, _ in self._inflight.values():
+            task.cancel()
+
+
+class _Owners:
+    """cached uid/gid name lookups"""
+
+    def __init__(self):
+        self._users = {}
+        self._groups = {}
+
+    def user(self, uid):
+        try:
+            return self._users[uid]
+        except KeyError:
+            try:
+                name = pwd.getpwuid(uid)[0]
+            except KeyError:
+                name = ''
+            self._users[uid] = name
+            return name
+
+    def group(self, gid):
+        try:
+            return self._groups[gid]
+        except KeyError:
+            try:
+                name = grp.getgrgid(gid)[0]
+            except KeyError:
+                name = ''
+            self._groups[gid] = name
+            return name
+
+
+_tar_types = (
+    (stat.S_ISDIR, tarfile.DIRTYPE),
+    (stat.S_ISLNK, tarfile.SYMTYPE),
+    (stat.S_ISFIFO, tarfile.FIFOTYPE),
+    (stat.S_ISCHR, tarfile.CHRTYPE),
+    (stat.S_ISBLK, tarfile.BLKTYPE),
+)
+
+
+def _tarinfo(path, st, link, inodes, owners, mtime):
+    """Build a TarInfo from stat results as TarFile.gettarinfo() does."""
+    info = tarfile.TarInfo(path)
+    info.size = 0
+    if stat.S_ISREG(st.st_mode):
+        inode = (st.st_ino, st.st_dev)
+        if st.st_nlink > 1 and inode in inodes:
+            info.type = tarfile.LNKTYPE
+            info.linkname = inodes[inode]
+        else:
+            info.type = tarfile.REGTYPE
+            info.size = st.st_size
+            if st.st_nlink > 1:
+                inodes[inode] = path
+    else:
+        for check, type in _tar_types:
+            if check(st.st_mode):
+                info.type = type
+                break
+        else:
+            # sockets can't be archived
+            return None
+        if info.issym():
+            info.linkname = link
+        elif info.ischr() or info.isblk():
+            info.devmajor = os.major(st.st_rdev)
+            info.devminor = os.minor(st.st_rdev)
+    info.mode = stat.S_IMODE(st.st_mode)
+    if owners is not None:
+        info.uid = st.st_uid
+        info.gid = st.st_gid
+        info.uname = owners.user(st.st_uid)
+        info.gname = owners.group(st.st_gid)
+    info.mtime = mtime
+    return info
+
+
+def create_tar(fileobj, src, jobs=None, mtime=None, owners=False):
+    """Write a tar archive of the contents of a directory.
+
+    :param fileobj: writable file object the archive is written to, e.g. a
+        parallel compressor
+    :param src: directory to archive
+    :param jobs: number of threads scanning and reading files, defaults to
+        the cpu count
+    :param mtime: if given, timestamp used for all members
+    :param owners: record the file owners instead of uid and gid 0
+    """
+    mtime, clamp = _resolve_mtimes(mtime)
+    with ThreadPoolExecutor(max_workers=jobs or cpu_count()) as pool:
+        entries = list(walk(src, pool))
+        inodes = {}
+        owners = _Owners() if owners else None
+        infos = []
+        for path, st, link in entries:
+            info = _tarinfo(path, st, link, inodes, owners, _clamp_mtime(st, mtime, clamp))
+            if info is not None:
+                infos.append((info, st))
+        reader = _ReadAhead(pool, src, ((info.name, st) for info, st in infos if info.isreg()))
+        try:
+            with tarfile.open(fileobj=fileobj, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+                for info, st in infos:
+                    if not info.isreg():
+                        tar.addfile(info)
+                        continue
+                    data = reader.get(info.name)
+                    if data is None:
+                        with open(os.path.join(src, info.name), 'rb') as f:
+                            tar.addfile(info, f)
+                        continue
+                    if len(data) != info.size:
+                        raise OSError(f'file changed while archiving: {info.name!r}')
+                    tar.addfile(info, io.BytesIO(data))
+        finally:
+            reader.cancel()
+
+
+_zip_local = struct.Struct('<IHHHHHIIIHH')
+_zip_central = struct.Struct('<IHHHHHHIIIHHHHHII')
+_zip_end = struct.Struct('<IHHHHIIH')
+_zip_descriptor = struct.Struct('<IIII')
+# zip64 fields aren't written, archives needing them use zipfile
+_zip_limit = 0xffffffff
+
+
+def _dostime(mtime):
+    t = time.gmtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+def _deflate(level, path):
+    """return (method, crc, data) for a file's compressed contents"""
+    data = _read(path)
+    return _deflate_data(level, data)
+
+
+def _deflate_data(level, data):
+    crc = zlib.crc32(data)
+    if data:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        cdata = compressor.compress(data) + compressor.flush()
+        if len(cdata) < len(data):
+            return zipfile.ZIP_DEFLATED, crc, cdata, len(data)
+    return zipfile.ZIP_STORED, crc, data, len(data)
+
+
+def _deflate_stream(level, path, fileobj):
+    """compress a file into fileobj, returning (crc, compressed size, size)"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    crc = csize = size = 0
+    with open(path, 'rb') as f:
+        data = f.read(_readsize)
+        while data:
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            cdata = compressor.compress(data)
+            fileobj.write(cdata)
+            csize += len(cdata)
+            data = f.read(_readsize)
+    cdata = compressor.flush()
+    fileobj.write(cdata)
+    return crc, csize + len(cdata), size
+
+
+def _zip_members(entries, mtime, clamp):
+    """yield (archive name, lstat result, symlink target, mtime) for zip members"""
+    for path, st, link in entries:
+        if stat.S_ISDIR(st.st_mode):
+            path += '/'
+        elif not (stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode)):
+            # special files can't be stored in zip archives
+            continue
+        yield path, st, link, _clamp_mtime(st, mtime, clamp)
+
+
+def create_zip(fileobj, src, level=6, jobs=None, mtime=None):
+    """Write a zip archive of the contents of a directory.
+
+    Files are compressed on the thread pool, apart from large ones which
+    are compressed as they're written, followed by a data descriptor
+    holding their sizes and crc.  Unix modes and symlinks are stored as
+    unzip and :py:class:`snakeoil.compression.ArComp` expect.
+
+    :param fileobj: writable file object the archive is written to
+    :param src: directory to archive
+    :param level: deflate compression level
+    :param jobs: number of threads scanning, reading, and compressing files,
+        defaulting to the cpu count
+    :param mtime: if given, timestamp used for all members
+    """
+    mtime, clamp = _resolve_mtimes(mtime)
+    with ThreadPoolExecutor(max_workers=jobs or cpu_count()) as pool:
+        members = list(_zip_members(walk(src, pool), mtime, clamp))
+        total = sum(st.st_size for _, st, _, _ in members)
+        if len(members) >= 0xffff or total >= _zip_limit // 2:
+            return _create_zip64(fileobj, src, members, level)
+
+        files = ((path, st) for path, st, _, _ in members if stat.S_ISREG(st.st_mode))
+        reader = _ReadAhead(
+            pool, src, files, func=lambda path: _deflate(level, path))
+        central = []
+        offset = 0
+        try:
+            for path, st, link, member_mtime in members:
+                if stat.S_ISREG(st.st_mode):
+                    result = reader.get(path)
+                elif stat.S_ISLNK(st.st_mode):
+                    result = _deflate_data(level, os.fsencode(link))
+                else:
+                    result = (zipfile.ZIP_STORED, 0, b'', 0)
+                name = path.encode('utf-8', 'surrogateescape')
+                # flag names that aren't plain ascii as utf-8
+                flags = 0 if all(c < 0x80 for c in name) else 0x800
+                dostime, dosdate = _dostime(member_mtime)
+                if result is None:
+                    # too large to hold in memory, sizes and crc follow the data
+                    flags |= 0x8
+                    fileobj.write(_zip_local.pack(
+                        0x04034b50, 20, flags, zipfile.ZIP_DEFLATED, dostime, dosdate,
+                        0, 0, 0, len(name), 0))
+                    fileobj.write(name)
+                    crc, csize, size = _deflate_stream(level, os.path.join(src, path), fileobj)
+                    if size != st.st_size:
+                        raise OSError(f'file changed while archiving: {path!r}')
+                    fileobj.write(_zip_descriptor.pack(0x08074b50, crc, csize, size))
+                    header = (20, flags, zipfile.ZIP_DEFLATED, dostime, dosdate, crc, csize, size)
+                    length = _zip_local.size + len(name) + csize + _zip_descriptor.size
+                else:
+                    method, crc, data, size = result
+                    header = (20, flags, method, dostime, dosdate, crc, len(data), size)
+                    fileobj.write(_zip_local.pack(0x04034b50, *header, len(name), 0))
+                    fileobj.write(name)
+                    fileobj.write(data)
+                    length = _zip_local.size + len(name) + len(data)
+                attr = (st.st_mode & 0xffff) << 16
+                if stat.S_ISDIR(st.st_mode):
+                    # MS-DOS directory flag
+                    attr |= 0x10
+                central.append(_zip_central.pack(
+                    0x02014b50, (3 << 8) | 20, *header, len(name), 0, 0, 0, 0,
+                    attr, offset) + name)
+                offset += length
+        finally:
+            reader.cancel()
+        size = sum(len(x) for x in central)
+        for entry in central:
+            fileobj.write(entry)
+        fileobj.write(_zip_end.pack(
+            0x06054b50, 0, 0, len(central), len(central), size, offset, 0))
+
+
+def _create_zip64(fileobj, src, members, level):
+    """serially create zip archives too large for the plain zip format"""
+    # zipfile only accepts a compression level from python 3.7 on
+    kwargs = {'compresslevel': level} if sys.version_info >= (3, 7) else {}
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED, **kwargs) as archive:
+        for path, st, link, mtime in members:
+            info = zipfile.ZipInfo(path, _dostime_tuple(mtime))
+            info.create_system = 3
+            info.external_attr = (st.st_mode & 0xffff) << 16
+            if stat.S_ISDIR(st.st_mode):
+                info.external_attr |= 0x10
+                archive.writestr(info, b'')
+            elif stat.S_ISLNK(st.st_mode):
+                archive.writestr(info, os.fsencode(link))
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.file_size = st.st_size
+                with open(os.path.join(src, path), 'rb') as src_f, \
+                        archive.open(info, 'w', force_zip64=True) as f:
+                    data = src_f.read(_readsize)
+                    while data:
+                        f.write(data)
+                        data = src_f.read(_readsize)
+
+
+def _dostime_tuple(mtime):
+    return max(time.gmtime(mtime)[:6], (1980, 1, 1, 0, 0, 0))
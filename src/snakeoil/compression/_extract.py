@@ -0,0 +1,397 @@
+"""
+parallel archive extraction
+
+Archives are read and decompressed sequentially by the calling thread while
+creating files, writing their data, and setting their metadata is handed off
+to a pool of worker threads, overlapping the syscall heavy parts of
+extraction with decompression and with each other.
+
+Ordering is preserved per path: each member's task waits on outstanding
+tasks for the same path, for its parent directories (so files land in
+directories and behind symlinks created earlier in the archive), and for
+hardlinks, the link target.  Directory metadata is set last, deepest first,
+as tarfile does.
+
+Symlinks are barriers: members following one in the archive aren't created
+until it exists, so path containment checks done by workers right before
+creating a member resolve every symlink extracted earlier, as they do when
+extracting serially.
+"""
+
+__all__ = ("Extractor", "extract_tar", "extract_zip")
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from multiprocessing import cpu_count
+import os
+import stat
+import tarfile
+import threading
+
+# bytes of member data held in memory awaiting workers
+_max_pending = 64 * 1024 * 1024
+# members larger than this are written directly by the reading thread
+_max_queued = 8 * 1024 * 1024
+# members are handed to workers in batches, amortizing the handoff cost
+_batch_members = 32
+_batch_bytes = 1024 * 1024
+# batches between dropping finished tasks from the dependency map
+_prune_interval = 1024
+_readsize = 1024 * 1024
+
+
+class Extractor:
+    """Run archive member writes on a thread pool, ordered per path."""
+
+    def __init__(self, dest, jobs=None):
+        """
+        :param dest: directory members are extracted to
+        :param jobs: number of worker threads, defaults to the cpu count
+        """
+        self.dest = dest
+        self._realdest = os.path.realpath(dest)
+        self._pool = ThreadPoolExecutor(max_workers=jobs or cpu_count())
+        # relative path -> task of the most recently submitted batch writing it
+        self._tasks = {}
+        self._submitted = 0
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._error = None
+        self._deferred = []
+        # task creating the last symlink submitted
+        self._barrier = None
+        self._reset_batch()
+
+    def _reset_batch(self):
+        self._batch = []
+        self._batch_paths = []
+        self._batch_deps = set()
+        self._batch_size = 0
+
+    def target(self, path):
+        """Return the extraction path for a normalized member path."""
+        return os.path.join(self.dest, path)
+
+    def _deps(self, path, extra):
+        # paths written earlier in the current batch aren't in the map yet,
+        # they're ordered by running the batch sequentially.
+        deps = set()
+        if self._barrier is not None:
+            deps.add(self._barrier)
+        for dep in extra:
+            task = self._tasks.get(dep)
+            if task is not None:
+                deps.add(task)
+        while path:
+            task = self._tasks.get(path)
+            if task is not None:
+                deps.add(task)
+            path = os.path.dirname(path)
+        return deps
+
+    def _check_inside(self, target, parent):
+        """Raise OSError if parent resolves outside of the destination."""
+        resolved = os.path.realpath(parent)
+        if os.path.commonpath((self._realdest, resolved)) != self._realdest:
+            raise OSError(
+                f'{target!r} would be extracted to {resolved!r}, '
+                'which is outside the destination')
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self, deps, batch, size):
+        try:
+            wait(deps)
+            for func, target in batch:
+                # skip work once extraction has failed
+                if self._error is not None:
+                    break
+                parent = os.path.dirname(target)
+                self._check_inside(target, parent)
+                if parent and not os.path.exists(parent):
+                    # directories that aren't part of the archive
+                    os.makedirs(parent, exist_ok=True)
+                func(target)
+        except BaseException as e:
+            with self._cond:
+                if self._error is None:
+                    self._error = e
+        finally:
+            if size:
+                with self._cond:
+                    self._pending -= size
+                    self._cond.notify_all()
+
+    def _flush(self):
+        if not self._batch:
+            return
+        size = self._batch_size
+        with self._cond:
+            while self._pending and self._pending + size > _max_pending:
+                self._cond.wait()
+            self._pending += size
+        task = self._pool.submit(self._run, self._batch_deps, self._batch, size)
+        for path in self._batch_paths:
+            self._tasks[path] = task
+        self._reset_batch()
+        self._submitted += 1
+        if not self._submitted % _prune_interval:
+            self._tasks = {k: v for k, v in self._tasks.items() if not v.done()}
+        return task
+
+    def submit(self, path, func, deps=(), size=0, barrier=False):
+        """Queue func(target path) to create member `path`.
+
+        :param path: normalized member path relative to the destination
+        :param deps: other member paths that must be created first
+        :param size: bytes of member data held by func, bounding the amount
+            of queued data
+        :param barrier: whether all members submitted later must wait for
+            this one, used for symlinks
+        """
+        self._check()
+        self._batch_deps.update(self._deps(path, deps))
+        self._batch.append((func, self.target(path)))
+        self._batch_paths.append(path)
+        self._batch_size += size
+        if barrier:
+            self._barrier = self._flush()
+        elif len(self._batch) >= _batch_members or self._batch_size >= _batch_bytes:
+            self._flush()
+
+    def run(self, path, func, deps=()):
+        """Create member `path` with func(target path) in the calling thread.
+
+        Used for members whose data is too large to queue.
+        """
+        self._check()
+        self._flush()
+        deps = self._deps(path, deps)
+        self._tasks.pop(path, None)
+        self._run(deps, [(func, self.target(path))], 0)
+        self._check()
+
+    def defer(self, path, func):
+        """Run func(target path) after all members are created."""
+        self._deferred.append((path, func))
+
+    def close(self):
+        """Wait for all queued work, then run deferred calls.
+
+        The first error raised by any worker is reraised.
+        """
+        self._flush()
+        self._pool.shutdown(wait=True)
+        self._check()
+        self._deferred.sort(key=lambda x: x[0], reverse=True)
+        for path, func in self._deferred:
+            func(self.target(path))
+
+    def abort(self):
+        """Stop extracting, waiting for running workers to finish."""
+        if self._error is None:
+            self._error = InterruptedError('extraction aborted')
+        self._pool.shutdown(wait=True)
+
+
+def _normpath(name):
+    return os.path.normpath(name).lstrip('/')
+
+
+def _unlink(target):
+    # replace existing files rather than writing through them, they may be
+    # hardlinks to files outside the destination
+    try:
+        os.unlink(target)
+    except FileNotFoundError:
+        pass
+
+
+def _check_link(member, dest):
+    """Raise OSError if a hardlink's target resolves outside of dest."""
+    realdest = os.path.realpath(dest)
+    resolved = os.path.realpath(member._link_target)
+    if os.path.commonpath((realdest, resolved)) != realdest:
+        raise OSError(
+            f'{member.name!r} would link to {resolved!r}, '
+            'which is outside the destination')
+
+
+def _copy(src, f):
+    data = src.read(_readsize)
+    while data:
+        f.write(data)
+        data = src.read(_readsize)
+
+
+def _tar_attrs(tar, member, target):
+    try:
+        tar.chown(member, target, False)
+        if not member.issym():
+            tar.chmod(member, target)
+            tar.utime(member, target)
+    except tarfile.ExtractError:
+        # nonfatal at the default tarfile errorlevel
+        pass
+
+
+def _refilter(filter, dest, member):
+    # rerun the filter now that earlier symlinks exist on disk; the first
+    # pass in the reading thread can't resolve them.
+    if filter is not None and filter(member, dest) is None:
+        return False
+    return True
+
+
+def _tar_member(tar, member, data, target, dest, filter=None):
+    if not _refilter(filter, dest, member):
+        return
+    if data is not None:
+        _unlink(target)
+        with open(target, 'wb') as f:
+            f.write(data)
+    elif member.isdir():
+        tar.makedir(member, target)
+        return
+    elif member.isfifo():
+        tar.makefifo(member, target)
+    elif member.ischr() or member.isblk():
+        tar.makedev(member, target)
+    elif member.islnk() or member.issym():
+        if member.islnk():
+            # checked here, once symlinks earlier in the archive exist
+            _check_link(member, dest)
+        try:
+            tar.makelink(member, target)
+        except (KeyError, ValueError):
+            # hardlink target missing, members aren't retained to look it up
+            raise tarfile.ExtractError(
+                f'unable to resolve link inside archive: {member.linkname!r}')
+    _tar_attrs(tar, member, target)
+
+
+def _tar_stream(tar, member, target, dest, filter=None):
+    if not _refilter(filter, dest, member):
+        return
+    _unlink(target)
+    with open(target, 'wb') as f:
+        _copy(tar.extractfile(member), f)
+    _tar_attrs(tar, member, target)
+
+
+def extract_tar(tar, dest, jobs=None, filter=None):
+    """Extract all members of an open tarfile.
+
+    :param tar: tarfile, possibly opened in stream mode; members aren't
+        retained in its members list
+    :param dest: target directory
+    :param jobs: number of worker threads, defaults to the cpu count
+    :param filter: tarfile extraction filter (e.g. :py:func:`tarfile.data_filter`)
+        applied to members
+    """
+    extractor = Extractor(dest, jobs)
+    try:
+        while True:
+            member = tar.next()
+            if member is None:
+                break
+            # as with snakeoil.tar.StreamingTarFile, don't accumulate members
+            tar.members.clear()
+            if filter is not None:
+                member = filter(member, dest)
+                if member is None:
+                    continue
+            path = _normpath(member.name)
+            deps = ()
+            data = None
+            if member.islnk():
+                deps = (_normpath(member.linkname),)
+                # for makelink(), as extractall() sets it; link names are
+                # relative to the archive root, even absolute ones
+                member._link_target = os.path.join(dest, deps[0])
+            elif member.isdir():
+                extractor.defer(path, lambda target, member=member: _tar_attrs(tar, member, target))
+            elif member.isreg() or member.type not in tarfile.SUPPORTED_TYPES:
+                if member.size > _max_queued:
+                    extractor.run(
+                        path, lambda target: _tar_stream(tar, member, target, dest, filter))
+                    continue
+                data = tar.extractfile(member).read()
+            extractor.submit(
+                path,
+                lambda target, member=member, data=data: _tar_member(
+                    tar, member, data, target, dest, filter),
+                deps=deps, size=len(data) if data else 0, barrier=member.issym())
+    except BaseException:
+        extractor.abort()
+        raise
+    extractor.close()
+
+
+def _zip_path(name):
+    """sanitize a zip member name as zipfile does"""
+    name = os.path.splitdrive(name.replace('/', os.path.sep))[1]
+    invalid = ('', os.path.curdir, os.path.pardir)
+    return os.path.sep.join(x for x in name.split(os.path.sep) if x not in invalid)
+
+
+def _unlink_symlink(target):
+    # replace symlinks rather than writing through them
+    if os.path.islink(target):
+        os.unlink(target)
+
+
+def _zip_member(member, data, target):
+    # zipfile ignores unix modes and symlinks; restore them like unzip.
+    mode = member.external_attr >> 16 if member.create_system == 3 else 0
+    if stat.S_ISLNK(mode):
+        if os.path.lexists(target):
+            os.unlink(target)
+        os.symlink(data.decode('utf-8', 'surrogateescape'), target)
+        return
+    _unlink_symlink(target)
+    with open(target, 'wb') as f:
+        f.write(data)
+    if mode:
+        os.chmod(target, stat.S_IMODE(mode))
+
+
+def _zip_stream(archive, member, target):
+    _unlink_symlink(target)
+    with archive.open(member) as src, open(target, 'wb') as f:
+        _copy(src, f)
+    mode = member.external_attr >> 16 if member.create_system == 3 else 0
+    if mode:
+        os.chmod(target, stat.S_IMODE(mode))
+
+
+def extract_zip(archive, dest, jobs=None, members=None):
+    """Extract members of an open zipfile.
+
+    :param archive: zipfile.ZipFile instance
+    :param dest: target directory
+    :param jobs: number of worker threads, defaults to the cpu count
+    :param members: ZipInfo instances to extract, defaults to all
+    """
+    extractor = Extractor(dest, jobs)
+    try:
+        for member in archive.infolist() if members is None else members:
+            path = _zip_path(member.filename)
+            if not path:
+                continue
+            if member.is_dir():
+                extractor.submit(path, lambda target: os.makedirs(target, exist_ok=True))
+            elif member.file_size > _max_queued and not stat.S_ISLNK(member.external_attr >> 16):
+                extractor.run(path, lambda target: _zip_stream(archive, member, target))
+            else:
+                data = archive.read(member)
+                mode = member.external_attr >> 16 if member.create_system == 3 else 0
+                extractor.submit(
+                    path,
+                    lambda target, member=member, data=data: _zip_member(member, data, target),
+                    size=len(data), barrier=stat.S_ISLNK(mode))
+    except BaseException:
+        extractor.abort()
+        raise
+    extractor.close()
@@ -0,0 +1,43 @@
+"""
+gzip decompression/compression
+
+Uses the cpython gzip module; parallel compression writes BGZF members that
+any gzip implementation can read, and parallel decompression applies to BGZF
+input (see :py:mod:`snakeoil.compression._parallel`).
+"""
+
+__all__ = ("compress_data", "decompress_data")
+
+import gzip
+import zlib
+
+from . import _parallel
+
+parallelizable = True
+# errors raised by handles on corrupt data beyond EnvironmentError
+exceptions = (EOFError, zlib.error)
+
+
+def compress_data(data, level=9, parallelize=False):
+    if parallelize:
+        return _parallel.compress_data('gzip', data, level)
+    return gzip.compress(data, compresslevel=level)
+
+def decompress_data(data, parallelize=False):
+    if parallelize:
+        return _parallel.decompress_data('gzip', data)
+    return gzip.decompress(data)
+
+def compress_handle(handle, level=9, parallelize=False):
+    if parallelize:
+        return _parallel.compress_handle('gzip', handle, level)
+    elif isinstance(handle, int):
+        handle = open(handle, 'wb', closefd=False)
+    return gzip.open(handle, 'wb', compresslevel=level)
+
+def decompress_handle(handle, parallelize=False):
+    if parallelize:
+        return _parallel.decompress_handle('gzip', handle)
+    elif isinstance(handle, int):
+        handle = open(handle, 'rb', closefd=False)
+    return gzip.open(handle, 'rb')
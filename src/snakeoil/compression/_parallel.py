@@ -0,0 +1,629 @@
+"""
+in-process parallel block compression and decompression
+
+zlib, bz2 and lzma all release the GIL while (de)compressing, so working on
+independent blocks from a thread pool scales across cpus without spawning
+external binaries.
+
+Compressed output is split into independently decodable units that any
+standard decompressor handles:
+
+- gzip: BGZF members (as written by bgzip), which record their own size
+- bzip2: one stream per block, as pbzip2 does
+- xz: one stream per block
+
+Parallel decompression needs to locate those units without decoding the
+data in between:
+
+- gzip: BGZF members, via the block size stored in their headers
+- bzip2: streams, by scanning for stream headers
+- xz: blocks and streams, via the stream indexes (seekable input only)
+
+Input lacking such units (regular gzip output, single stream bzip2 or xz)
+is decompressed serially, optionally by a caller supplied fallback such as
+an external multithreaded decompressor.  The output of each task is bounded;
+tasks exceeding it (e.g. long bzip2 streams of highly compressible data) are
+decompressed incrementally by the reading thread instead.
+"""
+
+__all__ = ("compress_data", "decompress_data", "compress_handle", "decompress_handle")
+
+import bz2
+from collections import deque
+from concurrent import futures
+import io
+import lzma
+from multiprocessing import cpu_count
+import os
+import re
+import struct
+import zlib
+
+# chunk size used when reading compressed input
+_readsize = 64 * 1024
+# compressed units larger than this are decompressed serially rather than
+# held in memory.
+_max_unit = 64 * 1024 * 1024
+# decompression units are grouped into tasks of at least this many bytes to
+# amortize the thread pool overhead for small units.
+_min_task = 1024 * 1024
+# decompressed bytes a task may hold in memory
+_max_output = 64 * 1024 * 1024
+
+_pool = None
+
+
+def _get_pool():
+    global _pool # pylint: disable=global-statement
+    # pools don't survive fork, children get their own.
+    if _pool is None or _pool[0] != os.getpid():
+        _pool = (os.getpid(), futures.ThreadPoolExecutor(cpu_count()))
+    return _pool[1]
+
+
+def _max_inflight():
+    return 2 * cpu_count()
+
+
+def _read_exact(f, size):
+    chunks = []
+    while size > 0:
+        data = f.read(size)
+        if not data:
+            break
+        chunks.append(data)
+        size -= len(data)
+    return b''.join(chunks)
+
+
+class _Serial:
+    """Marker for input the splitter can't handle.
+
+    Everything from here on (starting with the already consumed `prefix`)
+    is decompressed serially.
+    """
+
+    __slots__ = ("prefix",)
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+
+class _Format:
+    """Base block format support."""
+
+    name = None
+    # appended to parallel compressed output
+    trailer = b''
+
+    def compress_blocksize(self, level):
+        raise NotImplementedError
+
+    def compress_block(self, data, level):
+        raise NotImplementedError
+
+    def decompressor(self):
+        """return an incremental decompressor for a single member/stream"""
+        raise NotImplementedError
+
+    def split(self, f):
+        """yield independently decodable units of compressed data
+
+        May finish by yielding a :py:class:`_Serial` instance.
+        """
+        raise NotImplementedError
+
+    def decompress_units(self, units, max_output=None):
+        """decompress units in memory
+
+        :return: the decompressed data, or None if it would exceed
+            `max_output` bytes (defaulting to `_max_output`)
+        """
+        if max_output is None:
+            max_output = _max_output
+        out = []
+        size = 0
+        for data in units:
+            while data:
+                decomp = self.decompressor()
+                # asking for one byte past the limit tells hitting it apart
+                # from the unit ending exactly there
+                chunk = decomp.decompress(data, max_output - size + 1)
+                size += len(chunk)
+                if size > max_output:
+                    return None
+                out.append(chunk)
+                if not decomp.eof:
+                    raise EOFError(
+                        f'{self.name} block ended before the end-of-stream marker')
+                data = decomp.unused_data
+        return b''.join(out)
+
+    def iter_units(self, units):
+        """decompress units incrementally, yielding output as it's produced"""
+        for data in units:
+            while data:
+                decomp = self.decompressor()
+                for start in range(0, len(data), _readsize):
+                    out = decomp.decompress(data[start:start + _readsize])
+                    if out:
+                        yield out
+                    if decomp.eof:
+                        data = decomp.unused_data + data[start + _readsize:]
+                        break
+                else:
+                    raise EOFError(
+                        f'{self.name} block ended before the end-of-stream marker')
+
+    def decompress_stream(self, data, f):
+        """serially decompress `data` followed by the rest of file object `f`"""
+        decomp = self.decompressor()
+        # whether any input went to the current decompressor
+        fed = False
+        started = False
+        # fed in slices, bounding the output of each call
+        data = memoryview(data)
+        while True:
+            if not data:
+                data = memoryview(f.read(_readsize))
+                if not data:
+                    break
+            chunk = data[:_readsize]
+            data = data[_readsize:]
+            try:
+                out = decomp.decompress(chunk)
+            except (OSError, EOFError, lzma.LZMAError, zlib.error):
+                if started:
+                    # trailing garbage after valid data is ignored, matching
+                    # the bz2 and lzma modules.
+                    return
+                raise
+            fed = True
+            if out:
+                yield out
+            if decomp.eof:
+                started = True
+                data = memoryview(decomp.unused_data + data)
+                decomp = self.decompressor()
+                fed = False
+        if fed:
+            raise EOFError(
+                'compressed file ended before the end-of-stream marker was reached')
+
+
+class _GzipFormat(_Format):
+
+    name = 'gzip'
+    # BGZF's end of file marker, an empty member
+    trailer = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+    _header = struct.Struct('<4sIBBH2s2sH')
+    # uncompressed bytes per BGZF member; small enough that the compressed
+    # member always fits the 16 bit size field.
+    _member_size = 0xff00
+
+    def compress_blocksize(self, level):
+        return 16 * self._member_size
+
+    def compress_block(self, data, level):
+        out = []
+        for start in range(0, max(len(data), 1), self._member_size):
+            chunk = data[start:start + self._member_size]
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            cdata = compressor.compress(chunk) + compressor.flush()
+            size = self._header.size + len(cdata) + 8
+            out.append(self._header.pack(
+                b'\x1f\x8b\x08\x04', 0, 0, 0xff, 6, b'BC', b'\x02\x00', size - 1))
+            out.append(cdata)
+            out.append(struct.pack('<II', zlib.crc32(chunk), len(chunk) & 0xffffffff))
+        return b''.join(out)
+
+    def decompressor(self):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def split(self, f):
+        while True:
+            header = _read_exact(f, 12)
+            if not header:
+                return
+            if len(header) < 12 or header[:4] != b'\x1f\x8b\x08\x04':
+                yield _Serial(header)
+                return
+            xlen = struct.unpack('<H', header[10:12])[0]
+            extra = _read_exact(f, xlen)
+            size = self._bsize(extra)
+            if size is None or size < 12 + len(extra) + 8:
+                yield _Serial(header + extra)
+                return
+            rest = _read_exact(f, size - 12 - len(extra))
+            if len(rest) != size - 12 - len(extra):
+                yield _Serial(header + extra + rest)
+                return
+            yield header + extra + rest
+
+    @staticmethod
+    def _bsize(extra):
+        # walk the extra subfields looking for BGZF's block size
+        pos = 0
+        while pos + 4 <= len(extra):
+            sid = extra[pos:pos + 2]
+            slen = struct.unpack('<H', extra[pos + 2:pos + 4])[0]
+            if sid == b'BC' and slen == 2 and pos + 6 <= len(extra):
+                return struct.unpack('<H', extra[pos + 4:pos + 6])[0] + 1
+            pos += 4 + slen
+        return None
+
+
+class _Bzip2Format(_Format):
+
+    name = 'bzip2'
+    # stream header followed by the first block's magic; the bit aligned
+    # block magic of later blocks inside a stream can't be matched here.
+    _magic = re.compile(rb'BZh[1-9]1AY&SY')
+
+    def compress_blocksize(self, level):
+        # one bzip2 block per stream
+        return level * 100000
+
+    def compress_block(self, data, level):
+        return bz2.compress(data, level)
+
+    def decompressor(self):
+        return bz2.BZ2Decompressor()
+
+    def split(self, f):
+        pending = bytearray(f.read(_readsize))
+        if not self._magic.match(pending):
+            yield _Serial(bytes(pending))
+            return
+        searched = 1
+        split = False
+        while True:
+            match = self._magic.search(pending, searched)
+            if match is not None:
+                yield bytes(pending[:match.start()])
+                del pending[:match.start()]
+                searched = 1
+                split = True
+                continue
+            if len(pending) > _max_unit:
+                yield _Serial(bytes(pending))
+                return
+            # the magic may straddle reads
+            searched = max(1, len(pending) - 9)
+            data = f.read(_readsize)
+            if not data:
+                if not split:
+                    # a single stream, nothing to parallelize
+                    yield _Serial(bytes(pending))
+                elif pending:
+                    yield bytes(pending)
+                return
+            pending += data
+
+
+class _XzFormat(_Format):
+
+    name = 'xz'
+    _magic = b'\xfd7zXZ\x00'
+    # dictionary sizes of the lzma presets
+    _dict_sizes = (
+        256 * 1024, 1 << 20, 2 << 20, 4 << 20, 4 << 20,
+        8 << 20, 8 << 20, 16 << 20, 32 << 20, 64 << 20)
+
+    def compress_blocksize(self, level):
+        # matches the block size xz uses when threaded
+        return 3 * self._dict_sizes[level & 0xf]
+
+    def compress_block(self, data, level):
+        return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+
+    def decompressor(self):
+        return lzma.LZMADecompressor()
+
+    def split(self, f):
+        try:
+            base = f.tell()
+        except OSError:
+            # not seekable
+            yield _Serial(b'')
+            return
+        try:
+            blocks = self.blocks(f, base)
+        except (OSError, ValueError, IndexError, struct.error):
+            blocks = None
+        f.seek(base)
+        if (blocks is None or len(blocks) < 2 or
+                any(((x[2] + 3) & ~3) > _max_unit for x in blocks)):
+            yield _Serial(b'')
+            return
+        for flags, offset, unpadded, uncompressed in blocks:
+            f.seek(offset)
+            data = _read_exact(f, (unpadded + 3) & ~3)
+            yield self._wrap(flags, data, unpadded, uncompressed)
+
+    def blocks(self, f, base=0):
+        """return (stream flags, offset, unpadded size, uncompressed size) for all blocks
+
+        Streams are walked backwards from the end of the file via their
+        footers and indexes.
+        """
+        end = f.seek(0, io.SEEK_END)
+        streams = []
+        while end > base:
+            f.seek(end - 4)
+            if f.read(4) == b'\x00' * 4:
+                # stream padding
+                end -= 4
+                continue
+            f.seek(end - 12)
+            footer = _read_exact(f, 12)
+            if (footer[10:] != b'YZ' or
+                    zlib.crc32(footer[4:10]) != struct.unpack('<I', footer[:4])[0]):
+                raise ValueError('invalid xz stream footer')
+            index_size = (struct.unpack('<I', footer[4:8])[0] + 1) * 4
+            flags = footer[8:10]
+            f.seek(end - 12 - index_size)
+            index = _read_exact(f, index_size)
+            if index[0] != 0 or zlib.crc32(index[:-4]) != struct.unpack('<I', index[-4:])[0]:
+                raise ValueError('invalid xz index')
+            count, pos = _read_varint(index, 1)
+            records = []
+            for _ in range(count):
+                unpadded, pos = _read_varint(index, pos)
+                uncompressed, pos = _read_varint(index, pos)
+                records.append((unpadded, uncompressed))
+            start = end - 12 - index_size - 12 - sum((x + 3) & ~3 for x, _ in records)
+            if start < base:
+                raise ValueError('invalid xz index')
+            f.seek(start)
+            header = _read_exact(f, 12)
+            if header[:6] != self._magic or header[6:8] != flags:
+                raise ValueError('invalid xz stream header')
+            offset = start + 12
+            blocks = []
+            for unpadded, uncompressed in records:
+                blocks.append((flags, offset, unpadded, uncompressed))
+                offset += (unpadded + 3) & ~3
+            streams.append(blocks)
+            end = start
+        return [block for blocks in reversed(streams) for block in blocks]
+
+    def _wrap(self, flags, block, unpadded, uncompressed):
+        """wrap a block in a stream of its own
+
+        The block is kept as is, so its integrity check is still verified.
+        """
+        return b''.join((
+            self.stream_header(flags), block,
+            self.stream_trailer(flags, unpadded, uncompressed)))
+
+    def stream_header(self, flags):
+        return self._magic + flags + struct.pack('<I', zlib.crc32(flags))
+
+    @staticmethod
+    def stream_trailer(flags, unpadded, uncompressed):
+        """index and footer of a stream holding a single block"""
+        index = b'\x00' + _varint(1) + _varint(unpadded) + _varint(uncompressed)
+        index += b'\x00' * (-len(index) % 4)
+        index += struct.pack('<I', zlib.crc32(index))
+        backward = struct.pack('<I', len(index) // 4 - 1) + flags
+        return index + struct.pack('<I', zlib.crc32(backward)) + backward + b'YZ'
+
+
+def _varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+        if shift > 63:
+            raise ValueError('invalid xz varint')
+
+
+formats = {x.name: x for x in (_GzipFormat(), _Bzip2Format(), _XzFormat())}
+
+
+def _iter_tasks(units):
+    """group small units into tasks of at least _min_task bytes"""
+    task = []
+    size = 0
+    for unit in units:
+        if isinstance(unit, _Serial):
+            if task:
+                yield task
+            yield unit
+            return
+        task.append(unit)
+        size += len(unit)
+        if size >= _min_task:
+            yield task
+            task = []
+            size = 0
+    if task:
+        yield task
+
+
+class _ParallelReader(io.RawIOBase):
+    """Decompressed view of a file, decoding units on the thread pool."""
+
+    def __init__(self, fmt, fileobj, close_fileobj=True, serial=None):
+        super().__init__()
+        self._fmt = fmt
+        self._fileobj = fileobj
+        self._close_fileobj = close_fileobj
+        self._serial = serial
+        self._chunks = self._iter_chunks()
+        self._chunk = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._chunk:
+            try:
+                self._chunk = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        size = min(len(b), len(self._chunk))
+        b[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def _iter_chunks(self):
+        pool = _get_pool()
+        inflight = deque()
+        tail = None
+        for task in _iter_tasks(self._fmt.split(self._fileobj)):
+            if isinstance(task, _Serial):
+                tail = task.prefix
+                break
+            inflight.append((task, pool.submit(self._fmt.decompress_units, task)))
+            while len(inflight) >= _max_inflight():
+                yield from self._result(*inflight.popleft())
+        while inflight:
+            yield from self._result(*inflight.popleft())
+        if tail is not None:
+            if self._serial is not None:
+                yield from self._serial(tail, self._fileobj)
+            else:
+                yield from self._fmt.decompress_stream(tail, self._fileobj)
+
+    def _result(self, task, future):
+        data = future.result()
+        if data is None:
+            # too large to hold in memory at once
+            yield from self._fmt.iter_units(task)
+        else:
+            yield data
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._chunks.close()
+            if self._close_fileobj:
+                self._fileobj.close()
+        finally:
+            super().close()
+
+
+class _ParallelWriter(io.RawIOBase):
+    """File object compressing blocks of written data on the thread pool."""
+
+    def __init__(self, fmt, fileobj, level, close_fileobj=True):
+        super().__init__()
+        self._fmt = fmt
+        self._fileobj = fileobj
+        self._level = level
+        self._close_fileobj = close_fileobj
+        self._blocksize = fmt.compress_blocksize(level)
+        self._buf = bytearray()
+        self._inflight = deque()
+        self._written = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        with memoryview(data) as view:
+            size = view.nbytes
+            self._buf += view
+        while len(self._buf) >= self._blocksize:
+            self._submit(bytes(self._buf[:self._blocksize]))
+            del self._buf[:self._blocksize]
+        return size
+
+    def _submit(self, block):
+        self._inflight.append(
+            _get_pool().submit(self._fmt.compress_block, block, self._level))
+        self._written = True
+        while len(self._inflight) >= _max_inflight():
+            self._fileobj.write(self._inflight.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buf or not self._written:
+                # empty input still results in a valid (empty) stream
+                self._submit(bytes(self._buf))
+                self._buf.clear()
+            while self._inflight:
+                self._fileobj.write(self._inflight.popleft().result())
+            self._fileobj.write(self._fmt.trailer)
+            self._fileobj.flush()
+        finally:
+            try:
+                if self._close_fileobj:
+                    self._fileobj.close()
+            finally:
+                super().close()
+
+
+def _open(handle, mode):
+    """return a (file object, should close) pair for a path, fd, or file object"""
+    if isinstance(handle, str):
+        return open(handle, mode), True
+    elif isinstance(handle, int):
+        return open(handle, mode, closefd=False), True
+    return handle, False
+
+
+def compress_data(fmt, data, level=9):
+    """compress data in parallel blocks
+
+    :param fmt: compression format name, one of :py:data:`formats`
+    """
+    fmt = formats[fmt]
+    blocksize = fmt.compress_blocksize(level)
+    with memoryview(data) as view:
+        blocks = [bytes(view[i:i + blocksize])
+                  for i in range(0, max(len(view), 1), blocksize)]
+    compressed = _get_pool().map(fmt.compress_block, blocks, [level] * len(blocks))
+    return b''.join(compressed) + fmt.trailer
+
+
+def decompress_data(fmt, data, serial=None):
+    """decompress data, decoding independent units in parallel
+
+    See :py:func:`decompress_handle` for `serial`.
+    """
+    with decompress_handle(fmt, io.BytesIO(data), serial=serial) as f:
+        return f.read()
+
+
+def compress_handle(fmt, handle, level=9):
+    """return a writable file object compressing data in parallel blocks
+
+    :param handle: file path, file descriptor, or file object the compressed
+        data is written to
+    """
+    fileobj, close = _open(handle, 'wb')
+    return _ParallelWriter(formats[fmt], fileobj, level, close_fileobj=close)
+
+
+def decompress_handle(fmt, handle, serial=None):
+    """return a readable file object decompressing a file in parallel
+
+    :param handle: file path, file descriptor, or file object the compressed
+        data is read from
+    :param serial: callable used for input that can't be split into units,
+        passed the already consumed prefix of that input and the file object
+        holding the rest; returns an iterable of decompressed chunks.
+        Defaults to decompressing in-process.
+    """
+    fileobj, close = _open(handle, 'rb')
+    return io.BufferedReader(_ParallelReader(
+        formats[fmt], fileobj, close_fileobj=close, serial=serial))
@@ -0,0 +1,489 @@
+"""
+random access to compressed files
+
+A :py:class:`SeekableReader` builds a sparse index of checkpoints into the
+compressed data, each one a point decoding can restart from.  Seeking then
+decodes from the closest checkpoint preceding the target offset rather than
+from the start of the file, and forward seeks keep decoding from the
+current position when that's closer.
+
+Checkpoints per format:
+
+- gzip: member starts (so BGZF and other multi member files are fully
+  indexed), plus snapshots of the decompressor state every `spacing` bytes
+  within members.  zlib state can't be serialized, so only member starts are
+  persisted; snapshots are retaken as data is decoded.
+- bzip2: block starts, located by scanning for the bit aligned block magic.
+  Each block is decoded by rewrapping it as a standalone stream.
+- xz: block starts, read from the stream indexes.  Threaded xz writes many
+  blocks, single threaded xz a single one.
+
+Building the index for gzip and bzip2 requires decoding the whole file
+once; pass `index_path` to persist indexes between runs.  Persisted indexes
+are keyed to the compressed file's size and mtime, and rebuilt if it changed.
+"""
+
+__all__ = ("SeekableReader", "open_seekable")
+
+import bisect
+import bz2
+import io
+import json
+import lzma
+import os
+import zlib
+
+from ..fileutils import AtomicWriteFile
+from ._parallel import formats as _parallel_formats
+
+# chunk size used when reading compressed input
+_readsize = 64 * 1024
+# upper bound on the output of a single decompression call
+_chunksize = 256 * 1024
+_index_version = 1
+
+
+class _Codec:
+    """Checkpoint support for a compression format.
+
+    Checkpoints are (uncompressed offset, state) pairs, where state is
+    whatever the codec needs to restart decoding there.
+    """
+
+    name = None
+
+    def __init__(self, f, spacing):
+        self.fd = f.fileno()
+        self.f = f
+        self.spacing = spacing
+
+    def build(self, add):
+        """find all checkpoints, passing each to `add`; returns the uncompressed size"""
+        raise NotImplementedError
+
+    def dump(self):
+        """return the persistable checkpoints as json compatible data"""
+        raise NotImplementedError
+
+    def load(self, data, add):
+        """restore checkpoints previously returned by :py:meth:`dump`"""
+        raise NotImplementedError
+
+    def decode(self, uoffset, state, add):
+        """yield decompressed data from a checkpoint to the end of the file
+
+        Newly found checkpoints may be passed to `add` along the way.
+        """
+        raise NotImplementedError
+
+
+class _GzipCodec(_Codec):
+
+    name = 'gzip'
+
+    def __init__(self, f, spacing):
+        super().__init__(f, spacing)
+        self.members = []
+
+    def build(self, add):
+        size = 0
+        for data in self.decode(0, (0, None), add):
+            size += len(data)
+        return size
+
+    def dump(self):
+        return self.members
+
+    def load(self, data, add):
+        self.members = [tuple(x) for x in data]
+        for uoffset, coffset in self.members:
+            add(uoffset, (coffset, None))
+
+    def _add_member(self, add, uoffset, coffset):
+        if not self.members or self.members[-1][1] < coffset:
+            self.members.append((uoffset, coffset))
+        add(uoffset, (coffset, None))
+
+    def decode(self, uoffset, state, add):
+        coffset, snapshot = state
+        if snapshot is None:
+            self._add_member(add, uoffset, coffset)
+            decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            # copy, so the snapshot can be reused
+            decomp = snapshot.copy()
+        fed = snapshot is not None
+        last = uoffset
+        while True:
+            data = os.pread(self.fd, _readsize, coffset)
+            if not fed and data[:2] != b'\x1f\x8b':
+                # end of file, or trailing garbage after the last member
+                return
+            coffset += len(data)
+            if not data:
+                raise EOFError(
+                    'compressed file ended before the end-of-stream marker was reached')
+            while data:
+                out = decomp.decompress(data, _chunksize)
+                fed = True
+                data = decomp.unconsumed_tail
+                if out:
+                    yield out
+                    uoffset += len(out)
+                if decomp.eof:
+                    # the next member starts right after this one
+                    coffset -= len(decomp.unused_data)
+                    self._add_member(add, uoffset, coffset)
+                    decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    fed = False
+                    last = uoffset
+                    break
+                if uoffset - last >= self.spacing:
+                    add(uoffset, (coffset - len(data), decomp.copy()))
+                    last = uoffset
+
+
+def _bit_patterns(magic):
+    """yield search data for a 48 bit magic at each bit alignment
+
+    Yields (bit shift, bytes fully covered by the magic, offset of those
+    bytes, all bytes the magic touches, mask of the magic's bits in them).
+    """
+    for shift in range(8):
+        nbytes = 6 if shift == 0 else 7
+        value = (magic << (nbytes * 8 - 48 - shift)).to_bytes(nbytes, 'big')
+        mask = (((1 << 48) - 1) << (nbytes * 8 - 48 - shift)).to_bytes(nbytes, 'big')
+        full = [i for i in range(nbytes) if mask[i] == 0xff]
+        yield shift, value[full[0]:full[-1] + 1], full[0], value, mask
+
+
+class _Bzip2Codec(_Codec):
+
+    name = 'bzip2'
+    _block_magic = 0x314159265359
+    _eos_magic = 0x177245385090
+    _patterns = (
+        tuple(_bit_patterns(_block_magic)),
+        tuple(_bit_patterns(_eos_magic)),
+    )
+
+    def __init__(self, f, spacing):
+        super().__init__(f, spacing)
+        # (start bit, end bit) of every block
+        self.blocks = []
+        self._uoffsets = []
+
+    def _scan(self):
+        """return sorted (bit offset, is block) pairs for all block and end of stream magics"""
+        hits = []
+        tail = b''
+        base = 0
+        while True:
+            data = os.pread(self.fd, _readsize, base + len(tail))
+            if not data:
+                break
+            buf = tail + data
+            for is_block, patterns in zip((False, True), reversed(self._patterns)):
+                for shift, needle, lead, value, mask in patterns:
+                    pos = buf.find(needle)
+                    while pos != -1:
+                        start = pos - lead
+                        # magics entirely within the tail were found last round
+                        if (start >= 0 and start + len(value) <= len(buf) and
+                                start + len(value) > len(tail) and
+                                all(buf[start + i] & mask[i] == value[i]
+                                    for i in range(len(value)))):
+                            hits.append(((base + start) * 8 + shift, is_block))
+                        pos = buf.find(needle, pos + 1)
+            tail = buf[-7:]
+            base += len(buf) - len(tail)
+        hits.sort()
+        return hits
+
+    def build(self, add):
+        hits = self._scan()
+        blocks = [(start, end) for (start, is_block), (end, _) in zip(hits, hits[1:])
+                  if is_block]
+        uoffset = 0
+        for start, end in blocks:
+            self._add_block(add, uoffset, start, end)
+            for data in self._decode_block(start, end):
+                uoffset += len(data)
+        return uoffset
+
+    def dump(self):
+        return [(u, start, end) for u, (start, end) in zip(self._uoffsets, self.blocks)]
+
+    def load(self, data, add):
+        for uoffset, start, end in data:
+            self._add_block(add, uoffset, start, end)
+
+    def _add_block(self, add, uoffset, start, end):
+        self.blocks.append((start, end))
+        self._uoffsets.append(uoffset)
+        add(uoffset, (start, end))
+
+    def _wrap_block(self, start, end):
+        """wrap a block's bits in a stream of its own"""
+        first = start // 8
+        last = (end + 7) // 8
+        raw = os.pread(self.fd, last - first, first)
+        if len(raw) != last - first:
+            raise EOFError('compressed file ended before the end of a block')
+        nbits = end - start
+        bits = (int.from_bytes(raw, 'big') >> (last * 8 - end)) & ((1 << nbits) - 1)
+        # a single block stream's crc is that of its block, which directly
+        # follows the block magic.
+        crc = (bits >> (nbits - 80)) & 0xffffffff
+        value = int.from_bytes(b'BZh9', 'big')
+        value = (((value << nbits | bits) << 48 | self._eos_magic) << 32) | crc
+        total = 32 + nbits + 80
+        pad = -total % 8
+        return (value << pad).to_bytes((total + pad) // 8, 'big')
+
+    def _decode_block(self, start, end):
+        decomp = bz2.BZ2Decompressor()
+        out = decomp.decompress(self._wrap_block(start, end), _chunksize)
+        while True:
+            if out:
+                yield out
+            if decomp.eof:
+                return
+            elif decomp.needs_input:
+                raise EOFError('bzip2 block ended before the end-of-stream marker')
+            out = decomp.decompress(b'', _chunksize)
+
+    def decode(self, uoffset, state, add):
+        idx = bisect.bisect_left(self.blocks, state)
+        for start, end in self.blocks[idx:]:
+            yield from self._decode_block(start, end)
+
+
+class _XzCodec(_Codec):
+
+    name = 'xz'
+
+    def __init__(self, f, spacing):
+        super().__init__(f, spacing)
+        self.blocks = []
+
+    def build(self, add):
+        self.f.seek(0)
+        uoffset = 0
+        for flags, offset, unpadded, uncompressed in _parallel_formats['xz'].blocks(self.f):
+            self._add_block(add, uoffset, (flags, offset, unpadded, uncompressed))
+            uoffset += uncompressed
+        return uoffset
+
+    def dump(self):
+        return [(u, flags.hex(), offset, unpadded, uncompressed)
+                for u, (flags, offset, unpadded, uncompressed) in self.blocks]
+
+    def load(self, data, add):
+        for uoffset, flags, offset, unpadded, uncompressed in data:
+            self._add_block(
+                add, uoffset, (bytes.fromhex(flags), offset, unpadded, uncompressed))
+
+    def _add_block(self, add, uoffset, block):
+        self.blocks.append((uoffset, block))
+        add(uoffset, block)
+
+    def _decode_block(self, flags, offset, unpadded, uncompressed):
+        xz = _parallel_formats['xz']
+        decomp = lzma.LZMADecompressor(lzma.FORMAT_XZ)
+        remaining = (unpadded + 3) & ~3
+
+        def feed():
+            nonlocal offset, remaining
+            yield xz.stream_header(flags)
+            while remaining:
+                data = os.pread(self.fd, min(_readsize, remaining), offset)
+                if not data:
+                    raise EOFError('compressed file ended before the end of a block')
+                offset += len(data)
+                remaining -= len(data)
+                yield data
+            yield xz.stream_trailer(flags, unpadded, uncompressed)
+
+        for data in feed():
+            out = decomp.decompress(data, _chunksize)
+            while True:
+                if out:
+                    yield out
+                if decomp.eof or decomp.needs_input:
+                    break
+                out = decomp.decompress(b'', _chunksize)
+        if not decomp.eof:
+            raise EOFError('xz block ended before the end-of-stream marker')
+
+    def decode(self, uoffset, state, add):
+        idx = bisect.bisect_left(self.blocks, (uoffset,))
+        for _, block in self.blocks[idx:]:
+            yield from self._decode_block(*block)
+
+
+_codecs = {x.name: x for x in (_GzipCodec, _Bzip2Codec, _XzCodec)}
+
+_magics = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bzip2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+)
+
+
+def _detect(f):
+    magic = os.pread(f.fileno(), 6, 0)
+    for prefix, fmt in _magics:
+        if magic.startswith(prefix):
+            return fmt
+    raise ValueError(f'unsupported compression format: {f.name!r}')
+
+
+class SeekableReader(io.RawIOBase):
+    """Random access, read only view of the decompressed contents of a file.
+
+    :ivar format: compression format of the file
+    :ivar size: size of the decompressed data
+    """
+
+    def __init__(self, path, fmt=None, index_path=None, spacing=4 * 1024 * 1024):
+        """
+        :param path: compressed file path
+        :param fmt: compression format, one of gzip, bzip2, or xz; detected
+            from the file's magic if not given
+        :param index_path: file path the checkpoint index is loaded from and
+            saved to; if None, the index is only kept in memory
+        :param spacing: uncompressed bytes between in memory gzip checkpoints
+        """
+        super().__init__()
+        self.path = path
+        self._f = open(path, 'rb')
+        try:
+            self.format = _detect(self._f) if fmt is None else fmt
+            self._codec = _codecs[self.format](self._f, spacing)
+            self._offsets = []
+            self._states = []
+            self.size = self._load_index(index_path)
+        except BaseException:
+            self._f.close()
+            raise
+        self._pos = 0
+        self._decoder = None
+        # uncompressed offset of the start of _buf
+        self._dpos = 0
+        self._buf = memoryview(b'')
+
+    def _add_checkpoint(self, uoffset, state):
+        idx = bisect.bisect_left(self._offsets, uoffset)
+        if idx < len(self._offsets) and self._offsets[idx] == uoffset:
+            return
+        self._offsets.insert(idx, uoffset)
+        self._states.insert(idx, state)
+
+    def _load_index(self, index_path):
+        st = os.fstat(self._f.fileno())
+        key = {
+            'version': _index_version,
+            'format': self.format,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+        }
+        if index_path is not None:
+            try:
+                with open(index_path) as f:
+                    data = json.load(f)
+                if data['key'] == key:
+                    self._codec.load(data['checkpoints'], self._add_checkpoint)
+                    return data['size']
+            except (EnvironmentError, ValueError, KeyError, TypeError):
+                pass
+            self._codec = type(self._codec)(self._f, self._codec.spacing)
+            self._offsets, self._states = [], []
+
+        size = self._codec.build(self._add_checkpoint)
+        if not self._offsets:
+            # empty file
+            self._add_checkpoint(0, None)
+        if index_path is not None:
+            data = {'key': key, 'size': size, 'checkpoints': self._codec.dump()}
+            try:
+                f = AtomicWriteFile(index_path)
+                try:
+                    json.dump(data, f)
+                except BaseException:
+                    f.discard()
+                    raise
+                f.close()
+            except EnvironmentError:
+                # persisting the index is purely an optimization
+                pass
+        return size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f'invalid whence: {whence!r}')
+        if pos < 0:
+            raise ValueError(f'negative seek position: {pos!r}')
+        self._pos = pos
+        return pos
+
+    def _position(self, target):
+        """ready the decoder to return data from offset `target`"""
+        idx = bisect.bisect_right(self._offsets, target) - 1
+        start = self._offsets[idx]
+        if self._decoder is None or target < self._dpos or start > self._dpos:
+            self._decoder = self._codec.decode(start, self._states[idx], self._add_checkpoint)
+            self._dpos = start
+            self._buf = memoryview(b'')
+        while self._dpos < target:
+            if not self._buf:
+                self._buf = memoryview(next(self._decoder))
+            skip = min(len(self._buf), target - self._dpos)
+            self._buf = self._buf[skip:]
+            self._dpos += skip
+
+    def readinto(self, b):
+        if self._pos >= self.size:
+            return 0
+        self._position(self._pos)
+        if not self._buf:
+            self._buf = memoryview(next(self._decoder))
+        size = min(len(b), len(self._buf))
+        b[:size] = self._buf[:size]
+        self._buf = self._buf[size:]
+        self._dpos += size
+        self._pos += size
+        return size
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._decoder is not None:
+                self._decoder.close()
+            self._f.close()
+        finally:
+            super().close()
+
+
+def open_seekable(path, fmt=None, index_path=None, **kwds):
+    """open a compressed file for buffered random access reads
+
+    See :py:class:`SeekableReader` for the parameters.
+    """
+    return io.BufferedReader(SeekableReader(path, fmt, index_path, **kwds))
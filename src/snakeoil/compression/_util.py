@@ -3,6 +3,7 @@ __all__ = ("compress_data", "decompress_data")
 import errno
 import os
 import subprocess
+import threading
 
 
 def _drive_process(args, mode, data):
@@ -171,3 +172,47 @@ def decompress_handle(binary_path, handle, extra_args=()):
     args = [binary_path, '-dc']
     args.extend(extra_args)
     return _process_handle(handle, args, True)
+
+
+def decompress_stream(binary_path, prefix, fileobj, extra_args=(), readsize=64 * 1024):
+    """decompress `prefix` followed by the rest of `fileobj` via a binary
+
+    :return: iterator of decompressed chunks
+    """
+    args = [binary_path, '-dc']
+    args.extend(extra_args)
+    p = subprocess.Popen(
+        args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL, close_fds=True)
+
+    def feed():
+        try:
+            data = prefix
+            while data:
+                p.stdin.write(data)
+                data = fileobj.read(readsize)
+        except (BrokenPipeError, ValueError):
+            # the process exited early, its exit status is reported below
+            pass
+        finally:
+            try:
+                p.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        data = p.stdout.read1(readsize)
+        while data:
+            yield data
+            data = p.stdout.read1(readsize)
+        if p.wait() != 0:
+            raise EOFError(
+                "decompression returned %i exitcode from '%s'" % (p.returncode, ' '.join(args)))
+    finally:
+        if p.returncode is None:
+            p.kill()
+            p.wait()
+        feeder.join()
+        p.stdout.close()
@@ -0,0 +1,43 @@
+"""
+xz decompression/compression
+
+Uses the cpython lzma module; parallel compression writes one xz stream per
+block, and parallel decompression applies to any input holding multiple
+blocks or streams, such as the output of threaded xz (see
+:py:mod:`snakeoil.compression._parallel`).
+"""
+
+__all__ = ("compress_data", "decompress_data")
+
+import lzma
+
+from . import _parallel
+
+parallelizable = True
+# errors raised by handles on corrupt data beyond EnvironmentError
+exceptions = (EOFError, lzma.LZMAError)
+
+
+def compress_data(data, level=9, parallelize=False):
+    if parallelize:
+        return _parallel.compress_data('xz', data, level)
+    return lzma.compress(data, preset=level)
+
+def decompress_data(data, parallelize=False):
+    if parallelize:
+        return _parallel.decompress_data('xz', data)
+    return lzma.decompress(data)
+
+def compress_handle(handle, level=9, parallelize=False):
+    if parallelize:
+        return _parallel.compress_handle('xz', handle, level)
+    elif isinstance(handle, int):
+        handle = open(handle, 'wb', closefd=False)
+    return lzma.open(handle, 'wb', preset=level)
+
+def decompress_handle(handle, parallelize=False):
+    if parallelize:
+        return _parallel.decompress_handle('xz', handle)
+    elif isinstance(handle, int):
+        handle = open(handle, 'rb', closefd=False)
+    return lzma.open(handle, 'rb')
@@ -0,0 +1,50 @@
+"""
+zstd decompression/compression
+
+Requires the zstandard module (python-zstandard); it's optional, the zstd
+transform is only registered when it's installed.  Parallel compression uses
+zstd's own worker threads; zstd decompression is single threaded.
+"""
+
+__all__ = ("compress_data", "decompress_data")
+
+import io
+from multiprocessing import cpu_count
+
+import zstandard
+
+parallelizable = True
+# errors raised by handles on corrupt data beyond EnvironmentError
+exceptions = (zstandard.ZstdError,)
+
+
+def _compressor(level, parallelize):
+    return zstandard.ZstdCompressor(
+        level=level, threads=cpu_count() if parallelize else 0)
+
+def compress_data(data, level=9, parallelize=False):
+    return _compressor(level, parallelize).compress(data)
+
+def decompress_data(data, parallelize=False):
+    # frames written in streaming mode lack the content size that
+    # ZstdDecompressor.decompress() requires.
+    reader = zstandard.ZstdDecompressor().stream_reader(
+        io.BytesIO(data), read_across_frames=True)
+    with reader:
+        return reader.read()
+
+def _open(handle, mode):
+    if isinstance(handle, str):
+        return open(handle, mode), True
+    elif isinstance(handle, int):
+        return open(handle, mode, closefd=False), True
+    return handle, False
+
+def compress_handle(handle, level=9, parallelize=False):
+    fileobj, close = _open(handle, 'wb')
+    return _compressor(level, parallelize).stream_writer(fileobj, closefd=close)
+
+def decompress_handle(handle, parallelize=False):
+    fileobj, close = _open(handle, 'rb')
+    return zstandard.ZstdDecompressor().stream_reader(
+        fileobj, read_across_frames=True, closefd=close)
@@ -33,12 +33,15 @@ we caught the exception.
 """
 
 __all__ = (
-    "base", "bz2_source", "data_source", "local_source", "text_data_source",
-    "bytes_data_source", "invokable_data_source",
+    "base", "bz2_source", "compressed_source", "data_source", "local_source",
+    "text_data_source", "bytes_data_source", "invokable_data_source",
 )
 
 import errno
 from functools import partial
+import io
+import os
+import tempfile
 
 from . import compression, fileutils, klass, stringio
 from .currying import post_curry
@@ -152,11 +155,27 @@ class base:
         """
         raise NotImplementedError(self, "bytes_fileobj")
 
-    def transfer_to_path(self, path):
+    def transfer_to_path(self, path, chksum_types=None):
+        """copy this data to a file path
+
+        :param path: file path to write to
+        :param chksum_types: if specified, a sequence of chksum types to
+            compute over the data while it's being copied
+        :return: None if `chksum_types` wasn't specified, else a list of
+            chksums matching the order of `chksum_types`
+        """
         return self.transfer_to_data_source(
-            local_source(path, mutable=True, encoding=None))
+            local_source(path, mutable=True, encoding=None), chksum_types)
 
-    def transfer_to_data_source(self, write_source):
+    def transfer_to_data_source(self, write_source, chksum_types=None):
+        """copy this data to another data source
+
+        :param write_source: mutable data source to write to
+        :param chksum_types: if specified, a sequence of chksum types to
+            compute over the data while it's being copied
+        :return: None if `chksum_types` wasn't specified, else a list of
+            chksums matching the order of `chksum_types`
+        """
         read_f, m, write_f = None, None, None
         try:
             write_f = write_source.bytes_fileobj(True)
@@ -166,9 +185,15 @@ class base:
                 read_f = self.bytes_fileobj()
 
             if read_f is not None:
-                transfer_between_files(read_f, write_f)
-            else:
-                write_f.write(m)
+                return transfer_between_files(
+                    read_f, write_f, chksum_types=chksum_types)
+            write_f.write(m)
+            if chksum_types is None:
+                return None
+            chfs = _new_chksummers(chksum_types)
+            for chf in chfs:
+                chf.update(m)
+            return [int(chf.hexdigest(), 16) for chf in chfs]
         finally:
             for x in (read_f, write_f, m):
                 if x is None:
@@ -234,47 +259,155 @@ class local_source(base):
             return open_file(self.path, 'wb+', self.buffering_window)
 
 
-class bz2_source(base):
+class compressed_ro_file(io.BufferedReader):
+    """
+    readonly bytes mode filehandle streaming the decompressed contents of a
+    :py:class:`compressed_source`
     """
-    locally accessible bz2 archive
 
-    Literally a bz2 file on disk.
+    def __init__(self, raw, exceptions):
+        """
+        :param raw: decompressing file object
+        :param exceptions: exceptions that can be raised on I/O or corrupt data
+        """
+        super().__init__(raw)
+        self.exceptions = exceptions
+
+
+class compressed_wr_file(io.FileIO):
     """
+    uncompressed scratch file backing writable :py:class:`compressed_source`
+    filehandles
 
-    __slots__ = ("path", "mutable")
+    The data source is recompressed from its contents on close.
+    """
 
-    def __init__(self, path, mutable=False):
+    def __init__(self, callback, data):
+        """
+        :param callback: functor invoked with this file positioned at the start
+            of its data when it's closed
+        :param data: file object holding the initial data
+        """
+        if not callable(callback):
+            raise TypeError("callback must be callable")
+        self._callback = None
+        fd, path = tempfile.mkstemp(prefix='snakeoil-compressed-')
+        os.unlink(path)
+        super().__init__(fd, 'r+')
+        try:
+            transfer_between_files(data, self)
+            self.seek(0)
+        except BaseException:
+            super().close()
+            raise
+        self._callback = callback
+
+    def close(self):
+        callback, self._callback = self._callback, None
+        try:
+            if callback is not None and not self.closed:
+                self.seek(0)
+                callback(self)
+        finally:
+            super().close()
+
+
+class compressed_source(base):
+    """
+    locally accessible compressed file
+
+    Handles stream the data through the compressor with bounded memory use
+    rather than holding it all in memory.  Readonly handles decompress
+    lazily as they're read; writable handles operate on an uncompressed
+    temporary file, atomically replacing the compressed file on close.
+
+    :ivar compressor_type: compression format, detected from the file's magic
+        bytes if None
+    """
+
+    __slots__ = ("path", "mutable", "compressor_type", "encoding", "level")
+
+    def __init__(self, path, mutable=False, compressor_type=None, encoding=None, level=9):
         """
         :param path: file path of the data source
         :param mutable: whether this data source is considered modifiable or not
+        :param compressor_type: compression format of the file (see
+            :py:mod:`snakeoil.compression`), detected from its contents if
+            not specified; required when creating files
+        :param encoding: the text encoding to use, defaulting to utf8
+        :param level: compression level used when writing
         """
         base.__init__(self)
         self.path = path
         self.mutable = mutable
+        self.compressor_type = compressor_type
+        self.encoding = encoding
+        self.level = level
+
+    def _compressor(self):
+        if self.compressor_type is not None:
+            return self.compressor_type
+        compressor_type = compression.detect_compressor(self.path)
+        if compressor_type is None:
+            raise ValueError("unknown compression format: %r" % (self.path,))
+        return compressor_type
+
+    def _text(self, handle):
+        exceptions = handle.exceptions
+        handle = io.TextIOWrapper(handle, encoding=self.encoding or 'utf8')
+        handle.exceptions = exceptions
+        return handle
 
+    @klass.steal_docs(base)
     def text_fileobj(self, writable=False):
-        data = compression.decompress_data(
-            'bzip2', fileutils.readfile_bytes(self.path)).decode()
-        if writable:
-            if not self.mutable:
-                raise TypeError("data source %s is not mutable" % (self,))
-            return text_wr_StringIO(self._set_data, data)
-        return text_ro_StringIO(data)
+        return self._text(self.bytes_fileobj(writable))
 
+    @klass.steal_docs(base)
     def bytes_fileobj(self, writable=False):
-        data = compression.decompress_data(
-            'bzip2', fileutils.readfile_bytes(self.path))
-        if writable:
-            if not self.mutable:
-                raise TypeError("data source %s is not mutable" % (self,))
-            return bytes_wr_StringIO(self._set_data, data)
-        return bytes_ro_StringIO(data)
+        if not writable:
+            compressor_type = self._compressor()
+            return compressed_ro_file(
+                compression.decompress_handle(compressor_type, self.path),
+                compression.handle_exceptions(compressor_type))
+        if not self.mutable:
+            raise TypeError("data source %s is not mutable" % (self,))
+        try:
+            compressor_type = self._compressor()
+            source = compression.decompress_handle(compressor_type, self.path)
+        except FileNotFoundError:
+            if self.compressor_type is None:
+                raise ValueError(
+                    "compression format required to create %r" % (self.path,))
+            compressor_type = self.compressor_type
+            source = io.BytesIO()
+        with source:
+            raw = compressed_wr_file(
+                partial(self._set_data, compressor_type), source)
+        handle = io.BufferedRandom(raw)
+        handle.exceptions = compression.handle_exceptions(compressor_type)
+        return handle
+
+    def _set_data(self, compressor_type, data):
+        with fileutils.AtomicWriteFile(self.path, binary=True) as f:
+            with compression.compress_handle(compressor_type, f, self.level) as out:
+                transfer_between_files(data, out)
+
+
+class bz2_source(compressed_source):
+    """
+    locally accessible bz2 archive
 
-    def _set_data(self, data):
-        if isinstance(data, str):
-            data = data.encode()
-        with open(self.path, "wb") as f:
-            f.write(compression.compress_data('bzip2', data))
+    Literally a bz2 file on disk.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, path, mutable=False):
+        """
+        :param path: file path of the data source
+        :param mutable: whether this data source is considered modifiable or not
+        """
+        super().__init__(path, mutable=mutable, compressor_type='bzip2')
 
 
 class data_source(base):
@@ -454,8 +587,31 @@ class invokable_data_source(data_source):
         return bytes_ro_StringIO(data)
 
 
-def transfer_between_files(read_file, write_file, bufsize=(32 * 1024)):
+def _new_chksummers(chksum_types):
+    # delayed import; chksum depends on this module.
+    from .chksum import get_handler
+    return [get_handler(x).new()() for x in chksum_types]
+
+
+def transfer_between_files(read_file, write_file, bufsize=(32 * 1024),
+                           chksum_types=None):
+    """copy data between file objects
+
+    :param read_file: file object to read from
+    :param write_file: file object to write to
+    :param bufsize: size of the chunks copied at a time
+    :param chksum_types: if specified, a sequence of chksum types to compute
+        over the data as it's copied, avoiding a second read of it
+    :return: None if `chksum_types` wasn't specified, else a list of
+        chksums matching the order of `chksum_types`
+    """
+    chfs = () if chksum_types is None else _new_chksummers(chksum_types)
     data = read_file.read(bufsize)
     while data:
         write_file.write(data)
+        for chf in chfs:
+            chf.update(data)
         data = read_file.read(bufsize)
+    if chksum_types is None:
+        return None
+    return [int(chf.hexdigest(), 16) for chf in chfs]
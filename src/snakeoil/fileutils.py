@@ -2,14 +2,17 @@
 file related operations, mainly reading
 """
 
-__all__ = ("AtomicWriteFile", 'write_file', 'UnbufferedWriteHandle', 'touch')
+__all__ = ("AtomicWriteFile", "AtomicWriteBatch", 'write_file', 'UnbufferedWriteHandle', 'touch')
 types = [""] + list("_%s" % x for x in ("ascii", "utf8"))
 __all__ += tuple("readfile%s" % x for x in types) + tuple("readlines%s" % x for x in types)
 del types
 
-from functools import partial
+from functools import lru_cache, partial
 import mmap
 import os
+import shutil
+import sys
+import tempfile
 
 from . import _fileutils, data_source
 from .compatibility import IGNORED_EXCEPTIONS
@@ -181,6 +184,192 @@ class AtomicWriteFile(AtomicWriteFile_mixin):
     __getattr__ = GetAttrProxy("raw")
 
 
+@lru_cache(maxsize=None)
+def _load_syncfs():
+    """return libc's syncfs(), or None if it's unavailable"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        syncfs = libc.syncfs
+    except (ImportError, OSError, AttributeError):
+        return None
+    syncfs.argtypes = (ctypes.c_int,)
+    return syncfs
+
+
+def _syncfs(path):
+    """flush the filesystem containing path to disk
+
+    Falls back to :py:func:`os.sync` where syncfs(2) isn't available.
+    """
+    syncfs = _load_syncfs()
+    if syncfs is None:
+        os.sync()
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if syncfs(fd) != 0:
+            import ctypes
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+    finally:
+        os.close(fd)
+
+
+class AtomicWriteBatch:
+
+    """Write many files, replacing their targets all at once.
+
+    Files are written to a staging directory created within `path` and
+    renamed over their targets when the batch is committed, so targets must
+    be on the same filesystem as `path`.  Rather than syncing each file, the
+    filesystem is synced once before the renames, so no target can end up
+    replaced by a file whose data didn't make it to disk, and once after
+    them, so the whole batch is durable when :py:meth:`commit` returns.
+
+    Rollback semantics: existing targets are hardlinked into the staging
+    directory before anything is renamed.  If any rename fails, targets
+    renamed so far are restored from those links (or removed, if they didn't
+    exist before) and the error is raised, leaving the targets as they were.
+    A crash midway through the renames can't be rolled back; each target
+    holds either its old or its new contents in full, but the batch may be
+    partially applied.
+
+    As with :py:class:`AtomicWriteFile`, exiting the context manager commits
+    the batch unless an exception was raised, in which case it's discarded,
+    as it is if this object falls out of memory without being committed.
+    """
+
+    def __init__(self, path, binary=False, perms=None, uid=-1, gid=-1, sync=True):
+        """
+        :param path: directory to stage files in, usually the root of the
+            tree being written
+        :param binary: should files be opened in binary mode?
+        :param perms: if specified, permissions we should force for files.
+        :param uid: if specified, the uid to force for files.
+        :param gid: if specified, the gid to force for files.
+        :param sync: whether to sync the filesystem when committing
+        """
+        self._is_finalized = True
+        self._file_mode = 'wb' if binary else 'w'
+        self.perms = perms
+        self.uid = uid
+        self.gid = gid
+        self.sync = sync
+        self._staging = tempfile.mkdtemp(prefix='.update.', dir=path)
+        # target -> staged path, in the order they were written
+        self._files = {}
+        self._handles = []
+        self._count = 0
+        self._is_finalized = False
+
+    def __len__(self):
+        return len(self._files)
+
+    def open(self, fp):
+        """Return a file handle whose contents will replace fp on commit.
+
+        Writing the same target again replaces its earlier contents.
+        """
+        if self._is_finalized:
+            raise ValueError('batch was already committed or discarded')
+        fp = os.path.realpath(fp)
+        # earlier handles for fp may still be open, so stage to a new file
+        staged = os.path.join(self._staging, str(self._count))
+        self._count += 1
+        handle = open(staged, self._file_mode)
+        self._handles.append(handle)
+        old = self._files.pop(fp, None)
+        if old is not None:
+            os.unlink(old)
+        self._files[fp] = staged
+        if self.perms:
+            os.chmod(staged, self.perms)
+        if (self.gid, self.uid) != (-1, -1):
+            os.chown(staged, self.uid, self.gid)
+        return handle
+
+    def write(self, fp, data):
+        """Stage data to replace fp on commit."""
+        with self.open(fp) as f:
+            f.write(data)
+
+    def discard(self):
+        """Drop all staged files without touching their targets."""
+        if not self._is_finalized:
+            self._close_handles()
+            shutil.rmtree(self._staging, ignore_errors=True)
+            self._is_finalized = True
+
+    def _close_handles(self):
+        for handle in self._handles:
+            handle.close()
+        self._handles = []
+
+    def commit(self):
+        """Replace all targets with their staged files.
+
+        Note that if we're already committed or discarded, this method
+        does nothing.
+
+        :raise OSError: if the batch couldn't be applied, in which case the
+            targets were rolled back.
+        """
+        if self._is_finalized:
+            return
+        try:
+            self._close_handles()
+            if self.sync:
+                _syncfs(self._staging)
+            backups = {}
+            for i, fp in enumerate(self._files):
+                backup = os.path.join(self._staging, 'backup.%i' % i)
+                try:
+                    os.link(fp, backup, follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                backups[fp] = backup
+            renamed = []
+            try:
+                for fp, staged in self._files.items():
+                    os.rename(staged, fp)
+                    renamed.append(fp)
+            except BaseException:
+                self._rollback(renamed, backups)
+                raise
+            if self.sync:
+                _syncfs(self._staging)
+        finally:
+            self.discard()
+
+    @staticmethod
+    def _rollback(renamed, backups):
+        for fp in reversed(renamed):
+            try:
+                backup = backups.get(fp)
+                if backup is None:
+                    os.unlink(fp)
+                else:
+                    os.rename(backup, fp)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.discard()
+        else:
+            self.commit()
+
+    def __del__(self):
+        self.discard()
+
+
 def _mk_pretty_derived_func(func, name_base, name, *args, **kwds):
     if name:
         name = '_' + name
@@ -34,17 +34,23 @@ pretty quickly.
 """
 
 __all__ = (
-    'abspath', 'abssymlink', 'ensure_dirs', 'join', 'pjoin', 'listdir_files',
+    'abspath', 'abssymlink', 'ensure_dirs', 'ensure_dirs_bulk', 'join', 'pjoin', 'listdir_files',
     'listdir_dirs', 'listdir', 'readdir', 'normpath', 'unlink_if_exists',
-    'FsLock', 'GenericFailed', 'LockException', 'NonExistent',
-    'supported_systems',
+    'readdir_stat', 'DirStat', 'ListdirCache', 'scandir_tree', 'walk', 'FsLock', 'GenericFailed', 'LockException',
+    'NonExistent', 'supported_systems',
 )
 
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import errno
 import fcntl
 import os
+import queue
 import stat
 import sys
+import threading
+import time
 
 # No name '_readdir' in module osutils
 # pylint: disable=E0611
@@ -65,6 +71,11 @@ readdir = module.readdir
 
 del module
 
+try:
+    from ._readdir_stat import readdir_stat_arrays as _readdir_stat_arrays
+except ImportError:
+    from .native_readdir import readdir_stat_arrays as _readdir_stat_arrays
+
 
 def supported_systems(*systems):
     """Decorator limiting functions to specified systems.
@@ -190,19 +201,230 @@ def ensure_dirs(path, gid=-1, uid=-1, mode=0o777, minimal=True):
         if not os.path.isdir(path):
             # don't change perms for existing paths that aren't dirs
             return False
+        return _update_dir_perms(path, st, gid, uid, mode, minimal)
+
+
+def _update_dir_perms(path, st, gid, uid, mode, minimal):
+    """apply ensure_dirs() ownership and mode settings to an existing directory"""
+    try:
+        if ((gid != -1 and gid != st.st_gid) or
+                (uid != -1 and uid != st.st_uid)):
+            os.chown(path, uid, gid)
+        if minimal:
+            if mode != (st.st_mode & mode):
+                os.chmod(path, st.st_mode | mode)
+        elif mode != (st.st_mode & 0o7777):
+            os.chmod(path, mode)
+    except OSError:
+        return False
+    return True
+
+
+class _BulkDirs:
+    """shared state for :py:func:`ensure_dirs_bulk`"""
 
+    # memo marker for directories created by this run
+    created = True
+
+    def __init__(self, gid, uid, mode, minimal):
+        self.gid = gid
+        self.uid = uid
+        self.mode = mode
+        self.minimal = minimal
+        # if the dir perms would lack +wx, we have to force it
+        self.force_temp_perms = ((mode & 0o300) != 0o300)
+        self.chown = gid != -1 or uid != -1
+        # path -> stat result, None if missing, or created
+        self.memo = {}
+        # created path -> whether its parent is setgid
+        self.sticky = {}
+
+    def stat(self, path):
+        try:
+            return self.memo[path]
+        except KeyError:
+            pass
         try:
-            if ((gid != -1 and gid != st.st_gid) or
-                    (uid != -1 and uid != st.st_uid)):
-                os.chown(path, uid, gid)
-            if minimal:
-                if mode != (st.st_mode & mode):
-                    os.chmod(path, st.st_mode | mode)
-            elif mode != (st.st_mode & 0o7777):
-                os.chmod(path, mode)
+            st = os.stat(path)
         except OSError:
+            st = None
+        self.memo[path] = st
+        return st
+
+    def create(self, path, target, resets):
+        """create missing components of a path, as ensure_dirs() does
+
+        :param target: whether path is one of the requested directories
+        :param resets: list extended with (path, mode) pairs needing their
+            permissions set once everything is created
+        """
+        # walk up to the closest known directory instead of down from the
+        # root, all but the missing components are usually memoized
+        missing = []
+        base = path
+        st = self.stat(base)
+        while st is None:
+            missing.append(base)
+            parent = os.path.dirname(base)
+            if parent == base:
+                return False
+            base = parent
+            st = self.stat(base)
+
+        if st is self.created:
+            # subdirs inherit the setgid bit on creation
+            sticky_parent = self.sticky[base]
+        elif not stat.S_ISDIR(st.st_mode):
+            # one of the path components isn't a dir
             return False
-    return True
+        else:
+            sticky_parent = bool(st.st_mode & stat.S_ISGID)
+
+        for base in reversed(missing):
+            # nothing exists.
+            try:
+                if self.force_temp_perms:
+                    if not _safe_mkdir(base, 0o700):
+                        return False
+                    resets.append((base, self.mode))
+                else:
+                    if not _safe_mkdir(base, self.mode):
+                        return False
+                    if target and base == path and sticky_parent:
+                        resets.append((base, self.mode))
+                    if self.chown:
+                        os.chown(base, self.uid, self.gid)
+            except OSError:
+                return False
+            self.memo[base] = self.created
+            self.sticky[base] = sticky_parent
+        return True
+
+    def ensure(self, targets):
+        """ensure sorted directories exist, returning (failures, resets)"""
+        failed = []
+        resets = []
+        memo = self.memo
+        for path in targets:
+            # inlined stat(), targets are rarely memoized already
+            if path in memo:
+                st = memo[path]
+            else:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    st = None
+                memo[path] = st
+            if st is self.created:
+                continue
+            elif st is None:
+                if not self.create(path, True, resets):
+                    failed.append(path)
+            elif not stat.S_ISDIR(st.st_mode):
+                # don't change perms for existing paths that aren't dirs
+                failed.append(path)
+            elif not _update_dir_perms(path, st, self.gid, self.uid, self.mode, self.minimal):
+                failed.append(path)
+        return failed, resets
+
+    def reset(self, resets, targets, failed):
+        """set the final permissions of directories created with +wx
+
+        :param resets: (path, mode) pairs
+        :param targets: sorted requested directories, those at or below a
+            directory whose permissions couldn't be set are added to `failed`
+        """
+        # deepest first, so parents stay writable while children are fixed
+        for base, mode in reversed(resets):
+            try:
+                os.chmod(base, mode)
+                if self.chown:
+                    os.chown(base, self.uid, self.gid)
+            except OSError:
+                i = bisect_left(targets, base)
+                if i < len(targets) and targets[i] == base:
+                    failed.add(base)
+                # paths sharing a prefix are contiguous once sorted
+                prefix = base + os.path.sep
+                i = bisect_left(targets, prefix, i)
+                while i < len(targets) and targets[i].startswith(prefix):
+                    failed.add(targets[i])
+                    i += 1
+
+
+def ensure_dirs_bulk(paths, gid=-1, uid=-1, mode=0o777, minimal=True, jobs=1):
+    """:py:func:`ensure_dirs` for many directories at once.
+
+    Paths are normalized, deduplicated, and sorted so ancestors are handled
+    first; each directory along the way is stat'd and created at most once
+    rather than once per path containing it.  Permissions of directories
+    temporarily created with +wx (see `mode`) are set once all directories
+    are created.
+
+    :param paths: iterable of directories to ensure exist on disk
+    :param jobs: number of threads; above 1, subtrees below the common
+        ancestor of the paths are handled in parallel.  This only pays off
+        where stat and mkdir block, e.g. network filesystems or cold caches;
+        for cached local filesystems the threads just contend for the GIL
+        and are slower than the default of 1.
+    :return: list of the paths that couldn't be created or ensured to have
+        the requested permissions, in the order given
+
+    See :py:func:`ensure_dirs` for the remaining parameters.
+    """
+    paths = list(paths)
+    normalized = {}
+    cwd = os.getcwd()
+    for path in paths:
+        # absolute paths are usually normalized already, skip the cost
+        if (path[:1] != os.path.sep or path[-1:] == os.path.sep or
+                '//' in path or '/.' in path):
+            normalized.setdefault(normpath(os.path.join(cwd, path)), path)
+        else:
+            normalized.setdefault(path, path)
+    targets = sorted(normalized)
+    if not targets:
+        return []
+
+    state = _BulkDirs(gid, uid, mode, minimal)
+    um = os.umask(0)
+    try:
+        if jobs is None or jobs > 1:
+            failed, resets = _ensure_dirs_parallel(state, targets, jobs)
+        else:
+            failed, resets = state.ensure(targets)
+        failed = set(failed)
+        state.reset(resets, targets, failed)
+    finally:
+        os.umask(um)
+    failed = {normalized[x] for x in failed}
+    return [x for x in paths if x in failed]
+
+
+def _ensure_dirs_parallel(state, targets, jobs):
+    common = os.path.commonpath(targets)
+    failed = []
+    resets = []
+    if targets[0] == common:
+        # the common ancestor is a target itself
+        failed, resets = state.ensure(targets[:1])
+        targets = targets[1:]
+    elif not state.create(common, False, resets):
+        return targets, []
+
+    # group targets by subtree of the common ancestor; subtrees aren't
+    # contiguous once sorted, e.g. 'a', 'a-b', 'a/b'
+    prefix = len(common.rstrip(os.path.sep)) + 1
+    groups = {}
+    for path in targets:
+        key = path[prefix:].split(os.path.sep, 1)[0]
+        groups.setdefault(key, []).append(path)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for group_failed, group_resets in pool.map(state.ensure, groups.values()):
+            failed.extend(group_failed)
+            resets.extend(group_resets)
+    return failed, resets
 
 
 def abssymlink(path):
@@ -256,6 +478,437 @@ def abspath(path):
         return path
 
 
+DirStatEntry = namedtuple('DirStatEntry', ('name', 'mode', 'inode', 'size', 'mtime_ns'))
+
+
+class DirStat:
+    """lstat details for the entries of a directory, stored as parallel arrays
+
+    Iterating or indexing yields :py:class:`DirStatEntry` records; the
+    arrays can be used directly to avoid creating per entry objects.
+
+    :ivar names: list of entry names
+    :ivar modes: :py:class:`array.array` of st_mode values, see
+        :py:func:`stat.S_IFMT` for file types
+    :ivar inodes: :py:class:`array.array` of inode numbers
+    :ivar sizes: :py:class:`array.array` of sizes
+    :ivar mtimes_ns: :py:class:`array.array` of mtimes in nanoseconds
+    """
+
+    __slots__ = ('names', 'modes', 'inodes', 'sizes', 'mtimes_ns')
+
+    def __init__(self, names, modes, inodes, sizes, mtimes_ns):
+        self.names = names
+        self.modes = modes
+        self.inodes = inodes
+        self.sizes = sizes
+        self.mtimes_ns = mtimes_ns
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        return DirStatEntry(
+            self.names[index], self.modes[index], self.inodes[index],
+            self.sizes[index], self.mtimes_ns[index])
+
+    def __iter__(self):
+        return map(DirStatEntry, self.names, self.modes, self.inodes,
+                   self.sizes, self.mtimes_ns)
+
+
+def readdir_stat(path):
+    """Return lstat details for all entries of a directory.
+
+    Unlike :py:func:`listdir_files` and friends, each entry is stat'd once
+    and the results are returned instead of being thrown away.  Entries are
+    stat'd relative to the open directory (fstatat) in a single loop; in C
+    with the GIL released around syscalls if the extension is built.
+
+    :param path: directory to scan
+    :return: :py:class:`DirStat` instance, entries in directory order
+    """
+    return DirStat(*_readdir_stat_arrays(path))
+
+
+class ListdirCache:
+    """Cache of directory listings, invalidated when directories change.
+
+    Provides cached equivalents of :py:func:`listdir`, :py:func:`listdir_files`,
+    and :py:func:`listdir_dirs` for callers repeatedly scanning the same,
+    mostly unchanging, directories.
+
+    Where inotify is available, cached directories are watched.  Watches
+    follow inodes rather than paths, so a lookup also checks the path still
+    resolves to the watched directory (e.g. it wasn't replaced after an
+    ancestor was renamed away), costing a stat call plus a nonblocking read
+    of the inotify queue.  Otherwise, or if a watch can't be added, listings
+    are validated against the directory's mtime and ctime, also costing a
+    stat call.  Directories modified within the last :py:attr:`racy_window`
+    seconds aren't trusted via stat since they could change again within the
+    filesystem's timestamp granularity.
+
+    Limitations:
+
+    - changes to the targets of symlinks aren't tracked, so with
+      followSymlinks the type of a symlink's target is as it was when the
+      directory was listed
+    - inotify doesn't see changes made by other hosts on network
+      filesystems such as NFS; use inotify=False for those
+
+    :ivar hits: number of lookups answered from the cache
+    :ivar misses: number of lookups that had to read the directory
+    """
+
+    racy_window = 2.0
+
+    def __init__(self, maxsize=4096, inotify=True):
+        """
+        :param maxsize: maximum number of cached directories, the least
+            recently used are evicted beyond that
+        :param inotify: use inotify for invalidation if it's available
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._use_inotify = inotify
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # path -> (validation key, (names, files, dirs, files and dirs w/o
+        #          following symlinks)); the key is the directory's identity
+        #          for watched paths, its stat key otherwise
+        self._cache = OrderedDict()
+        # inotify watch descriptor -> set of paths and the reverse
+        self._watched = {}
+        self._wds = {}
+        self._inotify = None
+        self._pid = os.getpid()
+        if self._use_inotify:
+            from . import _inotify
+            try:
+                self._inotify = _inotify.Inotify()
+            except OSError:
+                pass
+
+    def close(self):
+        """Drop all cached listings and release inotify resources."""
+        with self._lock:
+            if self._inotify is not None and self._pid == os.getpid():
+                self._inotify.close()
+            self._inotify = None
+            self._cache.clear()
+            self._watched.clear()
+            self._wds.clear()
+
+    def __del__(self):
+        inotify = getattr(self, '_inotify', None)
+        if inotify is not None and self._pid == os.getpid():
+            inotify.close()
+
+    def clear(self):
+        """Drop all cached listings."""
+        with self._lock:
+            self._drop_all()
+
+    def invalidate(self, path):
+        """Drop the cached listing of a directory."""
+        with self._lock:
+            self._drop(os.path.abspath(path))
+
+    def _drop_all(self):
+        if self._inotify is not None:
+            for wd in self._watched:
+                self._inotify.rm_watch(wd)
+        self._cache.clear()
+        self._watched.clear()
+        self._wds.clear()
+
+    def _drop(self, path):
+        self._cache.pop(path, None)
+        wd = self._wds.pop(path, None)
+        if wd is not None:
+            paths = self._watched[wd]
+            paths.discard(path)
+            if not paths:
+                del self._watched[wd]
+                self._inotify.rm_watch(wd)
+
+    def _poll(self):
+        """invalidate listings of directories with pending inotify events"""
+        wds = self._inotify.read()
+        if wds is None:
+            # events were lost
+            self._drop_all()
+            return
+        for wd in wds:
+            for path in tuple(self._watched.get(wd, ())):
+                self._drop(path)
+
+    @staticmethod
+    def _identity(path):
+        st = os.stat(path)
+        return (st.st_ino, st.st_dev)
+
+    def _stat_key(self, path):
+        st = os.stat(path)
+        if time.time() - st.st_mtime <= self.racy_window:
+            return None
+        return (st.st_mtime_ns, st.st_ctime_ns, st.st_ino, st.st_dev)
+
+    def _scan(self, path):
+        names = []
+        files = []
+        dirs = []
+        files_nofollow = []
+        dirs_nofollow = []
+        with os.scandir(path) as it:
+            for entry in it:
+                name = entry.name
+                names.append(name)
+                if entry.is_symlink():
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    if stat.S_ISREG(st.st_mode):
+                        files.append(name)
+                    elif stat.S_ISDIR(st.st_mode):
+                        dirs.append(name)
+                elif entry.is_file():
+                    files.append(name)
+                    files_nofollow.append(name)
+                elif entry.is_dir():
+                    dirs.append(name)
+                    dirs_nofollow.append(name)
+        return (names, files, dirs, files_nofollow, dirs_nofollow)
+
+    def _listing(self, path, index):
+        path = os.path.abspath(path)
+        with self._lock:
+            if self._pid != os.getpid():
+                # inotify state isn't shared with forked children
+                self._reset()
+            if self._inotify is not None and self._watched:
+                self._poll()
+            cached = self._cache.get(path)
+            if cached is not None:
+                try:
+                    if path in self._wds:
+                        valid = cached[0] == self._identity(path)
+                    else:
+                        valid = cached[0] == self._stat_key(path)
+                except OSError:
+                    valid = False
+                if valid:
+                    self._cache.move_to_end(path)
+                    self.hits += 1
+                    return list(cached[1][index])
+                self._drop(path)
+            self.misses += 1
+
+            if self._inotify is not None:
+                # identify the directory before watching it, and watch it
+                # before reading so concurrent changes aren't missed
+                key = self._identity(path)
+                try:
+                    wd = self._inotify.add_watch(path)
+                except OSError:
+                    # e.g. the watch limit was hit
+                    key = self._stat_key(path)
+                else:
+                    self._watched.setdefault(wd, set()).add(path)
+                    self._wds[path] = wd
+            else:
+                key = self._stat_key(path)
+            try:
+                listing = self._scan(path)
+            except OSError:
+                self._drop(path)
+                raise
+            if key is None and path not in self._wds:
+                # recently modified and unwatched, don't trust it
+                return list(listing[index])
+            self._cache[path] = (key, listing)
+            if len(self._cache) > self.maxsize:
+                self._drop(next(iter(self._cache)))
+            return list(listing[index])
+
+    def listdir(self, path):
+        """Cached equivalent of :py:func:`listdir`."""
+        return self._listing(path, 0)
+
+    def listdir_files(self, path, followSymlinks=True):
+        """Cached equivalent of :py:func:`listdir_files`."""
+        return self._listing(path, 1 if followSymlinks else 3)
+
+    def listdir_dirs(self, path, followSymlinks=True):
+        """Cached equivalent of :py:func:`listdir_dirs`."""
+        return self._listing(path, 2 if followSymlinks else 4)
+
+
+def _scandir(path, follow_symlinks):
+    """scan a directory, returning (path, entries, subdirectory entries)"""
+    with os.scandir(path) as it:
+        entries = list(it)
+    # d_type answers this without a stat call, except for filesystems that
+    # don't report it and for symlinks being followed
+    subdirs = []
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=follow_symlinks):
+                subdirs.append(entry)
+        except OSError:
+            pass
+    return path, entries, subdirs
+
+
+def scandir_tree(top, prune=None, jobs=None, follow_symlinks=False, onerror=None):
+    """Recursively scan a directory tree, scanning subdirectories in parallel.
+
+    Directory scans are spread over a thread pool; :py:func:`os.scandir`
+    releases the GIL while reading directories and its entries carry the
+    file type from d_type, so trees are walked without stat calls on
+    filesystems supporting it.  Workers walk subtrees depth first, handing
+    subdirectories off to idle workers, which mainly pays off for large
+    trees on high latency filesystems such as NFS.
+
+    Results are yielded as scans complete, so the order of directories is
+    arbitrary aside from parents preceding their subdirectories.
+
+    :param top: directory to scan
+    :param prune: if given, a callable passed the :py:class:`os.DirEntry` for
+        each subdirectory; if it returns True the subdirectory isn't scanned.
+        It's called from worker threads, possibly concurrently; exceptions
+        it raises are reraised from the iterator.
+    :param jobs: number of threads scanning directories, defaults to the
+        cpu count plus 4 capped at 32, as scans are mostly waiting on I/O
+    :param follow_symlinks: descend into symlinks to directories; note this
+        can lead to infinite recursion with symlink loops
+    :param onerror: if given, a callable passed the OSError for directories
+        that can't be scanned, otherwise errors are ignored as
+        :py:func:`os.walk` does
+    :return: iterator of (directory path, list of :py:class:`os.DirEntry`)
+    """
+    return _TreeScanner(prune, jobs, follow_symlinks).run(top, onerror)
+
+
+class _Reraise:
+    """exception escaping a worker, raised by the consumer as is"""
+
+    __slots__ = ("exc",)
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+class _TreeScanner:
+    """thread pool state for :py:func:`scandir_tree`"""
+
+    # directories scanned by a worker between handing results over
+    batch = 32
+
+    def __init__(self, prune, jobs, follow_symlinks):
+        self.prune = prune
+        self.follow_symlinks = follow_symlinks
+        # the ThreadPoolExecutor default, as directory scans are I/O bound
+        self.workers = jobs or min(32, (os.cpu_count() or 1) + 4)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.results = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        # queued or running tasks
+        self.active = 0
+        self.stopped = False
+
+    def submit(self, path):
+        with self.lock:
+            self.active += 1
+        self.pool.submit(self.scan, path)
+
+    def idle(self):
+        return self.active < self.workers
+
+    def scan(self, path):
+        """walk a subtree, queueing lists of (result, number of subdirectories queued)"""
+        stack = [path]
+        results = []
+        try:
+            while stack and not self.stopped:
+                path = stack.pop()
+                try:
+                    path, entries, subdirs = _scandir(path, self.follow_symlinks)
+                except OSError as e:
+                    results.append((e, 0))
+                    continue
+                if self.prune is not None:
+                    subdirs = [x for x in subdirs if not self.prune(x)]
+                results.append(((path, entries), len(subdirs)))
+                if len(results) >= self.batch or (subdirs and self.idle()):
+                    # results are handed over first so parents always
+                    # precede their subdirectories
+                    self.results.put(results)
+                    results = []
+                    # give idle workers a share of the tree
+                    while subdirs and self.idle():
+                        self.submit(subdirs.pop(0).path)
+                stack.extend(x.path for x in reversed(subdirs))
+        except BaseException as e:
+            # e.g. raised by prune; directories left on the stack are
+            # dropped along with the current one
+            results.append((_Reraise(e), -len(stack)))
+        finally:
+            with self.lock:
+                self.active -= 1
+            if results:
+                self.results.put(results)
+
+    def run(self, top, onerror):
+        try:
+            self.submit(top)
+            outstanding = 1
+            while outstanding:
+                for result, queued in self.results.get():
+                    outstanding += queued - 1
+                    if isinstance(result, _Reraise):
+                        raise result.exc
+                    elif isinstance(result, BaseException):
+                        if not isinstance(result, OSError):
+                            raise result
+                        if onerror is not None:
+                            onerror(result)
+                        continue
+                    yield result
+        finally:
+            # running workers stop at their next directory
+            self.stopped = True
+            self.pool.shutdown(wait=True)
+
+
+def walk(top, prune=None, jobs=None, follow_symlinks=False, onerror=None):
+    """Parallel variant of :py:func:`os.walk`.
+
+    Unlike :py:func:`os.walk`, subdirectories are pruned via the `prune`
+    callback rather than by modifying the yielded directory list.  See
+    :py:func:`scandir_tree` for the parameters and result ordering.
+
+    :return: iterator of (directory path, subdirectory names, other names)
+    """
+    for path, entries in scandir_tree(
+            top, prune=prune, jobs=jobs, follow_symlinks=follow_symlinks, onerror=onerror):
+        dirs = []
+        nondirs = []
+        for entry in entries:
+            # as with os.walk, symlinks to directories are listed as
+            # directories even when they aren't descended into
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            (dirs if is_dir else nondirs).append(entry.name)
+        yield path, dirs, nondirs
+
+
 def native_normpath(mypath):
     """normalize path- //usr/bin becomes /usr/bin, /usr/../bin becomes /bin
 
@@ -0,0 +1,107 @@
+"""
+minimal ctypes binding for linux inotify, used to invalidate cached listings
+
+Only what :py:class:`snakeoil.osutils.ListdirCache` needs is covered: watching
+directories for entries being added, removed, or renamed, and polling for
+changes without blocking.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_ONLYDIR = 0x01000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# changes to the set of entries of a directory, or to the directory itself;
+# IN_ATTRIB catches the directory being chmod'd unreadable
+DIR_CHANGES = (
+    IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+    IN_DELETE_SELF | IN_MOVE_SELF)
+
+_event = struct.Struct('iIII')
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+    libc.inotify_rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+    return libc
+
+
+_libc = _load_libc()
+
+
+class Inotify:
+    """Nonblocking inotify instance.
+
+    :raise OSError: if inotify isn't supported or the instance limit was hit
+    """
+
+    def __init__(self):
+        if _libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is unsupported')
+        self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+
+    def add_watch(self, path, mask=DIR_CHANGES | IN_ONLYDIR):
+        """Watch a path, returning the watch descriptor.
+
+        Note that watches are per inode, paths resolving to the same
+        directory share a watch descriptor.
+        """
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+        return wd
+
+    def rm_watch(self, wd):
+        """Remove a watch, ignoring ones that were already dropped."""
+        _libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        """Return the watch descriptors with pending events.
+
+        :return: set of watch descriptors, or None if the event queue
+            overflowed and events were lost
+        """
+        wds = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return wds
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = _event.unpack_from(data, offset)
+                offset += _event.size + length
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                wds.add(wd)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
@@ -0,0 +1,134 @@
+# distutils: language = c
+# cython: language_level = 3
+
+"""native readdir loop collecting lstat details of directory entries"""
+
+from cpython cimport array
+from libc.errno cimport errno, ENOENT
+from posix.types cimport ino_t, mode_t, off_t, time_t
+
+import array
+import os
+
+
+cdef extern from "fcntl.h" nogil:
+    int open(const char *path, int flags)
+    int O_RDONLY, O_DIRECTORY, O_CLOEXEC
+    int AT_SYMLINK_NOFOLLOW
+
+cdef extern from "unistd.h" nogil:
+    int close(int fd)
+
+cdef extern from "sys/stat.h" nogil:
+    struct timespec:
+        time_t tv_sec
+        long tv_nsec
+    struct stat:
+        mode_t st_mode
+        ino_t st_ino
+        off_t st_size
+        timespec st_mtim
+    int fstatat(int dirfd, const char *path, stat *buf, int flags)
+
+cdef extern from "dirent.h" nogil:
+    ctypedef struct DIR
+    struct dirent:
+        char d_name[256]
+    DIR *fdopendir(int fd)
+    dirent *readdir(DIR *dirp)
+    int closedir(DIR *dirp)
+    int dirfd(DIR *dirp)
+
+cdef extern from "Python.h":
+    object PyUnicode_DecodeFSDefault(const char *s)
+
+# assigning errno in cython code makes it a local variable instead
+cdef extern from *:
+    """
+    #include <errno.h>
+    static void snakeoil_clear_errno(void) { errno = 0; }
+    """
+    void clear_errno "snakeoil_clear_errno"() nogil
+
+
+def readdir_stat_arrays(path):
+    """lstat all entries of a directory in a single loop
+
+    Entries are stat'd via fstatat() relative to the open directory, with the
+    GIL released around each readdir() and fstatat() call.  Entries removed
+    while the directory is being read are skipped.
+
+    :param path: directory to scan
+    :return: tuple of (names list, then mode, inode, size, and mtime in
+        nanoseconds arrays)
+    """
+    cdef bytes bpath = os.fsencode(path)
+    cdef const char *cpath = bpath
+    cdef int fd
+    cdef DIR *d
+    cdef dirent *entry
+    cdef const char *name
+    cdef stat st
+    cdef int ret
+    cdef int err = 0
+    cdef Py_ssize_t n = 0
+
+    cdef list names = []
+    cdef array.array modes = array.array('I')
+    cdef array.array inodes = array.array('Q')
+    cdef array.array sizes = array.array('q')
+    cdef array.array mtimes = array.array('q')
+
+    # errno is saved right after each failing call; close() and python
+    # code run before raising can clobber it.
+    with nogil:
+        fd = open(cpath, O_RDONLY | O_DIRECTORY | O_CLOEXEC)
+        if fd < 0:
+            err = errno
+    if fd < 0:
+        raise OSError(err, os.strerror(err), path)
+    d = fdopendir(fd)
+    if d is NULL:
+        err = errno
+        close(fd)
+        raise OSError(err, os.strerror(err), path)
+
+    try:
+        while True:
+            with nogil:
+                clear_errno()
+                entry = readdir(d)
+                if entry is NULL:
+                    err = errno
+                else:
+                    name = entry.d_name
+                    if name[0] == b'.' and (name[1] == 0 or (name[1] == b'.' and name[2] == 0)):
+                        ret = 1
+                    else:
+                        ret = fstatat(dirfd(d), name, &st, AT_SYMLINK_NOFOLLOW)
+                        if ret < 0:
+                            err = errno
+            if entry is NULL:
+                if err:
+                    raise OSError(err, os.strerror(err), path)
+                break
+            if ret == 1:
+                continue
+            elif ret < 0:
+                if err == ENOENT:
+                    continue
+                raise OSError(err, os.strerror(err), os.path.join(path, os.fsdecode(name)))
+            names.append(PyUnicode_DecodeFSDefault(name))
+            array.resize_smart(modes, n + 1)
+            array.resize_smart(inodes, n + 1)
+            array.resize_smart(sizes, n + 1)
+            array.resize_smart(mtimes, n + 1)
+            modes.data.as_uints[n] = st.st_mode
+            inodes.data.as_ulonglongs[n] = st.st_ino
+            sizes.data.as_longlongs[n] = st.st_size
+            mtimes.data.as_longlongs[n] = st.st_mtim.tv_sec * 1000000000LL + st.st_mtim.tv_nsec
+            n += 1
+    finally:
+        closedir(d)
+
+    return names, modes, inodes, sizes, mtimes
@@ -1,6 +1,7 @@
 """Wrapper for readdir which grabs file type from d_type."""
 
 
+from array import array
 import errno
 import os
 from stat import (S_IFDIR, S_IFREG, S_IFCHR, S_IFBLK, S_IFIFO, S_IFLNK, S_IFSOCK,
@@ -89,3 +90,37 @@ def readdir(path):
     lstat = os.lstat
     dt = d_type_mapping
     return [(name, dt[S_IFMT(lstat(pjf(path, name)).st_mode)]) for name in things]
+
+
+def readdir_stat_arrays(path):
+    """
+    lstat all entries of a directory
+
+    Entries are stat'd relative to the open directory via ``dir_fd``
+    (fstatat), avoiding path joins and lookups of the directory for each
+    entry.  Entries removed while the directory is being read are skipped.
+
+    :param path: directory to scan
+    :return: tuple of (names list, then mode, inode, size, and mtime in
+        nanoseconds arrays)
+    """
+    names = []
+    modes = array('I')
+    inodes = array('Q')
+    sizes = array('q')
+    mtimes = array('q')
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+    try:
+        for name in os.listdir(fd):
+            try:
+                st = os.stat(name, dir_fd=fd, follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            names.append(name)
+            modes.append(st.st_mode)
+            inodes.append(st.st_ino)
+            sizes.append(st.st_size)
+            mtimes.append(st.st_mtime_ns)
+    finally:
+        os.close(fd)
+    return names, modes, inodes, sizes, mtimes
@@ -63,6 +63,118 @@ def find_binary(binary, paths=None, fallback=None):
     raise CommandNotFound(binary)
 
 
+class BinaryCache:
+    """Cache of PATH directory listings for resolving binaries.
+
+    :py:func:`find_binary` probes every PATH directory in turn for each
+    lookup.  Here each directory is listed once and its listing reused until
+    the directory's mtime changes, so a lookup only checks that the matching
+    file is an executable.  Listings are shared across lookups using
+    different PATH values.
+
+    Directory mtimes are rechecked at most every :py:attr:`ttl` seconds, so
+    bursts of lookups don't stat every PATH directory each time.  Directories
+    modified within the last :py:attr:`racy_window` seconds aren't cached
+    since they could change again within the filesystem's mtime granularity.
+    """
+
+    ttl = 1.0
+    racy_window = 2.0
+
+    def __init__(self):
+        # directory path -> (mtime_ns, frozenset of entries, last checked)
+        self._dirs = {}
+        # PATH entries -> absolute paths
+        self._paths = {}
+
+    def clear(self):
+        """Drop all cached listings."""
+        self._dirs.clear()
+        self._paths.clear()
+
+    def _abspaths(self, paths):
+        if paths is None:
+            paths = os.environ.get("PATH", "")
+        elif not isinstance(paths, str):
+            paths = tuple(paths)
+        abspaths = self._paths.get(paths)
+        if abspaths is None:
+            # relative entries depend on the working directory
+            entries = paths.split(":") if isinstance(paths, str) else paths
+            abspaths = tuple(os.path.abspath(x) for x in entries)
+            if all(os.path.isabs(x) for x in entries):
+                self._paths[paths] = abspaths
+        return abspaths
+
+    def _listing(self, path, now):
+        cached = self._dirs.get(path)
+        if cached is not None and now - cached[2] < self.ttl:
+            return cached[1]
+        try:
+            st = os.stat(path)
+        except EnvironmentError:
+            return frozenset()
+        if cached is not None and cached[0] == st.st_mtime_ns:
+            self._dirs[path] = (cached[0], cached[1], now)
+            return cached[1]
+        try:
+            names = frozenset(os.listdir(path))
+        except EnvironmentError:
+            names = frozenset()
+        if time.time() - st.st_mtime > self.racy_window:
+            self._dirs[path] = (st.st_mtime_ns, names, now)
+        else:
+            self._dirs.pop(path, None)
+        return names
+
+    def find(self, binary, paths=None, fallback=None):
+        """Cached equivalent of :py:func:`find_binary`."""
+        if os.path.isabs(binary) or os.sep in binary:
+            return find_binary(binary, paths, fallback)
+
+        now = time.monotonic()
+        for path in self._abspaths(paths):
+            if binary in self._listing(path, now):
+                filename = os.path.join(path, binary)
+                if access(filename, os.X_OK) and os.path.isfile(filename):
+                    return filename
+
+        if fallback is not None:
+            return fallback
+
+        raise CommandNotFound(binary)
+
+    def warm(self, binaries=(), paths=None):
+        """Load the listings of all PATH directories in bulk.
+
+        :param binaries: binaries to resolve once loaded
+        :return: mapping of each binary to its path, None if it wasn't found
+        """
+        now = time.monotonic()
+        for path in self._abspaths(paths):
+            self._listing(path, now)
+        found = {}
+        for binary in binaries:
+            try:
+                found[binary] = self.find(binary, paths)
+            except CommandNotFound:
+                found[binary] = None
+        return found
+
+
+_binary_cache = BinaryCache()
+
+
+def find_binary_cached(binary, paths=None, fallback=None):
+    """:py:func:`find_binary` backed by a process wide :py:class:`BinaryCache`"""
+    return _binary_cache.find(binary, paths, fallback)
+
+
+def warm_binary_cache(binaries=(), paths=None):
+    """Load the process wide binary cache; see :py:meth:`BinaryCache.warm`"""
+    return _binary_cache.warm(binaries, paths)
+
+
 def get_exit_status(status):
     """Get the exit status of a child from an os.waitpid call.
 
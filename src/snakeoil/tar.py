@@ -14,7 +14,14 @@ In usage, instead of importing tarfile you should just import this module
 instead.  It's intended to be a drop in replacement.
 """
 
+from array import array
+import io
+import os
+import struct
 import sys
+
+from .fileutils import AtomicWriteFile
+
 t = sys.modules.pop("tarfile", None)
 tarfile = __import__("tarfile")
 if t is not None:
@@ -107,3 +114,321 @@ for x in tarfile.__all__:
     locals()[x] = getattr(tarfile, x)
 # pylint: disable=undefined-loop-variable
 del x
+
+
+class StreamingTarFile(tarfile.TarFile):
+
+    """
+    TarFile that doesn't retain the members it reads.
+
+    :py:class:`tarfile.TarFile` keeps every member it reads in its members
+    list, so memory usage grows with the size of the archive when iterating
+    over it.  Here members are dropped once read, making iteration run in
+    near constant memory.  Members can be extracted as they're iterated over,
+    or via :py:meth:`extractall` (which only retains directory members, to
+    set their attributes last).
+
+    Since members aren't retained, archives can only be iterated over once,
+    and :py:meth:`getmember`, :py:meth:`getmembers`, and
+    :py:meth:`getnames` don't work.  Hardlinks are extracted by linking to
+    their already extracted targets.
+    """
+
+    def next(self):
+        tarinfo = super().next()
+        self.members.clear()
+        return tarinfo
+
+    def _unsupported(self, *args, **kwargs):
+        raise tarfile.StreamError(
+            'members of a streaming tarfile can only be iterated over')
+
+    getmember = getmembers = getnames = _unsupported
+
+
+class TarIndex:
+
+    """
+    Compact index of the members of a tarball.
+
+    Member data is held in flat arrays, one entry per member in archive
+    order, rather than as a TarInfo per member.
+
+    :ivar offsets: offset of each member's first header
+    :ivar data_offsets: offset of each member's data
+    :ivar sizes: size of each member's data
+    :ivar types: tar type flag of each member
+    """
+
+    __slots__ = (
+        "offsets", "data_offsets", "sizes", "types", "_names", "_name_ends",
+        "_order")
+
+    _magic = b'SOTARIDX'
+    _header = struct.Struct('<8sIQQQ')
+    _version = 1
+
+    def __init__(self, names, offsets, data_offsets, sizes, types):
+        """
+        :param names: iterable of member names
+        :param offsets: array of header offsets
+        :param data_offsets: array of data offsets
+        :param sizes: array of data sizes
+        :param types: bytes of member type flags
+        """
+        self.offsets = offsets
+        self.data_offsets = data_offsets
+        self.sizes = sizes
+        self.types = types
+        self._name_ends = array('Q')
+        names_blob = bytearray()
+        for name in names:
+            names_blob += name.encode('utf-8', 'surrogateescape')
+            self._name_ends.append(len(names_blob))
+        self._names = bytes(names_blob)
+        # lookups are by normalized name, with members of the same name kept
+        # in archive order
+        keys = [self._key(x) for x in self]
+        self._order = array('Q', sorted(range(len(self)), key=keys.__getitem__))
+
+    @staticmethod
+    def _key(name):
+        return os.path.normpath(name).encode('utf-8', 'surrogateescape')
+
+    @classmethod
+    def build(cls, fileobj):
+        """Index the tarball readable from a seekable file object."""
+        names = []
+        offsets, data_offsets, sizes = array('Q'), array('Q'), array('Q')
+        types = bytearray()
+        for info in StreamingTarFile(fileobj=fileobj):
+            names.append(info.name)
+            offsets.append(info.offset)
+            data_offsets.append(info.offset_data)
+            sizes.append(info.size)
+            types += info.type
+        return cls(names, offsets, data_offsets, sizes, bytes(types))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def name(self, idx):
+        """Return the name of the member at position `idx`."""
+        start = self._name_ends[idx - 1] if idx else 0
+        return self._names[start:self._name_ends[idx]].decode('utf-8', 'surrogateescape')
+
+    def __iter__(self):
+        return (self.name(x) for x in range(len(self)))
+
+    def __contains__(self, name):
+        return self.find(name) is not None
+
+    def find(self, name, limit=None):
+        """Return the position of member `name`, None if there's no such member.
+
+        If multiple members share the name, the last is returned.
+
+        :param limit: if given, only members before this position are matched
+        """
+        key = self._key(name)
+        order = self._order
+        lo, hi = 0, len(order)
+        # find the end of the run of matching names
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key < self._key(self.name(order[mid])):
+                hi = mid
+            else:
+                lo = mid + 1
+        while lo and self._key(self.name(order[lo - 1])) == key:
+            idx = order[lo - 1]
+            if limit is None or idx < limit:
+                return idx
+            lo -= 1
+        return None
+
+    def dump(self, f, size, mtime_ns):
+        """Write the index to a binary file object.
+
+        :param size: size of the indexed tarball
+        :param mtime_ns: mtime of the indexed tarball, in nanoseconds
+        """
+        f.write(self._header.pack(self._magic, self._version, size, mtime_ns, len(self)))
+        f.write(self.types)
+        for arr in (self.offsets, self.data_offsets, self.sizes, self._name_ends, self._order):
+            if sys.byteorder == 'big':
+                arr = array('Q', arr)
+                arr.byteswap()
+            f.write(arr.tobytes())
+        f.write(self._names)
+
+    @classmethod
+    def load(cls, f, size, mtime_ns):
+        """Read an index written by :py:meth:`dump`.
+
+        :return: the index, None if the file is invalid or for a different
+            version of the tarball
+        """
+        header = f.read(cls._header.size)
+        if len(header) != cls._header.size:
+            return None
+        magic, version, stored_size, stored_mtime_ns, count = cls._header.unpack(header)
+        if (magic, version, stored_size, stored_mtime_ns) != (
+                cls._magic, cls._version, size, mtime_ns):
+            return None
+        obj = cls.__new__(cls)
+        obj.types = f.read(count)
+        arrays = []
+        for _ in range(5):
+            arr = array('Q')
+            data = f.read(count * arr.itemsize)
+            if len(data) != count * arr.itemsize:
+                return None
+            arr.frombytes(data)
+            if sys.byteorder == 'big':
+                arr.byteswap()
+            arrays.append(arr)
+        obj.offsets, obj.data_offsets, obj.sizes, obj._name_ends, obj._order = arrays
+        obj._names = f.read()
+        if len(obj.types) != count or len(obj._names) != (obj._name_ends[-1] if count else 0):
+            return None
+        return obj
+
+
+# links followed before giving up, as the kernel does with ELOOP
+_max_link_hops = 40
+
+
+class IndexedTarFile:
+
+    """
+    Random access to the members of a tarball.
+
+    On first use the tarball is scanned to build a :py:class:`TarIndex`,
+    which is saved to a sidecar file; afterwards reading a member takes a
+    single seek to its header.  Compressed tarballs (gzip, bzip2, or xz) are
+    read via :py:func:`snakeoil.compression.open_seekable`, whose checkpoint
+    index is saved alongside.
+
+    Note that members are read from their own headers, so settings from pax
+    global headers earlier in the archive aren't applied.
+    """
+
+    def __init__(self, path, index_path=None):
+        """
+        :param path: tarball path
+        :param index_path: sidecar file path the member index is cached at,
+            defaults to the tarball path with an `.index` suffix
+        """
+        self.path = path
+        self.index_path = f'{path}.index' if index_path is None else index_path
+        self._file = self._open()
+        try:
+            self.index = self._load_index()
+            self._tar = StreamingTarFile(fileobj=self._file)
+        except BaseException:
+            self._file.close()
+            raise
+        # the first member was read on init, drop it so next() reads from
+        # wherever it's pointed at
+        self._tar.firstmember = None
+
+    def _open(self):
+        from .compression import _seekable
+        # open is tarfile.open in this module's namespace
+        f = io.open(self.path, 'rb')
+        try:
+            magic = f.read(6)
+        except BaseException:
+            f.close()
+            raise
+        if any(magic.startswith(prefix) for prefix, _ in _seekable._magics):
+            f.close()
+            return _seekable.open_seekable(
+                self.path, index_path=f'{self.index_path}.checkpoints')
+        f.seek(0)
+        return f
+
+    def _load_index(self):
+        st = os.stat(self.path)
+        try:
+            with io.open(self.index_path, 'rb') as f:
+                index = TarIndex.load(f, st.st_size, st.st_mtime_ns)
+            if index is not None:
+                return index
+        except EnvironmentError:
+            pass
+
+        index = TarIndex.build(self._file)
+        try:
+            f = AtomicWriteFile(self.index_path, binary=True)
+            try:
+                index.dump(f, st.st_size, st.st_mtime_ns)
+            except BaseException:
+                f.discard()
+                raise
+            f.close()
+        except EnvironmentError:
+            # persisting the index is purely an optimization
+            pass
+        return index
+
+    def getnames(self):
+        """Return the member names in archive order."""
+        return list(self.index)
+
+    def _getmember(self, idx):
+        self._file.seek(self.index.offsets[idx])
+        self._tar.offset = self.index.offsets[idx]
+        return self._tar.next()
+
+    def getmember(self, name):
+        """Return the TarInfo for member `name`, raising KeyError if it doesn't exist."""
+        idx = self.index.find(name)
+        if idx is None:
+            raise KeyError(f'filename {name!r} not found')
+        return self._getmember(idx)
+
+    def extractfile(self, name):
+        """Return a file object for reading member `name`.
+
+        Links are followed to their targets, absolute symlinks relative to
+        the archive root; None is returned for members without data such as
+        directories.
+
+        :raise KeyError: if the member or a link target doesn't exist, or
+            links are nested too deeply (e.g. they form a cycle)
+        """
+        idx = self.index.find(name)
+        if idx is None:
+            raise KeyError(f'filename {name!r} not found')
+        info = self._getmember(idx)
+        hops = 0
+        while info.islnk() or info.issym():
+            hops += 1
+            if hops > _max_link_hops:
+                raise KeyError(f'too many levels of links: {name!r}')
+            if info.issym():
+                if info.linkname.startswith('/'):
+                    linkname = info.linkname.lstrip('/')
+                else:
+                    linkname = '/'.join(filter(None, (os.path.dirname(info.name), info.linkname)))
+                idx = self.index.find(linkname)
+            else:
+                # hardlinks refer to already archived files
+                linkname = info.linkname
+                idx = self.index.find(linkname, limit=idx)
+            if idx is None:
+                raise KeyError(f'linkname {linkname!r} not found')
+            info = self._getmember(idx)
+        return self._tar.extractfile(info)
+
+    def close(self):
+        self._tar.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
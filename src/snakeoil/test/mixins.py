@@ -61,6 +61,8 @@ class PythonNamespaceWalker:
 
     module_blacklist = frozenset([
         'snakeoil.cli.arghparse', 'snakeoil.pickling',
+        # requires the optional zstandard module
+        'snakeoil.compression._zstd',
     ])
 
     def _default_module_blacklister(self, target):
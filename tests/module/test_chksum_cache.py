@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+from snakeoil import chksum
+from snakeoil.chksum.cache import CachedChksummer, ChksumCache
+
+
+class TestChksumCache:
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmpdir):
+        self.cache = ChksumCache(str(tmpdir.join('chksums.db')))
+        self.fp = str(tmpdir.join('file'))
+        with open(self.fp, 'w') as f:
+            f.write('foon')
+        # recently modified files aren't cached
+        os.utime(self.fp, (1000000000, 1000000000))
+        self.calls = []
+        yield
+        chksum.set_cache(None)
+        self.cache.close()
+
+    def compute(self, chksums):
+        self.calls.append(tuple(chksums))
+        return chksum.get_chksums(self.fp, *chksums)
+
+    def test_get_chksums(self):
+        expected = chksum.get_chksums(self.fp, 'md5', 'sha1')
+        assert self.cache.get_chksums(self.fp, ('md5', 'sha1'), self.compute) == expected
+        assert self.calls == [('md5', 'sha1')]
+        assert self.cache.get_chksums(self.fp, ('md5', 'sha1'), self.compute) == expected
+        assert self.calls == [('md5', 'sha1')]
+        # only misses are computed
+        self.cache.get_chksums(self.fp, ('sha1', 'sha256'), self.compute)
+        assert self.calls[-1] == ('sha256',)
+
+    def test_modification(self):
+        self.cache.get_chksums(self.fp, ('md5',), self.compute)
+        st = os.stat(self.fp)
+        with open(self.fp, 'w') as f:
+            f.write('dar')
+        os.utime(self.fp, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        assert self.cache.get_chksums(self.fp, ('md5',), self.compute) == \
+            chksum.get_chksums(self.fp, 'md5')
+        assert len(self.calls) == 2
+        # the stale entry was dropped
+        assert self.cache.get(st, ('md5',)) == {}
+
+    def test_racy(self):
+        os.utime(self.fp)
+        expected = chksum.get_chksums(self.fp, 'md5')
+        assert self.cache.get_chksums(self.fp, ('md5',), self.compute) == expected
+        # a rewrite in the same mtime tick wouldn't change the stat identity
+        assert self.cache.get(os.stat(self.fp), ('md5',)) == {}
+        assert self.cache.get_chksums(self.fp, ('md5',), self.compute) == expected
+        assert len(self.calls) == 2
+
+    def test_persistence(self, tmpdir):
+        self.cache.get_chksums(self.fp, ('md5',), self.compute)
+        cache = ChksumCache(self.cache.path)
+        assert cache.get(os.stat(self.fp), ('md5',)) == \
+            {'md5': chksum.get_chksums(self.fp, 'md5')[0]}
+        cache.close()
+
+    def test_eviction(self, tmpdir):
+        self.cache.max_size = 0
+        self.cache._evict_check_interval = 1
+        st = os.stat(self.fp)
+        self.cache.update(st, {'md5': 1})
+        # evicted on the next insert
+        self.cache.update(st, {'sha1': 2})
+        assert self.cache.get(st, ('md5', 'sha1')) == {'sha1': 2}
+
+    def test_set_cache(self):
+        chksum.set_cache(self.cache)
+        expected = chksum.get_chksums(self.fp, 'md5', 'sha1')
+        st = os.stat(self.fp)
+        assert self.cache.get(st, ('md5', 'sha1')) == dict(zip(('md5', 'sha1'), expected))
+        self.cache.update(st, {'md5': 1})
+        assert chksum.get_chksums(self.fp, 'md5', 'sha1') == [1, expected[1]]
+        handler = chksum.get_handler('md5')
+        assert isinstance(handler, CachedChksummer)
+        assert handler(self.fp) == 1
+        assert handler.chf_type == 'md5'
+        chksum.set_cache(None)
+        assert chksum.get_chksums(self.fp, 'md5') == expected[:1]
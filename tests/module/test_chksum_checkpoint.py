@@ -0,0 +1,84 @@
+import os
+import pickle
+
+import pytest
+
+from snakeoil import chksum
+from snakeoil.chksum.checkpoint import ChksumCheckpoint
+
+data = b"afsd123klawerponzzbnzsdf;h89y23746123;haas"
+
+
+class TestChksumCheckpoint:
+
+    chfs = ('md5', 'sha1', 'sha512', 'size')
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmpdir):
+        self.fp = str(tmpdir.join('partial'))
+        self.write(data * 1000, 'wb')
+
+    def write(self, content, mode='ab'):
+        with open(self.fp, mode) as f:
+            f.write(content)
+
+    def expected(self):
+        return chksum.get_chksums(self.fp, *self.chfs, parallelize=False)
+
+    def test_resume(self):
+        checkpoint = ChksumCheckpoint(self.chfs)
+        assert chksum.get_chksums(self.fp, *self.chfs, checkpoint=checkpoint) == self.expected()
+        assert checkpoint.offset == len(data) * 1000
+        self.write(data * 500)
+        assert chksum.get_chksums(
+            self.fp, *self.chfs, checkpoint=checkpoint, blocksize=4096) == self.expected()
+        assert checkpoint.offset == len(data) * 1500
+        # no change, nothing to hash
+        assert checkpoint.get_chksums(self.fp, self.chfs[::-1]) == self.expected()[::-1]
+
+    def test_only_new_data_read(self):
+        checkpoint = ChksumCheckpoint(self.chfs)
+        checkpoint.get_chksums(self.fp, self.chfs)
+        # corrupting the already hashed prefix goes unnoticed, proving it
+        # isn't reread.
+        with open(self.fp, 'r+b') as f:
+            f.write(b'x' * 10)
+        expected = checkpoint.get_chksums(self.fp, self.chfs)
+        self.write(data * 1000, 'wb')
+        assert expected == self.expected()
+
+    def test_restart(self):
+        checkpoint = ChksumCheckpoint(self.chfs)
+        checkpoint.get_chksums(self.fp, self.chfs)
+        # truncated
+        self.write(data, 'wb')
+        assert checkpoint.get_chksums(self.fp, self.chfs) == self.expected()
+        assert checkpoint.offset == len(data)
+        # replaced; the old file is kept around so its inode can't be reused
+        os.rename(self.fp, self.fp + '.old')
+        self.write(data * 2)
+        assert checkpoint.get_chksums(self.fp, self.chfs) == self.expected()
+        assert checkpoint.offset == len(data) * 2
+
+    def test_pickling(self):
+        checkpoint = ChksumCheckpoint(('size',))
+        checkpoint.get_chksums(self.fp, ('size',))
+        restored = pickle.loads(pickle.dumps(checkpoint))
+        assert restored.offset == checkpoint.offset
+        self.write(data)
+        assert restored.get_chksums(self.fp, ('size',)) == [len(data) * 1001]
+
+        # hashlib state can't be serialized, so it restarts
+        checkpoint = ChksumCheckpoint(self.chfs)
+        checkpoint.get_chksums(self.fp, self.chfs)
+        restored = pickle.loads(pickle.dumps(checkpoint))
+        assert restored.offset == 0
+        assert restored.get_chksums(self.fp, self.chfs) == self.expected()
+
+    def test_bad_args(self):
+        checkpoint = ChksumCheckpoint(('md5',))
+        with pytest.raises(ValueError):
+            checkpoint.get_chksums(self.fp, ('sha1',))
+        with open(self.fp, 'rb') as f:
+            with pytest.raises(TypeError):
+                checkpoint.get_chksums(f, ('md5',))
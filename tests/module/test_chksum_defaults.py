@@ -1,11 +1,14 @@
+import functools
 import os
 import tempfile
+import threading
 
 import pytest
 
-from snakeoil import chksum, fileutils
+from snakeoil import chksum, compression, fileutils
+from snakeoil.chksum import defaults
 from snakeoil.currying import post_curry
-from snakeoil.data_source import data_source, local_source
+from snakeoil.data_source import bz2_source, compressed_source, data_source, local_source
 
 data = "afsd123klawerponzzbnzsdf;h89y23746123;haas"
 multi = 40000
@@ -116,3 +119,285 @@ class TestGetChksums(base):
 
     def get_chf(self):
         self.chf = post_curry(chksum.get_chksums, *self.chfs)
+
+
+class TestIterChksums:
+
+    chfs = ('md5', 'sha1', 'size')
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmpdir):
+        self.paths = []
+        for i in range(20):
+            path = str(tmpdir.join(str(i)))
+            with open(path, 'w') as f:
+                f.write(data * (i * 100))
+            self.paths.append(path)
+
+    def _check(self, **kwds):
+        expected = {p: chksum.get_chksums(p, *self.chfs) for p in self.paths}
+        results = dict(chksum.iter_chksums(self.paths, *self.chfs, **kwds))
+        assert results == expected
+
+    def test_threads(self):
+        self._check()
+        self._check(max_workers=1, sort_reads=False)
+
+    def test_processes(self):
+        self._check(max_workers=2, processes=True)
+
+    def test_no_chksums(self):
+        assert list(chksum.iter_chksums(self.paths)) == []
+
+    def test_missing_handler(self):
+        with pytest.raises(chksum.MissingChksumHandler):
+            list(chksum.iter_chksums(self.paths, 'nonexistent'))
+
+    def test_missing_file(self, tmpdir):
+        with pytest.raises(EnvironmentError):
+            list(chksum.iter_chksums([str(tmpdir.join('missing'))], 'md5'))
+
+
+class TestReadStrategies:
+
+    chfs = ('md5', 'sha1', 'size')
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmpdir):
+        self.fn = str(tmpdir.join('file'))
+        with open(self.fn, 'w') as f:
+            f.write(data * multi)
+
+    @pytest.mark.parametrize('parallelize', (True, False))
+    @pytest.mark.parametrize('strategy', defaults.read_strategies)
+    def test_strategies(self, strategy, parallelize, monkeypatch):
+        # small blocks to force cycling through the readinto buffer ring
+        monkeypatch.setattr(defaults, 'blocksize', 4096)
+        # threads are skipped on single cpu systems
+        monkeypatch.setattr(defaults, 'cpu_count', lambda: 2)
+        expected = [checksums[k][0] for k in self.chfs]
+        chfs = [chksum.get_handler(k).new() for k in self.chfs]
+        assert expected == defaults.chksum_loop_over_file(
+            self.fn, chfs, parallelize=parallelize, strategy=strategy)
+        with open(self.fn, 'rb') as f:
+            assert expected == defaults.chksum_loop_over_file(
+                f, chfs, parallelize=parallelize, strategy=strategy)
+        assert expected == defaults.chksum_loop_over_file(
+            local_source(self.fn), chfs, parallelize=parallelize, strategy=strategy)
+        assert expected == chksum.get_chksums(
+            self.fn, *self.chfs, parallelize=parallelize, strategy=strategy)
+
+    def test_unknown_strategy(self):
+        with pytest.raises(ValueError):
+            defaults.loop_over_file(self.fn, [lambda data: None], strategy='foo')
+
+    def test_readinto_callback_error(self, monkeypatch):
+        # errors in callback threads are reraised rather than starving the
+        # reader of free buffers
+        monkeypatch.setattr(defaults, 'cpu_count', lambda: 2)
+        chunks = []
+
+        def fail(data):
+            if chunks:
+                raise ValueError('callback failed')
+            chunks.append(bytes(data))
+
+        with pytest.raises(ValueError):
+            defaults.loop_over_file(
+                self.fn, [lambda data: None, fail], strategy='readinto', blocksize=64)
+        assert len(chunks) == 1
+
+
+class TestStrategySelector:
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, monkeypatch):
+        monkeypatch.setattr(defaults, 'cpu_count', lambda: 4)
+        self.selector = defaults.StrategySelector()
+
+    def test_small_files(self):
+        choice = self.selector.select(1024, 3)
+        assert not choice.parallelize
+        assert choice.strategy == 'read'
+
+    def test_large_files(self):
+        choice = self.selector.select(2 ** 30, 3, fstype='ext4')
+        assert choice.parallelize
+        assert choice.strategy == 'mmap'
+        assert choice.blocksize == self.selector.large_blocksize
+        assert not self.selector.select(2 ** 30, 1).parallelize
+        assert self.selector.select(2 ** 30, 3, can_mmap=False).strategy == 'readinto'
+
+    def test_unknown_size(self):
+        assert self.selector.select(None, 2) == (self.selector.blocksize, True, None)
+        assert self.selector.select(None, 1) == (self.selector.blocksize, False, None)
+
+    def test_fstypes(self):
+        choice = self.selector.select(2 ** 21, 2, fstype='nfs')
+        assert choice.strategy == 'readinto'
+        assert choice.blocksize == self.selector.large_blocksize
+        self.selector.fstypes['nfs'] = {'blocksize': 4096, 'mmap': True}
+        assert self.selector.select(2 ** 21, 2, fstype='nfs') == (4096, True, 'mmap')
+
+    def test_select_for(self, tmpdir):
+        path = str(tmpdir.join('file'))
+        with open(path, 'w') as f:
+            f.write(data)
+        assert self.selector.select_for(path, 2).strategy == 'read'
+        assert self.selector.select_for(local_source(path), 2).strategy == 'read'
+        assert self.selector.select_for(str(tmpdir.join('missing')), 2).strategy is None
+        with open(path) as f:
+            assert self.selector.select_for(f, 2).strategy is None
+
+    def test_calibrate(self, tmpdir):
+        self.selector.calibrate(
+            str(tmpdir), repeat=1, sizes=(2 ** 12, 2 ** 14), blocksizes=(2 ** 12, 2 ** 13))
+        assert list(tmpdir.listdir()) == []
+        fstype = defaults.fstype(os.stat(str(tmpdir)).st_dev)
+        if fstype is None:
+            assert self.selector.blocksize in (2 ** 12, 2 ** 13)
+        else:
+            assert self.selector.fstypes[fstype]['blocksize'] in (2 ** 12, 2 ** 13)
+
+        path = str(tmpdir.join('calibration.json'))
+        self.selector.save(path)
+        selector = defaults.StrategySelector()
+        selector.load(path)
+        for attr in defaults.StrategySelector._attrs:
+            assert getattr(selector, attr) == getattr(self.selector, attr)
+
+
+class TestHashingExecutor:
+
+    chfs = ('md5', 'sha1', 'sha256', 'size')
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmpdir):
+        self.executor = defaults.HashingExecutor(queue_size=2, buffers=2)
+        self.paths = []
+        for i in range(8):
+            path = str(tmpdir.join(str(i)))
+            with open(path, 'w') as f:
+                f.write(data * (i * 1000 + 1))
+            self.paths.append(path)
+        yield
+        self.executor.shutdown()
+
+    def new_chfs(self):
+        return [chksum.get_handler(k).new() for k in self.chfs]
+
+    def expected(self, path):
+        return defaults.chksum_loop_over_file(path, self.new_chfs(), parallelize=False)
+
+    @pytest.mark.parametrize('strategy', defaults.read_strategies)
+    def test_chksum_loop_over_file(self, strategy):
+        for path in self.paths:
+            assert self.expected(path) == self.executor.chksum_loop_over_file(
+                path, self.new_chfs(), strategy=strategy, blocksize=4096)
+            with open(path, 'rb') as f:
+                assert self.expected(path) == self.executor.chksum_loop_over_file(
+                    f, self.new_chfs(), strategy=strategy, blocksize=4096)
+
+    def test_concurrent_callers(self):
+        errors = []
+        def hash_all(strategy):
+            try:
+                for _ in range(5):
+                    for path in self.paths:
+                        result = self.executor.chksum_loop_over_file(
+                            path, self.new_chfs(), strategy=strategy, blocksize=4096)
+                        assert result == self.expected(path)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=hash_all, args=(strategy,))
+                   for strategy in defaults.read_strategies * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors
+        # one worker per hash, regardless of the number of callers
+        assert len(self.executor._threads) == len(self.chfs)
+
+    def test_bounded_threads(self):
+        # fresh constructors per call reuse the same workers
+        for _ in range(5):
+            chfs = [functools.partial(chf) for chf in self.new_chfs()]
+            assert self.expected(self.paths[1]) == self.executor.chksum_loop_over_file(
+                self.paths[1], chfs)
+        assert len(self.executor._threads) == len(self.chfs)
+
+    def test_errors(self):
+        class broken:
+            def update(self, data):
+                raise ValueError('broken')
+        with pytest.raises(ValueError):
+            self.executor.chksum_loop_over_file(
+                self.paths[1], self.new_chfs() + [broken])
+        # workers survive failures
+        assert self.expected(self.paths[1]) == self.executor.chksum_loop_over_file(
+            self.paths[1], self.new_chfs())
+
+    def test_default_executor(self, monkeypatch):
+        monkeypatch.setattr(defaults, 'cpu_count', lambda: 2)
+        monkeypatch.setattr(defaults, 'hashing_executor', self.executor)
+        assert self.expected(self.paths[1]) == defaults.chksum_loop_over_file(
+            self.paths[1], self.new_chfs())
+        assert self.executor._threads
+
+
+class TestGilBoundHandlers:
+
+    chfs = ('md5', 'sha1', 'sha256', 'size')
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmpdir, monkeypatch):
+        self.fn = str(tmpdir.join('file'))
+        with open(self.fn, 'w') as f:
+            f.write(data * multi)
+        self.expected = chksum.get_chksums(self.fn, *self.chfs, parallelize=False)
+        monkeypatch.setattr(defaults, 'cpu_count', lambda: 2)
+        for k in ('sha1', 'sha256'):
+            monkeypatch.setattr(chksum.get_handler(k), 'releases_gil', False)
+        self.submitted = []
+        pool = chksum._get_process_pool()
+        orig_submit = pool.submit
+        def submit(func, *args):
+            self.submitted.append(args)
+            return orig_submit(func, *args)
+        monkeypatch.setattr(pool, 'submit', submit)
+
+    def test_get_chksums(self):
+        assert self.expected == chksum.get_chksums(self.fn, *self.chfs)
+        assert sorted(self.submitted) == [(self.fn, ('sha1',)), (self.fn, ('sha256',))]
+        assert self.expected == chksum.get_chksums(local_source(self.fn), *self.chfs)
+
+    def test_no_parallelize(self):
+        assert self.expected == chksum.get_chksums(self.fn, *self.chfs, parallelize=False)
+        assert not self.submitted
+        # non path locations can't be handed to other processes
+        with open(self.fn) as f:
+            assert self.expected == chksum.get_chksums(f, *self.chfs)
+        assert not self.submitted
+
+    def test_compressed_source(self, tmpdir):
+        # the file backing compressed sources isn't the data to hash
+        content = os.urandom(defaults.selector.thread_min_size)
+        path = str(tmpdir.join('file.bz2'))
+        with open(path, 'wb') as f:
+            f.write(compression.compress_data('bzip2', content))
+        chfs = self.chfs[:-1]
+        expected = chksum.get_chksums(data_source(content), *chfs)
+        for source in (bz2_source(path), compressed_source(path)):
+            assert expected == chksum.get_chksums(source, *chfs, parallelize=False)
+            assert expected == chksum.get_chksums(source, *chfs)
+        assert not self.submitted
+
+    def test_iter_chksums(self, monkeypatch):
+        used = []
+        orig = chksum.futures.ProcessPoolExecutor
+        monkeypatch.setattr(
+            chksum.futures, 'ProcessPoolExecutor',
+            lambda *a, **kw: used.append(True) or orig(*a, **kw))
+        assert dict(chksum.iter_chksums([self.fn], *self.chfs)) == {self.fn: self.expected}
+        assert used
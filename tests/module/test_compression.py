@@ -0,0 +1,834 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import stat
+import subprocess
+import tarfile
+import time
+import zipfile
+
+import pytest
+
+from snakeoil import compression
+from snakeoil.compression import (
+    ArComp, ArCompError, _bzip2, _create, _extract, _parallel, _seekable)
+from snakeoil.process import find_binary, CommandNotFound
+
+
+def have_binary(name):
+    try:
+        find_binary(name)
+        return True
+    except CommandNotFound:
+        return False
+
+
+files = {
+    'a': b'foo\n',
+    'dir/b': b'bar\n' * 1000,
+    'dir/sub/c': os.urandom(4096),
+}
+
+
+def check_tree(path):
+    for name, data in files.items():
+        with open(os.path.join(path, name), 'rb') as f:
+            assert f.read() == data
+
+
+def make_tar(path, mode):
+    with tarfile.open(path, mode) as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o755 if name == 'a' else 0o644
+            tar.addfile(info, io.BytesIO(data))
+        info = tarfile.TarInfo('link')
+        info.type = tarfile.SYMTYPE
+        info.linkname = 'a'
+        tar.addfile(info)
+
+
+def make_zip(path):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in files.items():
+            info = zipfile.ZipInfo(name)
+            info.create_system = 3
+            info.external_attr = ((0o755 if name == 'a' else 0o644) | stat.S_IFREG) << 16
+            archive.writestr(info, data)
+        info = zipfile.ZipInfo('link')
+        info.create_system = 3
+        info.external_attr = (0o777 | stat.S_IFLNK) << 16
+        archive.writestr(info, 'a')
+
+
+class TestArCompUnpack:
+
+    @pytest.mark.parametrize('native', (True, False))
+    @pytest.mark.parametrize(('ext', 'mode', 'binary'), (
+        ('.tar', 'w', 'tar'),
+        ('.tar.gz', 'w:gz', 'gzip'),
+        ('.tar.bz2', 'w:bz2', 'bzip2'),
+        ('.tar.xz', 'w:xz', 'xz'),
+    ))
+    def test_tar(self, tmp_path, ext, mode, binary, native):
+        if not native and not (have_binary('tar') and have_binary(binary)):
+            pytest.skip(f'missing required binaries: tar, {binary}')
+        path = str(tmp_path / f'archive{ext}')
+        make_tar(path, mode)
+        dest = tmp_path / 'dest'
+        dest.mkdir()
+        ArComp(path, ext=ext).unpack(str(dest), native=native)
+        check_tree(str(dest))
+        assert os.readlink(str(dest / 'link')) == 'a'
+        assert stat.S_IMODE(os.stat(str(dest / 'a')).st_mode) & 0o100
+
+    @pytest.mark.parametrize('native', (True, False))
+    def test_zip(self, tmp_path, native):
+        if not native and not have_binary('unzip'):
+            pytest.skip('missing required binary: unzip')
+        path = str(tmp_path / 'archive.zip')
+        make_zip(path)
+        dest = tmp_path / 'dest'
+        dest.mkdir()
+        ArComp(path, ext='.zip').unpack(str(dest), native=native)
+        check_tree(str(dest))
+        assert os.readlink(str(dest / 'link')) == 'a'
+        assert stat.S_IMODE(os.stat(str(dest / 'a')).st_mode) == 0o755
+        assert stat.S_IMODE(os.stat(str(dest / 'dir/b')).st_mode) == 0o644
+
+    def test_archive_cwd(self, tmp_path, monkeypatch):
+        path = str(tmp_path / 'archive.tar.gz')
+        make_tar(path, 'w:gz')
+        dest = tmp_path / 'dest'
+        dest.mkdir()
+        monkeypatch.chdir(str(dest))
+        ArComp(os.path.relpath(path), ext='.tar.gz').unpack()
+        check_tree(str(dest))
+
+    @pytest.mark.parametrize('native', (True, False))
+    @pytest.mark.parametrize(('ext', 'opener'), (
+        ('.gz', gzip.open),
+        ('.bz2', bz2.open),
+        ('.xz', lzma.open),
+        ('.lzma', lambda path, mode: lzma.open(path, mode, format=lzma.FORMAT_ALONE)),
+    ))
+    def test_compressed(self, tmp_path, ext, opener, native):
+        arcomp = ArComp(str(tmp_path / f'file{ext}'), ext=ext)
+        if not native and not any(have_binary(x) for x in arcomp.binary):
+            pytest.skip(f'missing required binaries: {arcomp.binary}')
+        data = files['dir/b']
+        with opener(arcomp.path, 'wb') as f:
+            f.write(data)
+        dest = str(tmp_path / 'file')
+        arcomp.unpack(dest, native=native)
+        with open(dest, 'rb') as f:
+            assert f.read() == data
+
+    def test_native_skips_binaries(self, tmp_path, monkeypatch):
+        def find_binary(*args):
+            raise CommandNotFound(args[0])
+        monkeypatch.setattr(compression, 'find_binary_cached', find_binary)
+        path = str(tmp_path / 'archive.tar.xz')
+        make_tar(path, 'w:xz')
+        ArComp(path, ext='.tar.xz').unpack(str(tmp_path), native=True)
+        check_tree(str(tmp_path))
+
+    def test_unsupported_fallback(self, tmp_path, monkeypatch):
+        # data the stdlib can't handle is passed on to the binaries
+        calls = []
+        monkeypatch.setattr(
+            compression._CompressedStdin, '_unpack_binary',
+            lambda self, dest, **kwargs: calls.append(dest))
+        path = tmp_path / 'file.Z'
+        path.write_bytes(b'\x1f\x9d\x90' + os.urandom(64))
+        dest = str(tmp_path / 'file')
+        ArComp(str(path), ext='.Z').unpack(dest, native=True)
+        assert calls == [dest]
+        assert not os.path.exists(dest)
+
+    def test_tar_without_filter(self, tmp_path, monkeypatch):
+        # without tarfile's data filter, tarballs are left to the binaries
+        calls = []
+        monkeypatch.setattr(compression, '_tar_filter', None)
+        monkeypatch.setattr(
+            compression._Tar, '_unpack_binary',
+            lambda self, dest, **kwargs: calls.append(dest))
+        path = str(tmp_path / 'archive.tar.gz')
+        make_tar(path, 'w:gz')
+        dest = str(tmp_path / 'dest')
+        ArComp(path, ext='.tar.gz').unpack(dest, native=True)
+        assert calls == [dest]
+        assert not os.path.exists(dest)
+
+    def test_corrupt(self, tmp_path):
+        path = str(tmp_path / 'archive.tar.gz')
+        make_tar(path, 'w:gz')
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        with pytest.raises(ArCompError):
+            ArComp(path, ext='.tar.gz').unpack(str(tmp_path), native=True)
+
+
+def tree(path):
+    """map of relative paths to (type, mode, data) for a directory tree"""
+    result = {}
+    for root, dirs, filenames in os.walk(path):
+        for name in dirs + filenames:
+            full = os.path.join(root, name)
+            st = os.lstat(full)
+            if stat.S_ISLNK(st.st_mode):
+                data = os.readlink(full)
+            elif stat.S_ISDIR(st.st_mode):
+                data = None
+            else:
+                with open(full, 'rb') as f:
+                    data = f.read()
+            result[os.path.relpath(full, path)] = (
+                stat.S_IFMT(st.st_mode), stat.S_IMODE(st.st_mode), data)
+    return result
+
+
+class TestParallelExtract:
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, monkeypatch):
+        # exercise backpressure and direct writes with small archives
+        monkeypatch.setattr(_extract, '_max_pending', 10000)
+        monkeypatch.setattr(_extract, '_max_queued', 5000)
+        monkeypatch.setattr(_extract, '_batch_members', 4)
+        monkeypatch.setattr(_extract, '_batch_bytes', 2000)
+        monkeypatch.setattr(_extract, '_prune_interval', 4)
+
+    def make_tar(self, path):
+        def add(name, data=None, **attrs):
+            info = tarfile.TarInfo(name)
+            for k, v in attrs.items():
+                setattr(info, k, v)
+            if data is not None:
+                info.size = len(data)
+                data = io.BytesIO(data)
+            tar.addfile(info, data)
+
+        with tarfile.open(path, 'w:gz') as tar:
+            add('real', type=tarfile.DIRTYPE, mode=0o755)
+            # files are written through symlinks created earlier
+            add('lib', type=tarfile.SYMTYPE, linkname='real')
+            add('lib/a', b'a' * 100)
+            for i in range(100):
+                add(f'dir{i % 7}/sub/file{i}', os.urandom(i * 37), mode=0o600 + i % 2 * 0o100)
+            add('big', os.urandom(20000))
+            add('hard', type=tarfile.LNKTYPE, linkname='big')
+            # later members of the same name win
+            add('dup', b'first')
+            add('dup', b'second')
+            # directory modes are set last, so their contents are writable
+            add('ro', type=tarfile.DIRTYPE, mode=0o555)
+            add('ro/file', b'ro')
+
+    @pytest.mark.skipif(not hasattr(tarfile, 'data_filter'), reason='tarfile lacks filters')
+    @pytest.mark.parametrize('jobs', (None, 1, 4))
+    def test_tar(self, tmp_path, jobs):
+        path = str(tmp_path / 'archive.tar.gz')
+        self.make_tar(path)
+        dest = tmp_path / 'dest'
+        dest.mkdir()
+        ArComp(path, ext='.tar.gz').unpack(str(dest), native=True, jobs=jobs)
+        assert os.path.samefile(str(dest / 'big'), str(dest / 'hard'))
+        assert (dest / 'real/a').read_bytes() == b'a' * 100
+        assert (dest / 'dup').read_bytes() == b'second'
+        assert (dest / 'ro/file').read_bytes() == b'ro'
+        assert stat.S_IMODE(os.stat(str(dest / 'dir3/sub/file3')).st_mode) == 0o700
+
+        # matches serial extraction
+        serial = tmp_path / 'serial'
+        serial.mkdir()
+        with tarfile.open(path) as tar:
+            tar.extractall(str(serial), filter='data')
+        assert tree(str(dest)) == tree(str(serial))
+
+    @pytest.mark.parametrize('jobs', (1, 4))
+    def test_tar_dir_modes(self, tmp_path, jobs):
+        # the data filter drops directory modes; without a filter they're
+        # set last, so their contents are writable
+        path = str(tmp_path / 'archive.tar.gz')
+        self.make_tar(path)
+        dest = tmp_path / 'dest'
+        with tarfile.open(path, 'r|gz') as tar:
+            _extract.extract_tar(tar, str(dest), jobs)
+        assert stat.S_IMODE(os.stat(str(dest / 'ro')).st_mode) == 0o555
+        assert (dest / 'ro/file').read_bytes() == b'ro'
+        # allow cleanup
+        os.chmod(str(dest / 'ro'), 0o755)
+
+    def test_tar_error(self, tmp_path):
+        path = str(tmp_path / 'archive.tar')
+        with tarfile.open(path, 'w') as tar:
+            info = tarfile.TarInfo('hard')
+            info.type = tarfile.LNKTYPE
+            info.linkname = 'missing'
+            tar.addfile(info)
+        with pytest.raises(ArCompError):
+            ArComp(path, ext='.tar').unpack(str(tmp_path / 'dest'), native=True, jobs=4)
+
+    @pytest.mark.skipif(not hasattr(tarfile, 'data_filter'), reason='tarfile lacks filters')
+    @pytest.mark.parametrize('jobs', (1, 4))
+    @pytest.mark.parametrize('name', ('evil/passwd', 'evil/sub/passwd', 'evil'))
+    def test_tar_symlink_escape(self, tmp_path, jobs, name):
+        # members can't be written through symlinks extracted earlier
+        outside = tmp_path / 'outside'
+        outside.mkdir()
+        path = str(tmp_path / 'archive.tar')
+        with tarfile.open(path, 'w') as tar:
+            info = tarfile.TarInfo('evil')
+            info.type = tarfile.SYMTYPE
+            # relative, absolute links are refused upfront
+            info.linkname = '../outside/passwd' if name == 'evil' else '../outside'
+            tar.addfile(info)
+            # queued in the same batch, the symlink doesn't exist on disk yet
+            # when the following member is read
+            info = tarfile.TarInfo(name)
+            info.size = 4
+            tar.addfile(info, io.BytesIO(b'root'))
+        with pytest.raises(ArCompError, match='outside the destination'):
+            ArComp(path, ext='.tar').unpack(str(tmp_path / 'dest'), native=True, jobs=jobs)
+        assert os.listdir(str(outside)) == []
+
+    @pytest.mark.parametrize('jobs', (1, 4))
+    @pytest.mark.parametrize('filter', (None, 'tar_filter', 'data_filter'))
+    @pytest.mark.parametrize('absolute', (True, False))
+    def test_tar_hardlink_escape(self, tmp_path, jobs, filter, absolute):
+        # files can't be written through hardlinks to files outside dest
+        if filter is not None:
+            if not hasattr(tarfile, filter):
+                pytest.skip('tarfile lacks filters')
+            filter = getattr(tarfile, filter)
+        outside = tmp_path / 'outside'
+        outside.mkdir()
+        secret = outside / 'secret'
+        secret.write_bytes(b'secret')
+        path = str(tmp_path / 'archive.tar')
+        with tarfile.open(path, 'w') as tar:
+            info = tarfile.TarInfo('link')
+            info.type = tarfile.LNKTYPE
+            info.linkname = str(secret) if absolute else '../outside/secret'
+            tar.addfile(info)
+            info = tarfile.TarInfo('link')
+            info.size = 4
+            tar.addfile(info, io.BytesIO(b'root'))
+        with tarfile.open(path) as tar, pytest.raises((OSError, tarfile.TarError)):
+            _extract.extract_tar(tar, str(tmp_path / 'dest'), jobs, filter=filter)
+        assert secret.read_bytes() == b'secret'
+
+    @pytest.mark.parametrize('jobs', (1, 4))
+    def test_zip_symlink_escape(self, tmp_path, jobs):
+        outside = tmp_path / 'outside'
+        outside.mkdir()
+        path = str(tmp_path / 'archive.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            info = zipfile.ZipInfo('evil')
+            info.create_system = 3
+            info.external_attr = (0o777 | stat.S_IFLNK) << 16
+            archive.writestr(info, str(outside))
+            archive.writestr('evil/passwd', b'root')
+        with pytest.raises(ArCompError, match='outside the destination'):
+            ArComp(path, ext='.zip').unpack(str(tmp_path / 'dest'), native=True, jobs=jobs)
+        assert os.listdir(str(outside)) == []
+
+    @pytest.mark.parametrize('jobs', (1, 4))
+    def test_zip_symlink_replaced(self, tmp_path, jobs):
+        outside = tmp_path / 'outside'
+        outside.mkdir()
+        path = str(tmp_path / 'archive.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            info = zipfile.ZipInfo('evil')
+            info.create_system = 3
+            info.external_attr = (0o777 | stat.S_IFLNK) << 16
+            archive.writestr(info, str(outside / 'passwd'))
+            archive.writestr('./evil', b'root')
+        dest = tmp_path / 'dest'
+        ArComp(path, ext='.zip').unpack(str(dest), native=True, jobs=jobs)
+        assert os.listdir(str(outside)) == []
+        assert (dest / 'evil').read_bytes() == b'root'
+
+    @pytest.mark.parametrize('jobs', (1, 4))
+    def test_zip(self, tmp_path, jobs):
+        path = str(tmp_path / 'archive.zip')
+        make_zip(path)
+        with zipfile.ZipFile(path, 'a') as archive:
+            archive.writestr('big', os.urandom(20000))
+            for i in range(50):
+                archive.writestr(f'many/{i}', os.urandom(i * 37))
+        dest = tmp_path / 'dest'
+        dest.mkdir()
+        ArComp(path, ext='.zip').unpack(str(dest), native=True, jobs=jobs)
+        check_tree(str(dest))
+        assert os.readlink(str(dest / 'link')) == 'a'
+        assert stat.S_IMODE(os.stat(str(dest / 'a')).st_mode) == 0o755
+        with zipfile.ZipFile(path) as archive:
+            for i in range(50):
+                assert (dest / f'many/{i}').read_bytes() == archive.read(f'many/{i}')
+            assert (dest / 'big').read_bytes() == archive.read('big')
+
+
+class TestCreate:
+
+    formats = ('.tar', '.tar.gz', '.tar.bz2', '.tar.xz', '.zip')
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, monkeypatch):
+        # exercise backpressure and streamed reads with small trees
+        monkeypatch.setattr(_create, '_max_pending', 10000)
+        monkeypatch.setattr(_create, '_max_queued', 5000)
+        monkeypatch.delenv('SOURCE_DATE_EPOCH', raising=False)
+
+    def make_tree(self, path):
+        os.makedirs(os.path.join(path, 'empty'))
+        for name, data in files.items():
+            os.makedirs(os.path.join(path, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(path, name), 'wb') as f:
+                f.write(data)
+        os.makedirs(os.path.join(path, 'many'))
+        for i in range(50):
+            with open(os.path.join(path, f'many/{i}'), 'wb') as f:
+                f.write(os.urandom(i * 37))
+        with open(os.path.join(path, 'big'), 'wb') as f:
+            f.write(os.urandom(20000))
+        os.chmod(os.path.join(path, 'a'), 0o751)
+        os.symlink('dir/b', os.path.join(path, 'link'))
+        os.utime(os.path.join(path, 'a'), (1000000000, 1000000000))
+
+    @pytest.fixture
+    def src(self, tmp_path):
+        path = tmp_path / 'src'
+        self.make_tree(str(path))
+        return str(path)
+
+    @pytest.mark.parametrize('ext', formats)
+    @pytest.mark.parametrize('jobs', (1, 4))
+    def test_roundtrip(self, tmp_path, src, ext, jobs):
+        path = str(tmp_path / f'archive{ext}')
+        ArComp(path, ext=ext).create(src, jobs=jobs)
+        dest = tmp_path / 'dest'
+        dest.mkdir()
+        ArComp(path, ext=ext).unpack(str(dest))
+        assert tree(str(dest)) == tree(src)
+        if ext != '.zip':
+            # zipfile doesn't restore mtimes
+            assert os.stat(str(dest / 'a')).st_mtime == 1000000000
+
+    def test_tar_contents(self, tmp_path, src):
+        os.link(os.path.join(src, 'big'), os.path.join(src, 'hard'))
+        path = str(tmp_path / 'archive.tar.gz')
+        ArComp(path, ext='.tar.gz').create(src)
+        with tarfile.open(path) as tar:
+            names = tar.getnames()
+            assert tar.getmember('hard').islnk()
+            assert tar.getmember('link').linkname == 'dir/b'
+        # sorted by name, directories preceding their contents
+        assert names[:6] == ['a', 'big', 'dir', 'dir/b', 'dir/sub', 'dir/sub/c']
+
+    def test_zip_contents(self, tmp_path, src):
+        path = str(tmp_path / 'archive.zip')
+        ArComp(path, ext='.zip').create(src)
+        with zipfile.ZipFile(path) as archive:
+            assert archive.testzip() is None
+            assert archive.getinfo('empty/').is_dir()
+            assert archive.read('dir/sub/c') == files['dir/sub/c']
+            # incompressible data is stored
+            assert archive.getinfo('many/49').compress_type == zipfile.ZIP_STORED
+            assert archive.getinfo('dir/b').compress_type == zipfile.ZIP_DEFLATED
+            # large files are streamed, followed by a data descriptor
+            assert archive.getinfo('big').flag_bits & 0x8
+            assert archive.getinfo('big').compress_type == zipfile.ZIP_DEFLATED
+            with open(os.path.join(src, 'big'), 'rb') as f:
+                assert archive.read('big') == f.read()
+        if have_binary('unzip'):
+            subprocess.run(['unzip', '-tq', path], check=True, stdout=subprocess.DEVNULL)
+
+    def test_zip_names(self, tmp_path, src):
+        with open(os.path.join(src, 'caf\xe9'), 'wb') as f:
+            f.write(b'x')
+        path = str(tmp_path / 'archive.zip')
+        ArComp(path, ext='.zip').create(src)
+        with zipfile.ZipFile(path) as archive:
+            # non-ascii names are flagged as utf-8
+            assert archive.getinfo('caf\xe9').flag_bits & 0x800
+            assert not archive.getinfo('dir/b').flag_bits & 0x800
+
+    def test_zip64_fallback(self, tmp_path, src, monkeypatch):
+        monkeypatch.setattr(_create, '_zip_limit', 1000)
+        path = str(tmp_path / 'archive.zip')
+        ArComp(path, ext='.zip').create(src, mtime=0)
+        dest = tmp_path / 'dest'
+        dest.mkdir()
+        ArComp(path, ext='.zip').unpack(str(dest))
+        assert tree(str(dest)) == tree(src)
+
+    @pytest.mark.parametrize('ext', formats)
+    def test_reproducible(self, tmp_path, src, ext):
+        first = tmp_path / f'first{ext}'
+        second = tmp_path / f'second{ext}'
+        ArComp(str(first), ext=ext).create(src, jobs=1, mtime=0)
+        os.utime(os.path.join(src, 'big'))
+        ArComp(str(second), ext=ext).create(src, jobs=4, mtime=0)
+        assert first.read_bytes() == second.read_bytes()
+
+    def test_reproducible_timezone(self, tmp_path, src, monkeypatch):
+        archives = []
+        try:
+            for tz in ('UTC', 'EST+5'):
+                monkeypatch.setenv('TZ', tz)
+                time.tzset()
+                path = tmp_path / f'archive-{len(archives)}.zip'
+                ArComp(str(path), ext='.zip').create(src, mtime=1000000000)
+                archives.append(path.read_bytes())
+        finally:
+            monkeypatch.delenv('TZ')
+            time.tzset()
+        assert archives[0] == archives[1]
+        with zipfile.ZipFile(str(path)) as archive:
+            assert archive.getinfo('a').date_time == (2001, 9, 9, 1, 46, 40)
+
+    def test_tar_owners(self, tmp_path, src):
+        path = tmp_path / 'archive.tar'
+        ArComp(str(path), ext='.tar').create(src)
+        with tarfile.open(str(path)) as tar:
+            assert {(x.uid, x.gid, x.uname, x.gname) for x in tar} == {(0, 0, '', '')}
+        with open(str(path), 'wb') as f:
+            _create.create_tar(f, src, owners=True)
+        with tarfile.open(str(path)) as tar:
+            assert tar.getmember('a').uid == os.getuid()
+            assert tar.getmember('a').gid == os.getgid()
+
+    def test_source_date_epoch(self, tmp_path, src, monkeypatch):
+        monkeypatch.setenv('SOURCE_DATE_EPOCH', '1500000000')
+        path = str(tmp_path / 'archive.tar')
+        ArComp(path, ext='.tar').create(src)
+        with tarfile.open(path) as tar:
+            # newer mtimes are clamped, older ones are kept
+            assert tar.getmember('a').mtime == 1000000000
+            assert tar.getmember('big').mtime == 1500000000
+        ArComp(path, ext='.tar').create(src, mtime=5)
+        with tarfile.open(path) as tar:
+            assert {x.mtime for x in tar.getmembers()} == {5}
+
+    def test_error(self, tmp_path):
+        path = tmp_path / 'archive.tar.gz'
+        with pytest.raises(ArCompError):
+            ArComp(str(path), ext='.tar.gz').create(str(tmp_path / 'missing'))
+        # partial output is removed
+        assert not path.exists()
+
+    def test_unsupported(self, tmp_path, src):
+        with pytest.raises(ArCompError, match='creation unsupported'):
+            ArComp(str(tmp_path / 'archive.tar.lzma'), ext='.tar.lzma').create(src)
+        with pytest.raises(ArCompError, match='creation unsupported'):
+            ArComp(str(tmp_path / 'archive.7z'), ext='.7z').create(src)
+        assert not (tmp_path / 'archive.tar.lzma').exists()
+
+
+class TestParallel:
+
+    decompressors = {
+        'gzip': gzip.decompress,
+        'bzip2': bz2.decompress,
+        'xz': lzma.decompress,
+    }
+    compressors = {
+        'gzip': gzip.compress,
+        'bzip2': bz2.compress,
+        'xz': lzma.compress,
+    }
+    data = os.urandom(100000) + b'snakeoil' * 100000
+
+    @pytest.fixture(autouse=True)
+    def _setup(self, monkeypatch):
+        # force multiple blocks and tasks out of small inputs
+        for fmt in _parallel.formats.values():
+            monkeypatch.setattr(fmt, 'compress_blocksize', lambda level: 64 * 1024)
+        monkeypatch.setattr(_parallel, '_min_task', 1)
+
+    @pytest.mark.parametrize('fmt', _parallel.formats)
+    def test_data(self, fmt):
+        compressed = _parallel.compress_data(fmt, self.data, 6)
+        # output is readable by any standard decompressor
+        assert self.decompressors[fmt](compressed) == self.data
+        assert _parallel.decompress_data(fmt, compressed) == self.data
+        units = list(_parallel.formats[fmt].split(io.BytesIO(compressed)))
+        assert len(units) > 1
+        assert all(isinstance(x, bytes) for x in units)
+
+    @pytest.mark.parametrize('fmt', _parallel.formats)
+    def test_empty(self, fmt):
+        compressed = _parallel.compress_data(fmt, b'', 6)
+        assert self.decompressors[fmt](compressed) == b''
+        assert _parallel.decompress_data(fmt, compressed) == b''
+
+    @pytest.mark.parametrize('fmt', _parallel.formats)
+    def test_serial_fallback(self, fmt):
+        # regular single stream data can't be split, but is still handled
+        compressed = self.compressors[fmt](self.data)
+        assert _parallel.decompress_data(fmt, compressed) == self.data
+        # as is data concatenated after splittable units
+        compressed = _parallel.compress_data(fmt, self.data, 6) + compressed
+        assert _parallel.decompress_data(fmt, compressed) == self.data * 2
+
+    @pytest.mark.parametrize('fmt', _parallel.formats)
+    def test_truncated(self, fmt):
+        compressed = _parallel.compress_data(fmt, self.data, 6)
+        with pytest.raises(EOFError):
+            _parallel.decompress_data(fmt, compressed[:len(compressed) // 2])
+
+    @pytest.mark.parametrize('fmt', _parallel.formats)
+    def test_handles(self, fmt, tmp_path):
+        path = str(tmp_path / 'file')
+        with _parallel.compress_handle(fmt, path, 6) as f:
+            for i in range(0, len(self.data), 10000):
+                f.write(self.data[i:i + 10000])
+        with open(path, 'rb') as f:
+            assert self.decompressors[fmt](f.read()) == self.data
+        with _parallel.decompress_handle(fmt, path) as f:
+            assert f.read(10) == self.data[:10]
+            assert f.read() == self.data[10:]
+        # file objects are left open
+        with open(path, 'rb') as fileobj:
+            with _parallel.decompress_handle(fmt, fileobj) as f:
+                assert f.read() == self.data
+            assert not fileobj.closed
+
+    def test_xz_streams(self):
+        # stream padding between and after streams is skipped
+        streams = lzma.compress(self.data[:1000]) + b'\x00' * 4 + lzma.compress(self.data)
+        units = list(_parallel.formats['xz'].split(io.BytesIO(streams + b'\x00' * 8)))
+        assert len(units) == 2
+        assert b''.join(lzma.decompress(x) for x in units) == self.data[:1000] + self.data
+
+    @pytest.mark.skipif(not have_binary('xz'), reason='missing required binary: xz')
+    def test_xz_blocks(self, tmp_path):
+        # multiple blocks within a single stream, as written by threaded xz
+        path = tmp_path / 'file'
+        path.write_bytes(self.data)
+        subprocess.run(['xz', '-T2', '--block-size=100KiB', str(path)], check=True)
+        compressed = (tmp_path / 'file.xz').read_bytes()
+        units = list(_parallel.formats['xz'].split(io.BytesIO(compressed)))
+        assert len(units) > 1
+        assert _parallel.decompress_data('xz', compressed) == self.data
+
+    def test_bzip2_transform(self):
+        compressed = compression.compress_data('bzip2', self.data, parallelize=True)
+        assert bz2.decompress(compressed) == self.data
+        assert compression.decompress_data(
+            'bzip2', compressed, parallelize=True) == self.data
+
+    @pytest.mark.parametrize('fmt', _parallel.formats)
+    def test_max_output(self, fmt, monkeypatch):
+        # tasks decompressing to more than the limit are streamed instead
+        monkeypatch.setattr(_parallel, '_max_output', 1000)
+        streamed = []
+        iter_units = _parallel._Format.iter_units
+        monkeypatch.setattr(
+            _parallel._Format, 'iter_units',
+            lambda self, units: streamed.append(len(units)) or iter_units(self, units))
+        compressed = _parallel.compress_data(fmt, self.data, 6)
+        assert _parallel.decompress_data(fmt, compressed) == self.data
+        assert streamed
+        with pytest.raises(EOFError):
+            _parallel.decompress_data(fmt, compressed[:len(compressed) // 2])
+
+    def test_bzip2_single_stream(self):
+        # a single stream isn't held in memory as one unit
+        units = list(_parallel.formats['bzip2'].split(io.BytesIO(bz2.compress(self.data))))
+        assert len(units) == 1
+        assert isinstance(units[0], _parallel._Serial)
+
+    @pytest.mark.skipif(not have_binary('bzip2'), reason='missing required binary: bzip2')
+    def test_bzip2_lbzip2(self, tmp_path, monkeypatch):
+        # lbzip2 handles data that can't be split in-process
+        log = tmp_path / 'log'
+        lbzip2 = tmp_path / 'lbzip2'
+        lbzip2.write_text(f'#!/bin/sh\necho "$@" >> {log}\nexec {find_binary("bzip2")} -dc\n')
+        lbzip2.chmod(0o755)
+        find_binary_cached = _bzip2.process.find_binary_cached
+        monkeypatch.setattr(
+            _bzip2.process, 'find_binary_cached',
+            lambda x: str(lbzip2) if x == 'lbzip2' else find_binary_cached(x))
+        monkeypatch.setattr(_bzip2, 'cpu_count', lambda: 4)
+        compressed = bz2.compress(self.data)
+        assert compression.decompress_data(
+            'bzip2', compressed, parallelize=True) == self.data
+        assert log.read_text() == '-dc -n4\n'
+        path = str(tmp_path / 'file.bz2')
+        with open(path, 'wb') as f:
+            f.write(compressed)
+        with compression.decompress_handle('bzip2', path, parallelize=True) as f:
+            assert f.read(10) == self.data[:10]
+            assert f.read() == self.data[10:]
+        with pytest.raises(EOFError):
+            compression.decompress_data(
+                'bzip2', compressed[:len(compressed) // 2], parallelize=True)
+
+        # splittable data is still decompressed in-process
+        log.unlink()
+        compressed = _parallel.compress_data('bzip2', self.data)
+        assert compression.decompress_data(
+            'bzip2', compressed, parallelize=True) == self.data
+        assert not log.exists()
+
+
+class TestTransforms:
+
+    data = os.urandom(10000) + b'snakeoil' * 10000
+
+    @pytest.mark.parametrize('parallelize', (False, True))
+    @pytest.mark.parametrize('fmt', sorted(compression._transforms))
+    def test_data(self, fmt, parallelize):
+        compressed = compression.compress_data(fmt, self.data, parallelize=parallelize)
+        assert compressed != self.data
+        assert self.data == compression.decompress_data(
+            fmt, compressed, parallelize=parallelize)
+        # parallel and serial output are interchangeable
+        assert self.data == compression.decompress_data(
+            fmt, compressed, parallelize=not parallelize)
+
+    @pytest.mark.parametrize('parallelize', (False, True))
+    @pytest.mark.parametrize('fmt', sorted(set(compression._transforms) - {'bzip2'}))
+    def test_handles(self, fmt, parallelize, tmp_path):
+        path = str(tmp_path / 'file')
+        with compression.compress_handle(fmt, path, parallelize=parallelize) as f:
+            f.write(self.data[:5000])
+            f.write(self.data[5000:])
+        with compression.decompress_handle(fmt, path, parallelize=parallelize) as f:
+            assert f.read() == self.data
+
+        # file objects and descriptors are left open
+        with open(path, 'wb') as fileobj:
+            with compression.compress_handle(fmt, fileobj, parallelize=parallelize) as f:
+                f.write(self.data)
+            assert not fileobj.closed
+        with open(path, 'rb') as fileobj:
+            with compression.decompress_handle(fmt, fileobj.fileno(), parallelize=parallelize) as f:
+                assert f.read() == self.data
+            os.fstat(fileobj.fileno())
+
+    def test_optional_zstd(self):
+        try:
+            import zstandard
+        except ImportError:
+            assert 'zstd' not in compression._transforms
+        else:
+            assert 'zstd' in compression._transforms
+
+
+class TestSeekable:
+
+    data = os.urandom(100000) + b'snakeoil' * 100000 + os.urandom(100000)
+
+    def check(self, path, **kwargs):
+        with compression.open_seekable(path, **kwargs) as f:
+            assert f.seekable()
+            assert f.read() == self.data
+            assert f.seek(0, io.SEEK_END) == len(self.data)
+            for offset in (500000, 10, len(self.data) - 5, 300000, 0, 299990, len(self.data)):
+                f.seek(offset)
+                assert f.read(100) == self.data[offset:offset + 100]
+            f.seek(5)
+            f.seek(1000, io.SEEK_CUR)
+            assert f.read(10) == self.data[1005:1015]
+
+    def test_gzip(self, tmp_path):
+        path = str(tmp_path / 'file.gz')
+        with open(path, 'wb') as f:
+            f.write(gzip.compress(self.data))
+        self.check(path, spacing=100000)
+        reader = _seekable.SeekableReader(path, spacing=100000)
+        # decompressor snapshots are taken within the member
+        assert len(reader._offsets) > 5
+        reader.close()
+
+    def test_gzip_members(self, tmp_path):
+        path = str(tmp_path / 'file.gz')
+        with open(path, 'wb') as f:
+            for i in range(0, len(self.data), 65280):
+                f.write(gzip.compress(self.data[i:i + 65280]))
+        self.check(path)
+
+    def test_bzip2(self, tmp_path):
+        path = str(tmp_path / 'file.bz2')
+        with open(path, 'wb') as f:
+            f.write(bz2.compress(self.data, 1))
+        reader = _seekable.SeekableReader(path)
+        assert reader.format == 'bzip2'
+        assert len(reader._codec.blocks) > 1
+        reader.close()
+        self.check(path)
+
+    @pytest.mark.skipif(not have_binary('xz'), reason='missing required binary: xz')
+    def test_xz(self, tmp_path):
+        path = tmp_path / 'file'
+        path.write_bytes(self.data)
+        subprocess.run(['xz', '-T2', '--block-size=100KiB', str(path)], check=True)
+        path = str(tmp_path / 'file.xz')
+        reader = _seekable.SeekableReader(path)
+        assert len(reader._codec.blocks) > 1
+        reader.close()
+        self.check(path)
+
+    @pytest.mark.parametrize(('fmt', 'compress'), (
+        ('gzip', gzip.compress),
+        ('bzip2', bz2.compress),
+        ('xz', lzma.compress),
+    ))
+    def test_single_unit(self, tmp_path, fmt, compress):
+        path = str(tmp_path / 'file')
+        with open(path, 'wb') as f:
+            f.write(compress(self.data))
+        self.check(path)
+        with open(path, 'wb') as f:
+            f.write(compress(b''))
+        with compression.open_seekable(path, fmt) as f:
+            assert f.read() == b''
+
+    def test_index(self, tmp_path, monkeypatch):
+        path = str(tmp_path / 'file.bz2')
+        index = str(tmp_path / 'index')
+        with open(path, 'wb') as f:
+            f.write(bz2.compress(self.data, 1))
+        self.check(path, index_path=index)
+        assert os.path.exists(index)
+
+        # cached indexes are reused
+        def build(*args):
+            raise AssertionError('index rebuilt')
+        monkeypatch.setattr(_seekable._Bzip2Codec, 'build', build)
+        self.check(path, index_path=index)
+        monkeypatch.undo()
+
+        # and rebuilt when the file changes
+        self.data = self.data[::-1]
+        with open(path, 'wb') as f:
+            f.write(bz2.compress(self.data, 1))
+        os.utime(path, ns=(0, 0))
+        self.check(path, index_path=index)
+
+        # as are corrupt indexes
+        with open(index, 'w') as f:
+            f.write('{')
+        self.check(path, index_path=index)
+
+    def test_truncated(self, tmp_path):
+        path = str(tmp_path / 'file.gz')
+        with open(path, 'wb') as f:
+            f.write(gzip.compress(self.data)[:-1000])
+        with pytest.raises(EOFError):
+            compression.open_seekable(path)
+
+    def test_unsupported(self, tmp_path):
+        path = tmp_path / 'file'
+        path.write_bytes(b'\x00' * 100)
+        with pytest.raises(ValueError):
+            compression.open_seekable(str(path))
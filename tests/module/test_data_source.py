@@ -1,8 +1,9 @@
 from functools import partial
+import os
 
 import pytest
 
-from snakeoil import compression, data_source
+from snakeoil import chksum, compression, data_source
 from snakeoil.osutils import pjoin
 from snakeoil.test.fixtures import TempDir
 
@@ -84,6 +85,24 @@ class TestDataSource(TempDir):
 
         self.assertContents(reader, writer)
 
+    def test_transfer_chksums(self):
+        # chksums cover exactly the data that was copied
+        data = self._mk_data()
+        chfs = ('md5', 'sha1', 'size')
+        reader = self.get_obj(data=data)
+        writer = data_source.data_source(b'', mutable=True)
+        result = reader.transfer_to_data_source(writer, chksum_types=chfs)
+        assert result == chksum.get_chksums(writer, *chfs)
+        assert reader.transfer_to_data_source(writer) is None
+
+        path = pjoin(self.dir, 'transfer_chksums')
+        assert reader.transfer_to_path(path, chfs) == chksum.get_chksums(path, *chfs)
+
+        reader_f, writer_f = reader.bytes_fileobj(), writer.bytes_fileobj(True)
+        result = data_source.transfer_between_files(reader_f, writer_f, chksum_types=chfs)
+        reader_f.close(), writer_f.close()
+        assert result == chksum.get_chksums(writer, *chfs)
+
     def test_transfer_data_between_files(self):
         data = self._mk_data()
         reader = self.get_obj(data=data)
@@ -154,6 +173,94 @@ class TestBz2Source(TestDataSource):
         f.close()
 
 
+class TestCompressedSource(TestDataSource):
+
+    compressor_type = 'gzip'
+
+    def get_obj(self, data="foonani", mutable=False, compressor_type=None):
+        self.fp = pjoin(self.dir, "compressedsource.test")
+        if isinstance(data, str):
+            data = data.encode()
+        with open(self.fp, 'wb') as f:
+            f.write(compression.compress_data(self.compressor_type, data))
+        # the format is detected from the file's contents
+        return data_source.compressed_source(
+            self.fp, mutable=mutable, compressor_type=compressor_type)
+
+    def test_transfer_to_path(self):
+        # the compressed file is copied as is
+        reader = self.get_obj(data=self._mk_data())
+        writer = data_source.compressed_source(pjoin(self.dir, 'transfer_to_path'))
+        reader.transfer_to_path(writer.path)
+        self.assertContents(reader, writer)
+
+    def test_streaming(self):
+        data = self._mk_data(1000000).encode()
+        obj = self.get_obj(data=data)
+        f = obj.bytes_fileobj()
+        assert isinstance(f, data_source.compressed_ro_file)
+        assert f.read(10) == data[:10]
+        assert f.read() == data[10:]
+        f.close()
+        f = obj.text_fileobj()
+        assert f.readline() == data.decode()
+        f.close()
+
+    def test_writable(self):
+        obj = self.get_obj(data="foonani", mutable=True)
+        with obj.bytes_fileobj(True) as f:
+            f.seek(0, 2)
+            f.write("\xf2".encode())
+        with obj.text_fileobj() as f:
+            # utf8 by default
+            assert f.read() == "foonani\xf2"
+        assert compression.detect_compressor(self.fp) == self.compressor_type
+
+    def test_creation(self):
+        path = pjoin(self.dir, "created")
+        obj = data_source.compressed_source(path, mutable=True)
+        with pytest.raises(ValueError):
+            obj.bytes_fileobj(True)
+        obj = data_source.compressed_source(
+            path, mutable=True, compressor_type=self.compressor_type)
+        with obj.text_fileobj(True) as f:
+            assert f.read() == ''
+            f.write('foonani')
+        with data_source.compressed_source(path).bytes_fileobj() as f:
+            assert f.read() == b'foonani'
+
+    truncation_errors = True
+
+    def test_corrupt(self):
+        obj = self.get_obj(data=self._mk_data().encode())
+        with open(self.fp, 'r+b') as f:
+            f.truncate(os.path.getsize(self.fp) // 2)
+        f = obj.bytes_fileobj()
+        if self.truncation_errors:
+            with pytest.raises(f.exceptions):
+                f.read()
+        f.close()
+        with open(self.fp, 'wb') as f:
+            f.write(b'foonani')
+        with pytest.raises(ValueError):
+            obj.bytes_fileobj()
+
+
+class TestCompressedSourceBzip2(TestCompressedSource):
+    compressor_type = 'bzip2'
+
+
+class TestCompressedSourceXz(TestCompressedSource):
+    compressor_type = 'xz'
+
+
+@pytest.mark.skipif('zstd' not in compression._transforms, reason='zstandard not installed')
+class TestCompressedSourceZstd(TestCompressedSource):
+    compressor_type = 'zstd'
+    # zstandard's stream reader returns truncated frames' data silently
+    truncation_errors = False
+
+
 class Test_invokable_data_source(TestDataSource):
 
     supports_mutable = False
@@ -2,13 +2,14 @@ import errno
 import mmap
 import os
 import time
+from unittest import mock
 
 pjoin = os.path.join
 
 import pytest
 
 from snakeoil import currying, fileutils, _fileutils
-from snakeoil.fileutils import AtomicWriteFile, write_file
+from snakeoil.fileutils import AtomicWriteBatch, AtomicWriteFile, write_file
 from snakeoil.test.fixtures import RandomPath, TempDir
 
 
@@ -121,6 +122,112 @@ class TestAtomicWriteFile(TempDir):
         af.close()
 
 
+class TestAtomicWriteBatch(TempDir):
+
+    def test_commit(self):
+        fp1, fp2 = pjoin(self.dir, "target1"), pjoin(self.dir, "target2")
+        write_file(fp1, "w", "me")
+        with AtomicWriteBatch(self.dir) as batch:
+            batch.write(fp1, "dar")
+            with batch.open(fp2) as f:
+                f.write("nani")
+            assert len(batch) == 2
+            assert fileutils.readfile_ascii(fp1) == "me"
+            assert not os.path.exists(fp2)
+        assert fileutils.readfile_ascii(fp1) == "dar"
+        assert fileutils.readfile_ascii(fp2) == "nani"
+        # the staging dir is removed
+        assert sorted(os.listdir(self.dir)) == ["target1", "target2"]
+
+    def test_rewrite(self):
+        fp = pjoin(self.dir, "target")
+        batch = AtomicWriteBatch(self.dir, binary=True, sync=False)
+        f = batch.open(fp)
+        f.write(b"foo")
+        batch.write(fp, b"dar")
+        assert len(batch) == 1
+        # the earlier handle is closed on commit without affecting the result
+        batch.commit()
+        assert f.closed
+        assert fileutils.readfile_bytes(fp) == b"dar"
+        # multiple commits are fine, but nothing more can be written
+        batch.commit()
+        with pytest.raises(ValueError):
+            batch.open(fp)
+
+    def test_perms(self):
+        fp = pjoin(self.dir, "target")
+        orig_um = os.umask(0o777)
+        try:
+            with AtomicWriteBatch(self.dir, perms=0o644) as batch:
+                batch.write(fp, "dar")
+        finally:
+            os.umask(orig_um)
+        assert os.stat(fp).st_mode & 0o4777 == 0o644
+
+    def test_discard(self):
+        fp = pjoin(self.dir, "target")
+        write_file(fp, "w", "me")
+        with pytest.raises(RuntimeError):
+            with AtomicWriteBatch(self.dir) as batch:
+                batch.write(fp, "dar")
+                raise RuntimeError
+        assert fileutils.readfile_ascii(fp) == "me"
+        assert os.listdir(self.dir) == ["target"]
+
+        batch = AtomicWriteBatch(self.dir)
+        batch.write(fp, "dar")
+        del batch
+        assert fileutils.readfile_ascii(fp) == "me"
+        assert os.listdir(self.dir) == ["target"]
+
+    def test_rollback(self):
+        fps = [pjoin(self.dir, "target%i" % i) for i in range(3)]
+        write_file(fps[0], "w", "me")
+        os.mkdir(pjoin(self.dir, "sub"))
+        batch = AtomicWriteBatch(self.dir)
+        for fp in fps:
+            batch.write(fp, "dar")
+        # renaming over a nonempty directory fails
+        batch.write(pjoin(self.dir, "sub"), "dar")
+        write_file(pjoin(self.dir, "sub", "file"), "w", "nani")
+        with pytest.raises(OSError):
+            batch.commit()
+        assert fileutils.readfile_ascii(fps[0]) == "me"
+        assert not os.path.exists(fps[1])
+        assert not os.path.exists(fps[2])
+        assert sorted(os.listdir(self.dir)) == ["sub", "target0"]
+
+    def test_rollback_backups(self):
+        # existing targets are restored via hardlinks, preserving the inode
+        fp = pjoin(self.dir, "target")
+        write_file(fp, "w", "me")
+        inode = os.stat(fp).st_ino
+        with pytest.raises(OSError):
+            with AtomicWriteBatch(self.dir) as batch:
+                batch.write(fp, "dar")
+                batch.write(pjoin(self.dir, "missing", "target"), "dar")
+        assert fileutils.readfile_ascii(fp) == "me"
+        assert os.stat(fp).st_ino == inode
+        assert os.listdir(self.dir) == ["target"]
+
+    def test_sync(self):
+        with mock.patch('snakeoil.fileutils._syncfs') as syncfs:
+            with AtomicWriteBatch(self.dir) as batch:
+                for i in range(10):
+                    batch.write(pjoin(self.dir, "target%i" % i), "dar")
+            # once before the renames and once after, regardless of batch size
+            assert syncfs.call_count == 2
+            syncfs.reset_mock()
+            with AtomicWriteBatch(self.dir, sync=False) as batch:
+                batch.write(pjoin(self.dir, "target"), "dar")
+            assert not syncfs.called
+
+    def test_syncfs(self):
+        # the real thing shouldn't fail
+        fileutils._syncfs(self.dir)
+
+
 def cpy_setup_class(scope, func_name):
     if getattr(fileutils, 'native_%s' % func_name) \
         is getattr(fileutils, func_name):
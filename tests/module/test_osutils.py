@@ -102,6 +102,281 @@ class TestCPyReaddir(TestNativeReaddir):
     module = _readdir
 
 
+class TestNativeReaddirStat(ReaddirCommon):
+
+    def test_readdir_stat_arrays(self):
+        self.setup()
+        os.symlink('file', pjoin(self.dir, 'link'))
+        with open(pjoin(self.dir, 'file'), 'w') as f:
+            f.write('data')
+        names, modes, inodes, sizes, mtimes = self.module.readdir_stat_arrays(self.dir)
+        assert sorted(names) == ['dir', 'fifo', 'file', 'link']
+        assert len(names) == len(modes) == len(inodes) == len(sizes) == len(mtimes)
+        for i, name in enumerate(names):
+            st = os.lstat(pjoin(self.dir, name))
+            assert (modes[i], inodes[i], sizes[i], mtimes[i]) == (
+                st.st_mode, st.st_ino, st.st_size, st.st_mtime_ns)
+        assert stat.S_ISLNK(modes[names.index('link')])
+
+    def test_empty(self):
+        self.setup()
+        assert self.module.readdir_stat_arrays(self.subdir)[0] == []
+
+    def test_missing(self):
+        self.setup()
+        self._test_missing([self.module.readdir_stat_arrays])
+        with pytest.raises(NotADirectoryError):
+            self.module.readdir_stat_arrays(pjoin(self.dir, 'file'))
+
+
+try:
+    from snakeoil.osutils import _readdir_stat
+except ImportError:
+    _readdir_stat = None
+
+
+@pytest.mark.skipif(_readdir_stat is None, reason="extension isn't compiled")
+class TestCPyReaddirStat(TestNativeReaddirStat):
+    module = _readdir_stat
+
+
+class TestReaddirStat(TempDir):
+
+    def test_readdir_stat(self):
+        touch(pjoin(self.dir, 'file'))
+        os.mkdir(pjoin(self.dir, 'dir'))
+        result = osutils.readdir_stat(self.dir)
+        assert isinstance(result, osutils.DirStat)
+        assert len(result) == 2
+        entries = {x.name: x for x in result}
+        assert entries == {x.name: x for x in (result[0], result[1])}
+        st = os.lstat(pjoin(self.dir, 'dir'))
+        assert entries['dir'] == (
+            'dir', st.st_mode, st.st_ino, st.st_size, st.st_mtime_ns)
+        assert entries['file'].size == 0
+        assert stat.S_ISREG(entries['file'].mode)
+
+
+class TestListdirCache(TempDir):
+
+    @pytest.fixture(autouse=True, params=(True, False), ids=('inotify', 'stat'))
+    def _setup(self, request):
+        self.cache = osutils.ListdirCache(inotify=request.param)
+        if request.param and self.cache._inotify is None:
+            pytest.skip('inotify unavailable')
+        # directories modified by the test are otherwise never trusted
+        self.cache.racy_window = -1
+        yield
+        self.cache.close()
+
+    def populate(self):
+        os.mkdir(pjoin(self.dir, 'dir'))
+        touch(pjoin(self.dir, 'file'))
+        os.mkfifo(pjoin(self.dir, 'fifo'))
+        os.symlink('file', pjoin(self.dir, 'file_link'))
+        os.symlink('dir', pjoin(self.dir, 'dir_link'))
+        os.symlink('missing', pjoin(self.dir, 'broken'))
+
+    def check(self):
+        for follow in (True, False):
+            assert sorted(self.cache.listdir_files(self.dir, follow)) == \
+                sorted(native_readdir.listdir_files(self.dir, follow))
+            assert sorted(self.cache.listdir_dirs(self.dir, follow)) == \
+                sorted(native_readdir.listdir_dirs(self.dir, follow))
+        assert sorted(self.cache.listdir(self.dir)) == sorted(os.listdir(self.dir))
+
+    def test_listings(self):
+        self.populate()
+        self.check()
+        assert (self.cache.hits, self.cache.misses) == (4, 1)
+        # results are copies
+        self.cache.listdir(self.dir).append('foo')
+        assert 'foo' not in self.cache.listdir(self.dir)
+
+    def test_invalidation(self):
+        self.populate()
+        self.check()
+        touch(pjoin(self.dir, 'new'))
+        self.check()
+        assert self.cache.misses == 2
+        os.rename(pjoin(self.dir, 'new'), pjoin(self.dir, 'renamed'))
+        self.check()
+        os.unlink(pjoin(self.dir, 'renamed'))
+        os.rmdir(pjoin(self.dir, 'dir'))
+        self.check()
+        assert self.cache.misses == 4
+        # modifying file contents doesn't invalidate listings
+        with open(pjoin(self.dir, 'file'), 'w') as f:
+            f.write('data')
+        self.check()
+        assert self.cache.misses == 4
+
+        self.cache.invalidate(self.dir)
+        self.check()
+        assert self.cache.misses == 5
+        self.cache.clear()
+        self.check()
+        assert self.cache.misses == 6
+
+    def test_ancestor_renamed(self):
+        # the path now refers to a different directory, without the watched
+        # one seeing any event
+        path = pjoin(self.dir, 'a', 'b')
+        os.makedirs(path)
+        touch(pjoin(path, 'old'))
+        assert self.cache.listdir(path) == ['old']
+        os.rename(pjoin(self.dir, 'a'), pjoin(self.dir, 'moved'))
+        os.makedirs(path)
+        touch(pjoin(path, 'new'))
+        assert self.cache.listdir(path) == ['new']
+        assert self.cache.listdir(pjoin(self.dir, 'moved', 'b')) == ['old']
+
+    def test_racy(self):
+        self.populate()
+        self.cache.racy_window = 3600
+        self.cache.listdir(self.dir)
+        self.cache.listdir(self.dir)
+        if self.cache._inotify is None:
+            # recently modified directories are reread via stat validation
+            assert self.cache.misses == 2
+        else:
+            assert self.cache.misses == 1
+
+    def test_lru(self):
+        self.cache.maxsize = 2
+        for name in ('a', 'b', 'c'):
+            os.mkdir(pjoin(self.dir, name))
+        self.cache.listdir(pjoin(self.dir, 'a'))
+        self.cache.listdir(pjoin(self.dir, 'b'))
+        self.cache.listdir(pjoin(self.dir, 'a'))
+        self.cache.listdir(pjoin(self.dir, 'c'))
+        assert self.cache.misses == 3
+        # b was least recently used
+        self.cache.listdir(pjoin(self.dir, 'a'))
+        assert self.cache.misses == 3
+        self.cache.listdir(pjoin(self.dir, 'b'))
+        assert self.cache.misses == 4
+        assert len(self.cache._cache) == 2
+        if self.cache._inotify is not None:
+            assert len(self.cache._watched) == 2
+
+    def test_missing(self):
+        with pytest.raises(FileNotFoundError):
+            self.cache.listdir(pjoin(self.dir, 'missing'))
+        touch(pjoin(self.dir, 'file'))
+        with pytest.raises(NotADirectoryError):
+            self.cache.listdir_files(pjoin(self.dir, 'file'))
+        assert not self.cache._cache
+        assert not self.cache._watched
+
+    def test_watch_failure(self, monkeypatch):
+        if self.cache._inotify is None:
+            pytest.skip('inotify specific')
+
+        def add_watch(path):
+            raise OSError(errno.ENOSPC, 'no watches left')
+        monkeypatch.setattr(self.cache._inotify, 'add_watch', add_watch)
+        # falls back to stat validation
+        self.populate()
+        self.check()
+        touch(pjoin(self.dir, 'new'))
+        self.check()
+        assert (self.cache.hits, self.cache.misses) == (8, 2)
+
+
+class TestScandirTree(TempDir):
+
+    def setup(self):
+        for i in range(20):
+            os.makedirs(pjoin(self.dir, f'dir{i}', 'sub', 'deeper'))
+            touch(pjoin(self.dir, f'dir{i}', f'file{i}'))
+            touch(pjoin(self.dir, f'dir{i}', 'sub', 'deeper', 'file'))
+        touch(pjoin(self.dir, 'top'))
+        os.symlink('dir0', pjoin(self.dir, 'link'))
+
+    def expected(self, prune=lambda path: False, followlinks=False):
+        result = {}
+        for path, dirs, files in os.walk(self.dir, followlinks=followlinks):
+            result[path] = (sorted(dirs), sorted(files))
+            dirs[:] = [x for x in dirs if not prune(pjoin(path, x))]
+        return result
+
+    @pytest.mark.parametrize('jobs', (None, 1, 4))
+    def test_scandir_tree(self, jobs):
+        self.setup()
+        seen = []
+        for path, entries in osutils.scandir_tree(self.dir, jobs=jobs):
+            # parents are yielded before their subdirectories
+            assert path == self.dir or os.path.dirname(path) in seen
+            assert sorted(x.name for x in entries) == sorted(os.listdir(path))
+            assert all(isinstance(x, os.DirEntry) for x in entries)
+            seen.append(path)
+        assert len(seen) == len(set(seen)) == 61
+        assert pjoin(self.dir, 'link') not in seen
+
+    def test_walk(self):
+        self.setup()
+        result = {path: (sorted(dirs), sorted(files))
+                  for path, dirs, files in osutils.walk(self.dir)}
+        assert result == self.expected()
+        result = {path: (sorted(dirs), sorted(files))
+                  for path, dirs, files in osutils.walk(self.dir, follow_symlinks=True)}
+        assert result == self.expected(followlinks=True)
+
+    def test_prune(self):
+        self.setup()
+        pruned = []
+
+        def prune(entry):
+            pruned.append(entry.path)
+            return entry.name == 'sub'
+
+        result = {path: (sorted(dirs), sorted(files))
+                  for path, dirs, files in osutils.walk(self.dir, prune=prune)}
+        # pruned directories are still listed in their parent
+        assert result == self.expected(lambda path: path.endswith('/sub'))
+        assert pjoin(self.dir, 'dir3', 'sub') in pruned
+        assert pjoin(self.dir, 'dir3', 'sub', 'deeper') not in pruned
+
+    @pytest.mark.parametrize('jobs', (1, 4))
+    @pytest.mark.parametrize('exc', (FileNotFoundError, ValueError))
+    def test_prune_errors(self, jobs, exc):
+        # prune errors are reraised rather than passed to onerror, even
+        # with sibling directories still pending
+        self.setup()
+
+        def prune(entry):
+            if entry.path == pjoin(self.dir, 'dir5', 'sub'):
+                raise exc(entry.path)
+            return False
+
+        errors = []
+        with pytest.raises(exc):
+            list(osutils.walk(self.dir, prune=prune, jobs=jobs, onerror=errors.append))
+        assert errors == []
+
+    def test_errors(self):
+        self.setup()
+        missing = pjoin(self.dir, 'missing')
+        assert list(osutils.scandir_tree(missing)) == []
+        errors = []
+        assert list(osutils.scandir_tree(missing, onerror=errors.append)) == []
+        assert len(errors) == 1 and isinstance(errors[0], FileNotFoundError)
+
+        def onerror(e):
+            raise e
+        with pytest.raises(NotADirectoryError):
+            list(osutils.scandir_tree(pjoin(self.dir, 'top'), onerror=onerror))
+
+    def test_early_exit(self):
+        self.setup()
+        it = osutils.scandir_tree(self.dir, jobs=2)
+        path, entries = next(it)
+        assert path == self.dir
+        # pending scans are cancelled and the pool shut down
+        it.close()
+
+
 class TestEnsureDirs(TempDir):
 
     def check_dir(self, path, uid, gid, mode):
@@ -227,6 +502,94 @@ class TestEnsureDirs(TempDir):
         self.check_dir(path, os.geteuid(), os.getegid(), 0o777)
 
 
+class TestEnsureDirsBulk(TempDir):
+
+    def paths(self, root):
+        return [pjoin(root, f'dir{i % 3}', f'sub{i}', 'leaf') for i in range(12)] + [
+            pjoin(root, 'dir1'), pjoin(root, 'dir1', 'sub1', '..', 'sub1'),
+            pjoin(root, 'existing', 'new'), pjoin(root, 'existing'),
+            pjoin(root, 'file'), pjoin(root, 'file', 'sub'),
+        ]
+
+    def prepare(self, root):
+        os.makedirs(pjoin(root, 'existing'))
+        os.chmod(pjoin(root, 'existing'), 0o700)
+        touch(pjoin(root, 'file'))
+
+    def tree(self, root):
+        return {
+            os.path.relpath(pjoin(path, name), root): stat.S_IMODE(os.lstat(pjoin(path, name)).st_mode)
+            for path, dirs, files in os.walk(root) for name in dirs + files}
+
+    @pytest.mark.parametrize('jobs', (1, 4))
+    @pytest.mark.parametrize(('mode', 'minimal'), ((0o777, True), (0o750, False), (0o500, True)))
+    def test_matches_ensure_dirs(self, jobs, mode, minimal):
+        serial = pjoin(self.dir, 'serial')
+        bulk = pjoin(self.dir, 'bulk')
+        for root in (serial, bulk):
+            self.prepare(root)
+        paths = self.paths(serial)
+        expected = [x for x in sorted(paths) if not osutils.ensure_dirs(x, mode=mode, minimal=minimal)]
+        failed = osutils.ensure_dirs_bulk(self.paths(bulk), mode=mode, minimal=minimal, jobs=jobs)
+        # in the order given
+        assert failed == [pjoin(bulk, 'file'), pjoin(bulk, 'file', 'sub')]
+        assert sorted(os.path.relpath(x, bulk) for x in failed) == \
+            sorted(os.path.relpath(x, serial) for x in expected)
+        assert self.tree(bulk) == self.tree(serial)
+        # allow cleanup
+        for root in (serial, bulk):
+            for path, dirs, files in os.walk(root):
+                for name in dirs:
+                    os.chmod(pjoin(path, name), 0o700)
+
+    def test_single_creation(self):
+        paths = [pjoin(self.dir, 'a', 'b', f'c{i}') for i in range(10)]
+        with mock.patch('snakeoil.osutils.os.mkdir', wraps=os.mkdir) as mkdir, \
+                mock.patch('snakeoil.osutils.os.stat', wraps=os.stat) as stat_:
+            assert osutils.ensure_dirs_bulk(paths) == []
+        created = [x[0][0] for x in mkdir.call_args_list]
+        assert sorted(created) == sorted([pjoin(self.dir, 'a'), pjoin(self.dir, 'a', 'b')] + paths)
+        # each path component is stat'd once
+        stat_paths = [x[0][0] for x in stat_.call_args_list]
+        assert len(stat_paths) == len(set(stat_paths))
+        assert all(os.path.isdir(x) for x in paths)
+
+    def test_empty(self):
+        assert osutils.ensure_dirs_bulk([]) == []
+
+    @pytest.mark.parametrize('jobs', (1, 4))
+    def test_mkdir_failing(self, jobs):
+        paths = [pjoin(self.dir, 'a', 'b'), pjoin(self.dir, 'c')]
+        with mock.patch('snakeoil.osutils.os.mkdir') as mkdir:
+            mkdir.side_effect = OSError(30, 'Read-only file system')
+            assert osutils.ensure_dirs_bulk(paths, jobs=jobs) == paths
+
+    def test_chmod_failing(self):
+        paths = [pjoin(self.dir, 'a', 'b'), pjoin(self.dir, 'a', 'c'), pjoin(self.dir, 'd')]
+        with mock.patch('snakeoil.osutils.os.chmod') as chmod:
+            chmod.side_effect = OSError(5, 'Input/output error')
+            # resetting the parents' temporary perms fails
+            assert osutils.ensure_dirs_bulk(paths, mode=0o500, jobs=4) == paths
+
+    @pytest.mark.parametrize('jobs', (1, 4))
+    def test_chmod_failing_parent(self, jobs):
+        # every target below a directory whose perms can't be reset fails,
+        # not just the one that created it
+        parent = pjoin(self.dir, 'a')
+        paths = [pjoin(parent, 'b'), pjoin(self.dir, 'a-b'), pjoin(parent, 'c', 'd'), pjoin(self.dir, 'e')]
+
+        real_chmod = os.chmod
+
+        def chmod(path, mode):
+            if path == parent:
+                raise OSError(5, 'Input/output error')
+            real_chmod(path, mode)
+
+        with mock.patch('snakeoil.osutils.os.chmod', side_effect=chmod):
+            assert osutils.ensure_dirs_bulk(paths, mode=0o500, jobs=jobs) == \
+                [pjoin(parent, 'b'), pjoin(parent, 'c', 'd')]
+
+
 class TestAbsSymlink(TempDir):
 
     def test_abssymlink(self):
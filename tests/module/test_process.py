@@ -63,6 +63,111 @@ class TestFindBinary(TempDir):
             process.find_binary(self.dir)
 
 
+class TestBinaryCache:
+
+    script = "findpath-test.sh"
+    age = 100
+
+    def make_binary(self, path, mode=0o750):
+        touch(str(path))
+        os.chmod(str(path), mode)
+        # age the directory past the racy window so its listing is cached,
+        # with a distinct mtime for each change
+        self.age += 1
+        mtime = time.time() - self.age
+        os.utime(str(path.parent), (mtime, mtime))
+
+    def test_find(self, tmp_path):
+        cache = process.BinaryCache()
+        cache.ttl = 0
+        fp = tmp_path / self.script
+        paths = [str(tmp_path), '/nonexistent']
+        with pytest.raises(process.CommandNotFound):
+            cache.find(self.script, paths=paths)
+        assert cache.find(self.script, paths=paths, fallback='foo') == 'foo'
+        self.make_binary(fp)
+        assert cache.find(self.script, paths=paths) == str(fp)
+        # absolute paths are checked directly
+        assert cache.find(str(fp)) == str(fp)
+
+        # not executable binaries and directories aren't matched
+        os.chmod(str(fp), 0o640)
+        with pytest.raises(process.CommandNotFound):
+            cache.find(self.script, paths=paths)
+        (tmp_path / 'dir').mkdir()
+        with pytest.raises(process.CommandNotFound):
+            cache.find('dir', paths=paths)
+
+    def test_cached_listing(self, tmp_path):
+        cache = process.BinaryCache()
+        cache.ttl = 0
+        self.make_binary(tmp_path / self.script)
+        paths = [str(tmp_path)]
+        with mock.patch('os.listdir', wraps=os.listdir) as listdir:
+            for _ in range(3):
+                assert cache.find(self.script, paths=paths)
+                with pytest.raises(process.CommandNotFound):
+                    cache.find('missing', paths=paths)
+            assert listdir.call_count == 1
+
+            # directory changes invalidate the listing
+            self.make_binary(tmp_path / 'new')
+            assert cache.find('new', paths=paths) == str(tmp_path / 'new')
+            assert listdir.call_count == 2
+
+            cache.clear()
+            assert cache.find('new', paths=paths)
+            assert listdir.call_count == 3
+
+    def test_racy(self, tmp_path):
+        # recently modified directories are relisted
+        cache = process.BinaryCache()
+        cache.ttl = 0
+        paths = [str(tmp_path)]
+        with pytest.raises(process.CommandNotFound):
+            cache.find(self.script, paths=paths)
+        fp = tmp_path / self.script
+        touch(str(fp))
+        os.chmod(str(fp), 0o750)
+        assert cache.find(self.script, paths=paths) == str(fp)
+
+    def test_ttl(self, tmp_path):
+        cache = process.BinaryCache()
+        cache.ttl = 3600
+        self.make_binary(tmp_path / self.script)
+        paths = [str(tmp_path)]
+        with mock.patch('os.stat', wraps=os.stat) as stat:
+            assert cache.find(self.script, paths=paths)
+            calls = stat.call_count
+            # directories aren't rechecked within the ttl
+            self.make_binary(tmp_path / 'new')
+            with pytest.raises(process.CommandNotFound):
+                cache.find('new', paths=paths)
+            assert cache.find(self.script, paths=paths)
+            # isfile() on the matched binary is the only stat
+            assert stat.call_count == calls + 1
+        cache.ttl = 0
+        assert cache.find('new', paths=paths)
+
+    def test_warm(self, tmp_path):
+        cache = process.BinaryCache()
+        self.make_binary(tmp_path / self.script)
+        paths = [str(tmp_path), '/nonexistent']
+        with mock.patch('os.listdir', wraps=os.listdir) as listdir:
+            assert cache.warm([self.script, 'missing'], paths=paths) == {
+                self.script: str(tmp_path / self.script),
+                'missing': None,
+            }
+            assert cache.warm(paths=paths) == {}
+            assert listdir.call_count == 1
+
+    def test_process_wide(self, tmp_path):
+        self.make_binary(tmp_path / self.script)
+        paths = [str(tmp_path)]
+        assert process.warm_binary_cache([self.script], paths=paths)[self.script]
+        assert process.find_binary_cached(self.script, paths=paths) == str(tmp_path / self.script)
+
+
 class TestIsRunning:
 
     def test_is_running(self):
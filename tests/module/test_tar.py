@@ -0,0 +1,170 @@
+import io
+import os
+
+import pytest
+
+from snakeoil import tar
+
+
+files = {
+    'a': b'foo\n',
+    'dir/b': b'bar\n' * 1000,
+    'dir/sub/c': os.urandom(100000),
+    'dir/' + 'long' * 50: b'long name\n',
+}
+
+
+def make_tar(path, mode):
+    with tar.TarFile.open(path, mode) as archive:
+        info = tar.TarInfo('dir')
+        info.type = tar.tarfile.DIRTYPE
+        archive.addfile(info)
+        for name, data in files.items():
+            info = tar.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+        info = tar.TarInfo('dir/link')
+        info.type = tar.tarfile.SYMTYPE
+        info.linkname = 'sub/c'
+        archive.addfile(info)
+        info = tar.TarInfo('hardlink')
+        info.type = tar.tarfile.LNKTYPE
+        info.linkname = 'a'
+        archive.addfile(info)
+        # later members replace earlier ones of the same name
+        info = tar.TarInfo('a')
+        info.size = 4
+        archive.addfile(info, io.BytesIO(b'new\n'))
+
+
+class TestIndexedTarFile:
+
+    @pytest.mark.parametrize(('ext', 'mode'), (
+        ('.tar', 'w'),
+        ('.tar.gz', 'w:gz'),
+        ('.tar.bz2', 'w:bz2'),
+        ('.tar.xz', 'w:xz'),
+    ))
+    def test_members(self, tmp_path, ext, mode):
+        path = str(tmp_path / f'archive{ext}')
+        make_tar(path, mode)
+        with tar.IndexedTarFile(path) as archive:
+            assert archive.getnames() == (
+                ['dir'] + list(files) + ['dir/link', 'hardlink', 'a'])
+            assert len(archive.index) == 8
+            for name, data in reversed(list(files.items())[1:]):
+                assert archive.extractfile(name).read() == data
+                assert archive.getmember(name).size == len(data)
+            assert archive.extractfile('a').read() == b'new\n'
+            # hardlinks resolve to the member they were archived after
+            assert archive.extractfile('hardlink').read() == b'foo\n'
+            assert archive.extractfile('dir/link').read() == files['dir/sub/c']
+            assert archive.extractfile('dir') is None
+            assert archive.getmember('./dir/').isdir()
+            with pytest.raises(KeyError):
+                archive.getmember('missing')
+        assert os.path.exists(f'{path}.index')
+
+    def test_links(self, tmp_path):
+        path = str(tmp_path / 'archive.tar')
+
+        def symlink(name, linkname):
+            info = tar.TarInfo(name)
+            info.type = tar.tarfile.SYMTYPE
+            info.linkname = linkname
+            archive.addfile(info)
+
+        with tar.TarFile.open(path, 'w') as archive:
+            info = tar.TarInfo('dir/file')
+            info.size = 4
+            archive.addfile(info, io.BytesIO(b'foo\n'))
+            # absolute links resolve relative to the archive root
+            symlink('other/abs', '/dir/file')
+            symlink('a', 'b')
+            symlink('b', 'a')
+            symlink('self', 'self')
+        with tar.IndexedTarFile(path) as archive:
+            assert archive.extractfile('other/abs').read() == b'foo\n'
+            # cycles don't hang
+            for name in ('a', 'b', 'self'):
+                with pytest.raises(KeyError):
+                    archive.extractfile(name)
+
+    def test_cached_index(self, tmp_path, monkeypatch):
+        path = str(tmp_path / 'archive.tar.gz')
+        index_path = str(tmp_path / 'index')
+        make_tar(path, 'w:gz')
+        tar.IndexedTarFile(path, index_path=index_path).close()
+
+        def build(*args):
+            raise AssertionError('index rebuilt')
+        with monkeypatch.context() as m:
+            m.setattr(tar.TarIndex, 'build', build)
+            with tar.IndexedTarFile(path, index_path=index_path) as archive:
+                assert archive.extractfile('dir/b').read() == files['dir/b']
+
+        # stale indexes are rebuilt
+        with tar.TarFile.open(path, 'w:gz') as archive:
+            info = tar.TarInfo('new')
+            archive.addfile(info, io.BytesIO())
+        os.utime(path, ns=(0, 0))
+        with tar.IndexedTarFile(path, index_path=index_path) as archive:
+            assert archive.getnames() == ['new']
+
+        # as are corrupt ones
+        with open(index_path, 'r+b') as f:
+            f.truncate(40)
+        with tar.IndexedTarFile(path, index_path=index_path) as archive:
+            assert archive.getnames() == ['new']
+
+    def test_unwritable_index(self, tmp_path):
+        path = str(tmp_path / 'archive.tar')
+        make_tar(path, 'w')
+        with tar.IndexedTarFile(path, index_path=str(tmp_path / 'missing' / 'index')) as archive:
+            assert archive.extractfile('dir/b').read() == files['dir/b']
+
+    def test_empty(self, tmp_path):
+        path = str(tmp_path / 'archive.tar')
+        tar.TarFile.open(path, 'w').close()
+        with tar.IndexedTarFile(path) as archive:
+            assert archive.getnames() == []
+        with tar.IndexedTarFile(path) as archive:
+            assert 'a' not in archive.index
+
+
+class TestStreamingTarFile:
+
+    @pytest.mark.parametrize('mode', ('r', 'r|*'))
+    def test_iter(self, tmp_path, mode):
+        path = str(tmp_path / 'archive.tar.gz')
+        make_tar(path, 'w:gz')
+        with tar.StreamingTarFile.open(path, mode) as archive:
+            names = []
+            for member in archive:
+                names.append(member.name)
+                assert not archive.members
+                if member.name == 'dir/b':
+                    assert archive.extractfile(member).read() == files['dir/b']
+            assert names == ['dir'] + list(files) + ['dir/link', 'hardlink', 'a']
+            with pytest.raises(tar.StreamError):
+                archive.getmembers()
+            with pytest.raises(tar.StreamError):
+                archive.getmember('a')
+
+    def test_extract(self, tmp_path):
+        path = str(tmp_path / 'archive.tar.bz2')
+        make_tar(path, 'w:bz2')
+        dest = tmp_path / 'dest'
+        with tar.StreamingTarFile.open(path, 'r|bz2') as archive:
+            for member in archive:
+                archive.extract(member, str(dest))
+        assert (dest / 'a').read_bytes() == b'new\n'
+        assert os.path.samefile(str(dest / 'hardlink'), str(dest / 'a'))
+        assert (dest / 'dir/link').read_bytes() == files['dir/sub/c']
+
+        dest = tmp_path / 'dest2'
+        with tar.StreamingTarFile.open(path, 'r|bz2') as archive:
+            archive.extractall(str(dest))
+            assert not archive.members
+        for name, data in list(files.items())[1:]:
+            assert (dest / name).read_bytes() == data